@@ -207,7 +207,11 @@ class MapVisualizer(Visualizer):
         Visualizer._init(self, map_size_pixels, map_size_meters,
                          title, 0, show_trajectory, 0, reference_trajectory=reference_trajectory)
 
-    def display(self, robot, mapbytes, vmin, vmax):
+    def display(self, robot, mapbytes, vmin, vmax, regions=None):
+        '''
+        Displays the robot and the map. If regions (row and column slices)
+        are given, only those regions of the map are redrawn.
+        '''
         x, y = self._pix2m(robot.x, robot.y)
         self._setPose(x, y, np.degrees(robot.theta))
 
@@ -216,6 +220,11 @@ class MapVisualizer(Visualizer):
         if self.img_artist is None:
             self.img_artist = self.ax.imshow(
                 mapbytes, vmin=vmin, vmax=vmax, cmap='gray_r')
+        elif regions is not None:
+            image = self.img_artist.get_array()
+            for region in regions:
+                image[region] = mapbytes[region]
+            self.img_artist.changed()
         else:
             self.img_artist.set_data(mapbytes)
 
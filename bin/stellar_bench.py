@@ -0,0 +1,815 @@
+"""
+Stellar benchmarks.
+
+Micro benchmarks for performance critical parts of stellar. Each benchmark
+is a subcommand, e.g.:
+
+    $ pipenv run python bin/stellar_bench.py inverse-model
+"""
+import argparse
+from timeit import Timer
+
+import numpy as np
+
+from stellar.cognition import mapping
+from stellar.models.gridmap import (DirtyRegions, DistanceField, MapPyramid,
+                                    QuantizedLogOddsMap, TiledGridMap)
+from stellar.perception.sensors import (RayOffsetTable, SensorArray, cast_rays,
+                                       distance_transform, sense_distance,
+                                       sphere_trace_rays)
+from stellar.simulation.data import png_to_ogm
+
+
+# Map and sonar configuration, as used by the simulation in `stellar_cli`.
+MAP_SIZE_PIXELS = 200
+SONAR_OPENING_ANGLE = np.radians(15)
+SONAR_BEARINGS = [np.radians(0), np.radians(90), np.radians(-90)]
+
+
+def measure(statement, repeat=5):
+    """Returns the best time (in seconds) of a single call to `statement`."""
+    timer = Timer(statement)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def report(name, seconds, baseline=None):
+    line = f"  {name:<28} {seconds * 1e3:10.3f} ms"
+    if baseline is not None:
+        line += f"  ({baseline / seconds:6.1f}x)"
+    print(line)
+
+
+def update_per_cell(gridmap, pose, measurement, sonar_bearing_angle, z_max):
+    """Per cell update of the occupancy grid map, used as baseline."""
+    measurement = mapping.normalize_measurement(measurement, z_max)
+    gridmap[pose[1], pose[0]] -= mapping.LOG_ODD_FREE
+
+    rows, cols = mapping.sonar_window(gridmap.shape, pose, measurement,
+                                      sonar_bearing_angle, SONAR_OPENING_ANGLE, z_max)
+    for y in range(rows.start, rows.stop):
+        for x in range(cols.start, cols.stop):
+            p = mapping.inverse_range_sensor_model(
+                (x, y), pose, sonar_bearing_angle, SONAR_OPENING_ANGLE,
+                z_max, measurement)
+            if p == -1:
+                gridmap[y, x] -= mapping.LOG_ODD_FREE
+            if p == 1:
+                gridmap[y, x] += mapping.LOG_ODD_OCCU
+
+    return np.clip(gridmap, a_max=mapping.LOG_ODD_MAX, a_min=mapping.LOG_ODD_MIN)
+
+
+def bench_inverse_model(args):
+    """Per cell vs. vectorized inverse sensor model (one tick, three sonars)."""
+    gridmap = np.zeros((MAP_SIZE_PIXELS, MAP_SIZE_PIXELS))
+    pose = (MAP_SIZE_PIXELS // 2, MAP_SIZE_PIXELS // 2, np.radians(30))
+
+    def tick(update, z_max):
+        for bearing in SONAR_BEARINGS:
+            update(gridmap, pose, z_max // 2, bearing, z_max)
+
+    def vectorized(gridmap, pose, measurement, bearing, z_max):
+        return mapping.update_occupancy_map(gridmap, pose, measurement, bearing,
+                                            SONAR_OPENING_ANGLE, z_max)
+
+    for z_max in args.z_max:
+        print(f"z_max = {z_max} cells")
+        baseline = measure(lambda: tick(update_per_cell, z_max), args.repeat)
+        report("per cell", baseline)
+        report("vectorized", measure(lambda: tick(vectorized, z_max), args.repeat),
+               baseline)
+
+
+def bench_fused_update(args):
+    """Per sonar updates with a full map clip vs. one fused in place update."""
+    measurements = [(bearing, 20) for bearing in SONAR_BEARINGS]
+
+    def per_sonar(gridmap, pose):
+        for angle, measurement in measurements:
+            gridmap = np.clip(
+                mapping.update_occupancy_map(gridmap, pose, measurement, angle,
+                                             SONAR_OPENING_ANGLE, 40),
+                a_max=mapping.LOG_ODD_MAX, a_min=mapping.LOG_ODD_MIN)
+        return gridmap
+
+    def fused(gridmap, pose):
+        mapping.fuse_measurements(gridmap, pose, measurements,
+                                  SONAR_OPENING_ANGLE, 40)
+
+    for size in args.size:
+        gridmap = np.zeros((size, size))
+        pose = (size // 2, size // 2, np.radians(30))
+
+        print(f"map = {size}x{size} cells")
+        baseline = measure(lambda: per_sonar(gridmap, pose), args.repeat)
+        report("per sonar, full clip", baseline)
+        report("fused, in place", measure(lambda: fused(gridmap, pose), args.repeat),
+               baseline)
+
+
+def bench_stamp_cache(args):
+    """Evaluating the inverse sensor model vs. looking up cached stamps."""
+    rng = np.random.default_rng(0)
+    gridmap = np.zeros((MAP_SIZE_PIXELS, MAP_SIZE_PIXELS))
+    z_max = 40
+
+    # A drive along a wall: slowly changing headings and ranges
+    ticks = [((MAP_SIZE_PIXELS // 2, MAP_SIZE_PIXELS // 2, theta),
+              [(bearing, int(distance)) for bearing, distance
+               in zip(SONAR_BEARINGS, rng.uniform(5, z_max, 3))])
+             for theta in np.radians(rng.integers(0, 90, 1000))]
+
+    cache = mapping.StampCache(SONAR_OPENING_ANGLE, z_max)
+
+    def drive(stamp_cache):
+        for pose, measurements in ticks:
+            mapping.fuse_measurements(gridmap, pose, measurements,
+                                      SONAR_OPENING_ANGLE, z_max,
+                                      stamp_cache=stamp_cache)
+
+    print(f"{len(ticks)} ticks, z_max = {z_max} cells")
+    baseline = measure(lambda: drive(None), args.repeat)
+    report("inverse sensor model", baseline)
+    report("stamp cache", measure(lambda: drive(cache), args.repeat), baseline)
+    print(f"  {len(cache)} stamps, {cache.nbytes / 1024:.0f} KiB, "
+          f"{cache.hits} hits, {cache.misses} misses, {cache.evictions} evictions")
+
+
+def bench_quantized_map(args):
+    """Memory and update throughput of float64 vs. quantized log odds."""
+    bounds = (mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX)
+    measurements = [(bearing, 20) for bearing in SONAR_BEARINGS]
+    rng = np.random.default_rng(0)
+
+    for size in args.size:
+        maps = [("float64", np.zeros((size, size))),
+                ("int16", QuantizedLogOddsMap((size, size), bounds, np.int16)),
+                ("int8", QuantizedLogOddsMap((size, size), bounds, np.int8))]
+
+        # Whole map updates, e.g. when merging maps, stress memory bandwidth
+        delta = rng.choice(mapping.LOG_ODD_UPDATES, (size, size))
+        region = (slice(None), slice(None))
+        pose = (size // 2, size // 2, np.radians(30))
+
+        print(f"map = {size}x{size} cells")
+        baseline_tick = baseline_merge = None
+        for name, gridmap in maps:
+            tick = measure(lambda: mapping.fuse_measurements(
+                gridmap, pose, measurements, SONAR_OPENING_ANGLE, 40), args.repeat)
+            if isinstance(gridmap, QuantizedLogOddsMap):
+                steps = gridmap.steps(delta)
+                merge = measure(lambda: gridmap.add_steps(region, steps), args.repeat)
+            else:
+                merge = measure(lambda: mapping.add_log_odds(gridmap, region, delta),
+                                args.repeat)
+            baseline_tick = baseline_tick or tick
+            baseline_merge = baseline_merge or merge
+
+            print(f"  {name}: {gridmap.nbytes / 2**20:.1f} MiB")
+            report("tick (three sonars)", tick, baseline_tick)
+            report("whole map update", merge, baseline_merge)
+
+
+def bench_tiled_map(args):
+    """Reading a mostly unexplored map, dense vs. tiled."""
+    measurements = [(bearing, 20) for bearing in SONAR_BEARINGS]
+    rng = np.random.default_rng(0)
+
+    for size in args.size:
+        dense = np.zeros((size, size))
+        tiled = TiledGridMap((size, size))
+        # Explore a corner of the map
+        poses = [(int(x), int(y), theta) for x, y, theta
+                 in zip(rng.integers(50, 250, 50), rng.integers(50, 250, 50),
+                        rng.uniform(0, 2 * np.pi, 50))]
+        for gridmap in (dense, tiled):
+            for pose in poses:
+                mapping.fuse_measurements(gridmap, pose, measurements, SONAR_OPENING_ANGLE, 40)
+
+        rows, cols = rng.integers(0, 300, (2, 1000))
+        xs, ys = rng.uniform(50, 250, (2, 1000))
+        angles = rng.uniform(0, 2 * np.pi, 1000)
+
+        print(f"map = {size}x{size} cells, dense {dense.nbytes / 2**20:.1f} MiB, "
+              f"tiled {tiled.nbytes / 2**20:.1f} MiB")
+        for name, run in [
+                ("1000 cells, one by one", lambda gridmap: [gridmap[int(row), int(col)]
+                                                           for row, col in zip(rows, cols)]),
+                ("cast 1000 rays", lambda gridmap: cast_rays(gridmap, xs, ys, angles, z_max=40)),
+                ("build distance field", lambda gridmap: DistanceField(
+                    gridmap, dirty=DirtyRegions(gridmap.shape))),
+                ("build map pyramid", lambda gridmap: MapPyramid(
+                    gridmap, dirty=DirtyRegions(gridmap.shape)))]:
+            baseline = measure(lambda: run(dense), args.repeat)
+            report(f"{name} (dense)", baseline)
+            report(f"{name} (tiled)", measure(lambda: run(tiled), args.repeat), baseline)
+
+
+def bench_pyramid(args):
+    """Resampling the whole map vs. incrementally updating a map pyramid."""
+    from skimage.transform import resize
+
+    measurements = [(bearing, 20) for bearing in SONAR_BEARINGS]
+    levels = 3
+
+    for size in args.size:
+        gridmap = np.zeros((size, size))
+        dirty = DirtyRegions(gridmap.shape)
+        pyramid = MapPyramid(gridmap, levels=levels, dirty=dirty)
+        pose = (size // 2, size // 2, np.radians(30))
+
+        def tick():
+            mapping.fuse_measurements(gridmap, pose, measurements,
+                                      SONAR_OPENING_ANGLE, 40, dirty=dirty)
+
+        def incremental():
+            tick()
+            pyramid.update()
+
+        def resample():
+            tick()
+            resize(gridmap, (size >> levels, size >> levels))
+
+        print(f"map = {size}x{size} cells, {levels} levels")
+        baseline = measure(resample, args.repeat)
+        report("tick + resize", baseline)
+        report("tick + full rebuild",
+               measure(lambda: (tick(), MapPyramid(gridmap, levels, dirty=dirty)),
+                       args.repeat), baseline)
+        report("tick + pyramid update", measure(incremental, args.repeat), baseline)
+
+
+def load_track(filename, ticks, margin, seed=0):
+    """Loads a track and samples poses within its free space.
+
+    Poses keep a margin to the border, as `sense_distance` does not check
+    boundaries (unlike `cast_rays`).
+    """
+    world = np.array(png_to_ogm(filename, normalized=True))
+    rng = np.random.default_rng(seed)
+
+    ys, xs = np.nonzero(world[margin:-margin, margin:-margin] <= 0.5)
+    samples = rng.integers(0, len(xs), ticks)
+    poses = [(int(x) + margin, int(y) + margin, theta) for x, y, theta
+             in zip(xs[samples], ys[samples], rng.uniform(0, 2 * np.pi, ticks))]
+
+    return world, poses
+
+
+def bench_beam_model(args):
+    """Accuracy and speed of the beam (ray) model vs. the cone model."""
+    world, poses = load_track(args.track, args.ticks, margin=max(args.z_max))
+
+    for z_max in args.z_max:
+        sensors = SensorArray(z_max)
+        ticks = [(pose, sensors.sense(world, pose)) for pose in poses]
+
+        def build(model):
+            gridmap = np.zeros(world.shape)
+            for pose, measurements in ticks:
+                mapping.fuse_measurements(gridmap, pose, measurements,
+                                          sensors.opening_angles, sensors.max_ranges,
+                                          model=model)
+            return gridmap
+
+        cone, beam = build('cone'), build('beam')
+        known_cone, known_beam = cone != 0, beam != 0
+        both = known_cone & known_beam
+        agreement = np.mean(np.sign(cone[both]) == np.sign(beam[both]))
+        occupied_cone, occupied_beam = cone > 0, beam > 0
+        occupied_iou = (occupied_cone & occupied_beam).sum() / \
+            (occupied_cone | occupied_beam).sum()
+
+        print(f"z_max = {z_max} cells, {len(ticks)} ticks on {world.shape} map")
+        baseline = measure(lambda: build('cone'), args.repeat)
+        report("cone", baseline)
+        report("beam", measure(lambda: build('beam'), args.repeat), baseline)
+        print(f"  known cells: cone {known_cone.sum()}, beam {known_beam.sum()}, "
+              f"agreement {agreement:.3f}, occupied IoU {occupied_iou:.3f}")
+
+
+def bench_connect_pylons(args):
+    """Connecting pylons point by point vs. rasterizing all edges at once."""
+    from bresenham import bresenham
+
+    def per_point(positions, gridmap):
+        for (x1, y1), (x2, y2) in zip(positions, positions[1:] + positions[:1]):
+            for x, y in bresenham(x1, y1, x2, y2):
+                gridmap[y, x] = gridmap[y + 1, x] = gridmap[y, x + 1] = mapping.LOG_ODD_MAX
+
+    rng = np.random.default_rng(0)
+    for size, pylons in zip(args.size, args.pylons):
+        positions = [tuple(p) for p in rng.integers(0, size - 1, (pylons, 2)).tolist()]
+        gridmap = np.zeros((size, size))
+
+        print(f"map = {size}x{size} cells, {pylons} pylons")
+        baseline = measure(lambda: per_point(positions, gridmap), args.repeat)
+        report("per point", baseline)
+        report("vectorized", measure(lambda: mapping.connect_pylons(positions, gridmap),
+                                     args.repeat), baseline)
+
+
+def bench_offline_mapping(args):
+    """Scaling of the sharded offline map building with the number of workers."""
+    from stellar.cognition.offline_mapping import build_map
+
+    world, poses = load_track(args.track, args.ticks, margin=40)
+    sensors = SensorArray(40)
+    measurements = [sensors.sense(world, pose)[:, 1] for pose in poses]
+
+    print(f"{len(poses)} ticks on {world.shape} map")
+    baseline = None
+    for workers in args.workers:
+        seconds = measure(lambda: build_map(world.shape, poses, measurements, sensors.bearings,
+                                            sensors.opening_angles, sensors.max_ranges,
+                                            workers=workers), args.repeat)
+        baseline = baseline or seconds
+        report(f"{workers} worker(s)", seconds, baseline)
+
+
+def bench_distance_field(args):
+    """Full distance transform vs. incrementally updating the distance field."""
+    measurements = [(bearing, 20) for bearing in SONAR_BEARINGS]
+
+    for size in args.size:
+        gridmap = np.zeros((size, size))
+        gridmap[::50, :] = mapping.LOG_ODD_MAX
+        dirty = DirtyRegions(gridmap.shape)
+        field = DistanceField(gridmap, max_distance=args.max_distance, dirty=dirty)
+        pose = (size // 2, size // 2, np.radians(30))
+
+        def tick():
+            mapping.fuse_measurements(gridmap, pose, measurements,
+                                      SONAR_OPENING_ANGLE, 40, dirty=dirty)
+
+        def full():
+            tick()
+            DistanceField(gridmap, max_distance=args.max_distance,
+                          dirty=DirtyRegions(gridmap.shape))
+
+        def incremental():
+            tick()
+            field.update()
+
+        print(f"map = {size}x{size} cells, max distance = {args.max_distance} cells")
+        baseline = measure(full, args.repeat)
+        report("tick + full transform", baseline)
+        report("tick + incremental update", measure(incremental, args.repeat), baseline)
+
+
+def bench_frontiers(args):
+    """Full frontier detection vs. re-examining the changed regions only."""
+    from stellar.cognition.exploration import FrontierDetector
+
+    measurements = [(bearing, 20) for bearing in SONAR_BEARINGS]
+
+    for size in args.size:
+        gridmap = np.zeros((size, size))
+        gridmap[size // 4:3 * size // 4, size // 4:3 * size // 4] = mapping.LOG_ODD_MIN
+        dirty = DirtyRegions(gridmap.shape)
+        detector = FrontierDetector(gridmap, dirty=dirty)
+        pose = (size // 4, size // 2, np.radians(150))
+
+        def tick():
+            mapping.fuse_measurements(gridmap, pose, measurements,
+                                      SONAR_OPENING_ANGLE, 40, dirty=dirty)
+
+        def full():
+            tick()
+            FrontierDetector(gridmap, dirty=DirtyRegions(gridmap.shape))
+
+        def incremental():
+            tick()
+            detector.update()
+
+        print(f"map = {size}x{size} cells, {len(detector)} frontier cells")
+        baseline = measure(full, args.repeat)
+        report("tick + full detection", baseline)
+        report("tick + incremental update", measure(incremental, args.repeat), baseline)
+        report("clustering", measure(detector.clusters, args.repeat))
+
+
+def bench_ray_casting(args):
+    """Casting rays one by one (Bresenham) vs. all at once (DDA, offset table)."""
+    world, poses = load_track(args.track, args.rays, margin=max(args.z_max))
+    xs, ys, angles = (np.array(values) for values in zip(*poses))
+
+    for z_max in args.z_max:
+        def per_ray():
+            for pose in poses[:1000]:
+                sense_distance(world, pose, 0, z_max=z_max)
+
+        print(f"{len(poses)} rays on {world.shape} map, z_max = {z_max} cells")
+        baseline = measure(per_ray, args.repeat) * len(poses) / 1000
+        report("sense_distance", baseline)
+        seconds = measure(lambda: cast_rays(world, xs, ys, angles, z_max=z_max), args.repeat)
+        report("cast_rays", seconds, baseline)
+        print(f"  {len(poses) / seconds / 1e6:.2f} M rays/s")
+
+        table = RayOffsetTable(world, z_max)
+        report("RayOffsetTable (build)",
+               measure(lambda: RayOffsetTable(world, z_max), args.repeat))
+        seconds = measure(lambda: table.cast(xs, ys, angles), args.repeat)
+        report("RayOffsetTable.cast", seconds, baseline)
+        print(f"  {len(poses) / seconds / 1e6:.2f} M rays/s")
+
+
+def bench_sphere_tracing(args):
+    """Cell stepping (DDA) vs. sphere tracing over a distance transform."""
+    from glob import glob
+    from skimage.transform import rescale
+
+    rng = np.random.default_rng(0)
+    for filename in sorted(glob(args.maps)):
+        track = np.array(png_to_ogm(filename, normalized=True))
+        for resolution in args.resolution:
+            world = rescale(track, resolution, order=0)
+            z_max = args.z_max * resolution
+            ys, xs = np.nonzero(world <= 0.5)
+            samples = rng.integers(0, len(xs), args.rays)
+            xs, ys = xs[samples], ys[samples]
+            angles = rng.uniform(0, 2 * np.pi, args.rays)
+
+            print(f"{filename}: {world.shape} cells, z_max = {z_max:g} cells")
+            baseline = measure(lambda: cast_rays(world, xs, ys, angles, z_max=z_max),
+                               args.repeat)
+            report("cast_rays", baseline)
+            report("distance transform",
+                   measure(lambda: distance_transform(world, max_distance=z_max), args.repeat))
+            distances = distance_transform(world, max_distance=z_max)
+            report("sphere_trace_rays",
+                   measure(lambda: sphere_trace_rays(world, distances, xs, ys, angles,
+                                                     z_max=z_max), args.repeat), baseline)
+
+
+def bench_scan_matching(args):
+    """Scan matching a drifted pose per tick vs. the sonar tick interval."""
+    from stellar.cognition.localization import LikelihoodField, ScanMatcher
+
+    world, poses = load_track(args.track, args.ticks, margin=40)
+    sensors = SensorArray(40)
+    field = LikelihoodField(DistanceField(world, threshold=0.5,
+                                          dirty=DirtyRegions(world.shape)))
+    matcher = ScanMatcher(field)
+
+    rng = np.random.default_rng(0)
+    ticks = [((x + int(dx), y + int(dy), theta + dtheta), sensors.sense(world, (x, y, theta)))
+             for (x, y, theta), dx, dy, dtheta
+             in zip(poses, rng.integers(-3, 4, len(poses)), rng.integers(-3, 4, len(poses)),
+                    rng.uniform(-0.1, 0.1, len(poses)))]
+
+    def match():
+        for pose, measurements in ticks:
+            matcher.match(pose, measurements)
+
+    seconds = measure(match, args.repeat) / len(ticks)
+    print(f"{len(ticks)} ticks on {world.shape} map")
+    report("match per tick", seconds)
+    report("tick interval", args.tick_interval)
+
+
+def bench_particle_filter(args):
+    """Particle filter tick (move, sense, resample) vs. the sonar tick interval."""
+    from stellar.cognition.particle_filter import ParticleFilter
+
+    world, poses = load_track(args.track, 20, margin=40)
+    sensors = SensorArray(40)
+    measurements = [sensors.sense(world, pose) for pose in poses]
+
+    for count in args.particles:
+        pf = ParticleFilter(world, sensors.bearings, sensors.z_max, count=count,
+                            rng=np.random.default_rng(0))
+        pf.initialize()
+
+        def tick():
+            for z in measurements:
+                pf.move(1.0, 0.0)
+                pf.sense(z)
+                pf.resample()
+
+        print(f"{count} particles on {world.shape} map")
+        report("tick", measure(tick, args.repeat) / len(measurements))
+        report("expected ranges", measure(pf.expected_ranges, args.repeat))
+    report("tick interval", args.tick_interval)
+
+
+def bench_alignment(args):
+    """Ring buffer lookups vs. a growing list of samples searched linearly."""
+    from stellar.perception.alignment import SignalBuffer
+
+    for capacity in args.capacity:
+        buffer = SignalBuffer(capacity, width=3, periodic=[2])
+        samples = []
+        for t in range(2 * capacity):
+            buffer.append(t * 0.02, (t, t, 0))
+            samples.append((t * 0.02, (t, t, 0)))
+        samples = samples[-capacity:]
+        timestamps = np.random.default_rng(0).uniform(*buffer.span(), 100)
+
+        def linear():
+            for t in timestamps:
+                min(samples, key=lambda sample: abs(sample[0] - t))
+
+        def nearest():
+            for t in timestamps:
+                buffer.nearest(t)
+
+        def interpolate():
+            for t in timestamps:
+                buffer.interpolate(t)
+
+        print(f"capacity = {capacity} samples, per lookup")
+        baseline = measure(linear, args.repeat) / len(timestamps)
+        report("linear search (list)", baseline)
+        report("nearest (ring buffer)", measure(nearest, args.repeat) / len(timestamps),
+               baseline)
+        report("interpolate (ring buffer)",
+               measure(interpolate, args.repeat) / len(timestamps), baseline)
+        report("append", measure(lambda: buffer.append(buffer.span()[1], (0, 0, 0)),
+                                 args.repeat))
+
+
+def bench_stream_decoder(args):
+    """Streaming decoder vs. combining and decoding the messages of each record."""
+    import struct
+    from stellar.perception.sourcing import StreamDecoder, combine_messages, decode_blob
+
+    frames = []
+    for i in range(args.records):
+        payload = struct.pack("=ffffii", 0.1 * i, 0.2, 0.3, 0.4, i, 3)
+        frames.extend(bytes([j == 0]) + payload[8 * j:8 * j + 8] + bytes([j == 2])
+                      for j in range(3))
+    stream = b''.join(frames)
+
+    def per_record():
+        # Assumes the stream is in sync and never fragmented.
+        for i in range(0, len(stream), 30):
+            decode_blob(combine_messages([stream[i:i + 10], stream[i + 10:i + 20],
+                                          stream[i + 20:i + 30]]))
+
+    print(f"{args.records} records, {len(stream)} bytes")
+    baseline = measure(per_record, args.repeat)
+    report("combine + decode", baseline)
+    for size in args.chunk_size:
+        decoder = StreamDecoder()
+
+        def streaming():
+            for i in range(0, len(stream), size):
+                for _ in decoder.decode(stream[i:i + size]):
+                    pass
+
+        seconds = measure(streaming, args.repeat)
+        report(f"stream, {size} byte chunks", seconds, baseline)
+        print(f"  {'':<28} {len(stream) / seconds / 1e6:10.1f} MB/s")
+
+
+def bench_bulk_decoding(args):
+    """Bulk decoding of a log of records vs. unpacking record by record."""
+    import struct
+    from stellar.perception.sourcing import Schema, decode_blob, decode_records
+
+    # Hypothetical layout, the firmware does not send a version byte yet
+    schema = Schema('tinyk22', 1, [('front', 'f'), ('outter', 'f'), ('inner', 'f'),
+                                   ('heading', 'f'), ('motor', 'i'), ('steering', 'i')])
+
+    fmt = "=xffffiix"
+    size = struct.calcsize(fmt)
+    blob = b''.join(struct.pack(fmt, 0.1 * i, 0.2, 0.3, 0.4, i, 3)
+                    for i in range(args.records))
+
+    def per_record():
+        for i in range(0, len(blob), size):
+            decode_blob(blob[i:i + size], fmt)
+
+    def bulk():
+        records = decode_records(blob, fmt)
+        return records['f0'].mean()
+
+    schema_blob = b''.join(schema.encode(0.1 * i, 0.2, 0.3, 0.4, i, 3)
+                           for i in range(args.records))
+
+    def per_record_schema():
+        for i in range(0, len(schema_blob), schema.size):
+            schema.decode(schema_blob, i)
+
+    def bulk_schema():
+        return schema.decode_all(schema_blob)['front'].mean()
+
+    print(f"{args.records} records, {len(blob) / 1e6:.1f} MB")
+    baseline = measure(per_record, args.repeat)
+    report("decode_blob per record", baseline)
+    report("schema records", measure(per_record_schema, args.repeat), baseline)
+    report("decode_records + column mean", measure(bulk, args.repeat), baseline)
+    report("schema decode_all + mean", measure(bulk_schema, args.repeat), baseline)
+
+
+def bench_replay(args):
+    """Replaying a recorded drive vs. its duration in real time."""
+    import struct
+    import tempfile
+    from stellar.perception.recording import LogReader, Recorder
+    from stellar.perception.sourcing import StreamDecoder
+
+    ticks = int(args.duration / args.tick_interval)
+    with tempfile.TemporaryDirectory() as directory:
+        with Recorder(f"{directory}/drive") as recorder:
+            for i in range(ticks):
+                t = i * args.tick_interval
+                recorder.record(b'\x00' + struct.pack("=ffffii", t, 0.2, 0.3, 0.4, i, 3)
+                                + b'\x01', timestamp=t)
+                if i % 2 == 0:
+                    recorder.record_camera('drive.mp4', i // 2, timestamp=t)
+
+        with LogReader(f"{directory}/drive") as reader:
+            def replay():
+                for _ in reader.replay(StreamDecoder(message_size=None)):
+                    pass
+
+            def seek():
+                start = np.random.uniform(0, args.duration - 1)
+                for _ in reader.window(start, start + 1):
+                    pass
+
+            seconds = measure(replay, args.repeat)
+            print(f"{args.duration} s drive, {ticks} sensor records, {len(reader)} entries")
+            report("replay sensors", seconds)
+            print(f"  {'':<28} {args.duration / seconds:10.0f} x real time")
+            report("seek + iterate 1 s window", measure(seek, args.repeat))
+
+
+def bench_tinyk22(args):
+    """End-to-end decoding of records sent by the emulated tinyK22 over a pty."""
+    import queue
+    import threading
+    import time
+    from stellar.perception.sourcing import SensorReader
+    from stellar.simulation.tinyk22 import TinyK22Emulator
+
+    for rate in args.rate:
+        emulator = TinyK22Emulator(message_size=args.message_size, rate=rate or None,
+                                   burst=args.burst, fragmentation=args.fragmentation,
+                                   corruption=args.corruption, rng=np.random.default_rng(0))
+        device = emulator.device()
+        reader = SensorReader(device, emulator.fmt, emulator.message_size, read_size=4096,
+                              maxsize=args.records).start()
+        received = np.full(args.records, np.nan)
+
+        start = time.perf_counter()
+        sender = threading.Thread(target=emulator.run, args=(args.records,))
+        sender.start()
+        idle = 0
+        while idle < 100:
+            try:
+                values = reader.records.get(timeout=0.01)
+            except queue.Empty:
+                idle += 1
+                continue
+            idle = 0
+            if 0 <= values[4] < args.records:
+                received[values[4]] = time.perf_counter()
+            if values[4] == args.records - 1:
+                break
+        elapsed = time.perf_counter() - start
+        sender.join()
+        reader.stop(timeout=1)
+        device.close()
+        emulator.close()
+
+        latencies = received[:emulator.sent] - np.array(emulator.sent_at)[:args.records]
+        decoded = np.count_nonzero(~np.isnan(latencies))
+        print(f"rate = {rate or 'max'} records/s, {emulator.sent} sent, {decoded} decoded, "
+              f"{reader.decode_errors} decode errors")
+        print(f"  {'throughput':<28} {decoded / elapsed:10.0f} records/s")
+        report("latency p50", np.nanpercentile(latencies, 50))
+        report("latency p99", np.nanpercentile(latencies, 99))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stellar benchmarks')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="Number of repetitions per measurement.")
+
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    # z_max of 10 cells is the default of `sense_distance`, 40 cells (4m)
+    # is used by the learning mode simulation.
+    inverse_model_args = subparsers.add_parser('inverse-model')
+    inverse_model_args.add_argument('--z-max', type=int, nargs='+',
+                                    default=[10, 40, 80])
+    inverse_model_args.set_defaults(run=bench_inverse_model)
+
+    fused_update_args = subparsers.add_parser('fused-update')
+    fused_update_args.add_argument('--size', type=int, nargs='+',
+                                   default=[200, 5000])
+    fused_update_args.set_defaults(run=bench_fused_update)
+
+    stamp_cache_args = subparsers.add_parser('stamp-cache')
+    stamp_cache_args.set_defaults(run=bench_stamp_cache)
+
+    quantized_map_args = subparsers.add_parser('quantized-map')
+    quantized_map_args.add_argument('--size', type=int, nargs='+',
+                                    default=[200, 5000])
+    quantized_map_args.set_defaults(run=bench_quantized_map)
+
+    tiled_map_args = subparsers.add_parser('tiled-map')
+    tiled_map_args.add_argument('--size', type=int, nargs='+', default=[500, 4000])
+    tiled_map_args.set_defaults(run=bench_tiled_map)
+
+    pyramid_args = subparsers.add_parser('pyramid')
+    pyramid_args.add_argument('--size', type=int, nargs='+', default=[200, 2000])
+    pyramid_args.set_defaults(run=bench_pyramid)
+
+    beam_model_args = subparsers.add_parser('beam-model')
+    beam_model_args.add_argument('--track', default='tests/maps/track.png')
+    beam_model_args.add_argument('--ticks', type=int, default=100)
+    beam_model_args.add_argument('--z-max', type=int, nargs='+',
+                                 default=[40, 100, 200])
+    beam_model_args.set_defaults(run=bench_beam_model)
+
+    connect_pylons_args = subparsers.add_parser('connect-pylons')
+    connect_pylons_args.add_argument('--size', type=int, nargs='+',
+                                     default=[200, 2000, 5000])
+    connect_pylons_args.add_argument('--pylons', type=int, nargs='+',
+                                     default=[5, 100, 500])
+    connect_pylons_args.set_defaults(run=bench_connect_pylons)
+
+    offline_mapping_args = subparsers.add_parser('offline-mapping')
+    offline_mapping_args.add_argument('--track', default='tests/maps/track.png')
+    offline_mapping_args.add_argument('--ticks', type=int, default=5000)
+    offline_mapping_args.add_argument('--workers', type=int, nargs='+',
+                                      default=[1, 2, 4, 8])
+    offline_mapping_args.set_defaults(run=bench_offline_mapping)
+
+    distance_field_args = subparsers.add_parser('distance-field')
+    distance_field_args.add_argument('--size', type=int, nargs='+', default=[200, 2000])
+    distance_field_args.add_argument('--max-distance', type=int, default=20)
+    distance_field_args.set_defaults(run=bench_distance_field)
+
+    frontiers_args = subparsers.add_parser('frontiers')
+    frontiers_args.add_argument('--size', type=int, nargs='+', default=[200, 2000])
+    frontiers_args.set_defaults(run=bench_frontiers)
+
+    ray_casting_args = subparsers.add_parser('ray-casting')
+    ray_casting_args.add_argument('--track', default='tests/maps/track.png')
+    ray_casting_args.add_argument('--rays', type=int, default=100000)
+    ray_casting_args.add_argument('--z-max', type=int, nargs='+', default=[40, 100])
+    ray_casting_args.set_defaults(run=bench_ray_casting)
+
+    sphere_tracing_args = subparsers.add_parser('sphere-tracing')
+    sphere_tracing_args.add_argument('--maps', default='tests/maps/*.png')
+    sphere_tracing_args.add_argument('--rays', type=int, default=20000)
+    sphere_tracing_args.add_argument('--z-max', type=int, default=100,
+                                     help="Maximum range at resolution 1 (cells).")
+    sphere_tracing_args.add_argument('--resolution', type=float, nargs='+',
+                                     default=[0.5, 1, 2, 4])
+    sphere_tracing_args.set_defaults(run=bench_sphere_tracing)
+
+    scan_matching_args = subparsers.add_parser('scan-matching')
+    scan_matching_args.add_argument('--track', default='tests/maps/track.png')
+    scan_matching_args.add_argument('--ticks', type=int, default=200)
+    scan_matching_args.add_argument('--tick-interval', type=float, default=0.02,
+                                    help="Sonar tick interval (s).")
+    scan_matching_args.set_defaults(run=bench_scan_matching)
+
+    particle_filter_args = subparsers.add_parser('particle-filter')
+    particle_filter_args.add_argument('--track', default='tests/maps/track.png')
+    particle_filter_args.add_argument('--particles', type=int, nargs='+',
+                                      default=[1000, 10000, 20000])
+    particle_filter_args.add_argument('--tick-interval', type=float, default=0.02,
+                                      help="Sonar tick interval (s).")
+    particle_filter_args.set_defaults(run=bench_particle_filter)
+
+    alignment_args = subparsers.add_parser('alignment')
+    alignment_args.add_argument('--capacity', type=int, nargs='+', default=[100, 1000, 10000])
+    alignment_args.set_defaults(run=bench_alignment)
+
+    stream_decoder_args = subparsers.add_parser('stream-decoder')
+    stream_decoder_args.add_argument('--records', type=int, default=10000)
+    stream_decoder_args.add_argument('--chunk-size', type=int, nargs='+',
+                                     default=[1, 30, 256, 4096])
+    stream_decoder_args.set_defaults(run=bench_stream_decoder)
+
+    bulk_decoding_args = subparsers.add_parser('bulk-decoding')
+    bulk_decoding_args.add_argument('--records', type=int, default=100000)
+    bulk_decoding_args.set_defaults(run=bench_bulk_decoding)
+
+    replay_args = subparsers.add_parser('replay')
+    replay_args.add_argument('--duration', type=float, default=600,
+                             help="Duration of the recorded drive (s).")
+    replay_args.add_argument('--tick-interval', type=float, default=0.02,
+                             help="Sonar tick interval (s).")
+    replay_args.set_defaults(run=bench_replay)
+
+    tinyk22_args = subparsers.add_parser('tinyk22')
+    tinyk22_args.add_argument('--records', type=int, default=1000)
+    tinyk22_args.add_argument('--rate', type=float, nargs='+', default=[50, 1000, 0],
+                              help="Records per second, 0 to send as fast as possible.")
+    tinyk22_args.add_argument('--message-size', type=int, default=8)
+    tinyk22_args.add_argument('--burst', type=int, default=1)
+    tinyk22_args.add_argument('--fragmentation', type=float, default=0.1)
+    tinyk22_args.add_argument('--corruption', type=float, default=0.0)
+    tinyk22_args.set_defaults(run=bench_tinyk22)
+
+    args = parser.parse_args()
+    args.run(args)
@@ -12,14 +12,14 @@ from functools import partial
 import numpy as np
 from roboviz import MapVisualizer
 from skimage.transform import resize
-from bresenham import bresenham
 from tqdm import tqdm
 
 
 from stellar.action import motion
 from stellar.cognition import mapping, planning, tracking
+from stellar.cognition.localization import LikelihoodField, ScanMatcher
 from stellar.models.astar import AStarPlanner
-from stellar.models.gridmap import OccupancyGridMap
+from stellar.models.gridmap import DistanceField, OccupancyGridMap, TiledGridMap
 from stellar.models.robot import Robot
 from stellar.perception import sensors
 from stellar.perception.sensors import SensorArray
@@ -72,10 +72,17 @@ def is_in_goal(robot, goal):
 
 
 def simulate_learning_mode(robot: Robot, world: np.ndarray, sensors: SensorArray,
-                           scale: float, visualization: MapVisualizer = None):
+                           scale: float, visualization: MapVisualizer = None,
+                           localize: bool = False):
     """
     Run the learning mode simulation.
 
+    With `localize`, the dead-reckoned pose is corrected by matching the
+    measurements against the map built so far, before updating the map. The
+    simulated robot moves without error, hence it is left alone; instead the
+    correction is kept as an offset to the dead-reckoned pose, such that the
+    following poses and the history start from the corrected pose.
+
     Returns:
         The simulation returns a tuple consisting of the constructed
         occupancy grid map, the robots configuration and the history
@@ -84,9 +91,16 @@ def simulate_learning_mode(robot: Robot, world: np.ndarray, sensors: SensorArray
     """
     steer = 0       # Relative change in direction
     step = 0
-    occupancy_grid_map = np.zeros(world.shape)
+    # Only the explored part of the map is allocated
+    occupancy_grid_map = TiledGridMap(world.shape)
+    visualization_updates = occupancy_grid_map.dirty.subscribe()
+    scan_matcher = None
+    if localize:
+        distance_field = DistanceField(occupancy_grid_map)
+        scan_matcher = ScanMatcher(LikelihoodField(distance_field))
     previous_time = time()
     history = list()
+    correction = np.zeros(3)    # Offset of the corrected pose (x, y in cells, theta)
 
     goal = (2.5, 2.5)
     robot_is_in_goal = partial(robot.in_goal,
@@ -97,7 +111,8 @@ def simulate_learning_mode(robot: Robot, world: np.ndarray, sensors: SensorArray
     while not robot_is_in_goal(goal):
         progress_bar.update(1)
         if visualization is not None:
-            if not visualization.display(robot, occupancy_grid_map, mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX):
+            if not visualization.display(robot, occupancy_grid_map, mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX,
+                                         regions=visualization_updates.drain()):
                 store_simulation_data_at_step(step, occupancy_grid_map)
                 exit(0)
 
@@ -114,16 +129,22 @@ def simulate_learning_mode(robot: Robot, world: np.ndarray, sensors: SensorArray
         # Retrieve measurements from ultrasonic sensors
         distance_measurements = sensors.sense(world, map_pose)
 
+        if scan_matcher is not None:
+            scan_matcher.likelihood_field.update()
+            dead_reckoned = np.array(map_pose, dtype=np.float64)
+            estimate = dead_reckoned + correction
+            estimate_pose = (int(estimate[0]), int(estimate[1]), estimate[2] % (2 * np.pi))
+            map_pose, _ = scan_matcher.match(estimate_pose, distance_measurements)
+            correction = np.array(map_pose, dtype=np.float64) - dead_reckoned
+
         # Update occupancy grid map with new information
-        for angle, measurement in distance_measurements:
-            occupancy_grid_map = mapping.update_occupancy_map(
-                occupancy_grid_map,
-                map_pose,
-                measurement,
-                angle,
-                sensors.sonar_opening_angle,
-                sensors.z_max
-            )
+        mapping.fuse_measurements(
+            occupancy_grid_map,
+            map_pose,
+            distance_measurements,
+            sensors.opening_angles,
+            sensors.max_ranges
+        )
 
         # Convert sensor measurements back to meters
         front, left, right = [distance * map_scale_meters_per_pixel
@@ -131,7 +152,8 @@ def simulate_learning_mode(robot: Robot, world: np.ndarray, sensors: SensorArray
 
         steer = motion.follow_wall(front, left, right)
         step += 1
-        history.append((robot.x, robot.y))
+        history.append((robot.x + correction[0] * map_scale_meters_per_pixel,
+                        robot.y + correction[1] * map_scale_meters_per_pixel))
 
     return (occupancy_grid_map, robot, history)
 
@@ -143,20 +165,7 @@ class Postprocessing:
         """
         Connects pylons with lines, i.e. sets all pixels on that line to occupied.
         """
-        for index, position in enumerate(positions):
-            next_index = (index + 1) % len(positions)
-            next_element = positions[next_index]
-
-            x1 = int(position[0])
-            y1 = int(position[1])
-            x2 = int(next_element[0])
-            y2 = int(next_element[1])
-            for x, y in bresenham(x1, y1, x2, y2):
-                occupancy_grid_map[y, x] = mapping.LOG_ODD_MAX
-                occupancy_grid_map[y+1, x] = mapping.LOG_ODD_MAX
-                occupancy_grid_map[y, x+1] = mapping.LOG_ODD_MAX
-
-        return occupancy_grid_map
+        return mapping.connect_pylons(positions, occupancy_grid_map)
 
 
 def contest(datafile):
@@ -325,7 +334,7 @@ def twiddle(path, n, tol=0.1):
     return p, best_err
 
 
-def main(parcours_filename):
+def main(parcours_filename, localize=False):
 
     # Create a MapVisualizer to track the robots behaviour
     viz = MapVisualizer(MAP_SIZE_PIXELS, MAP_SIZE_METERS,
@@ -358,7 +367,8 @@ def main(parcours_filename):
 
     # Start learning drive
     occupancy_grid_map, robot, history = simulate_learning_mode(
-        robot, mapbytes, sensors, viz.map_scale_meters_per_pixel, visualization=viz)
+        robot, mapbytes, sensors, viz.map_scale_meters_per_pixel, visualization=viz,
+        localize=localize)
 
     print("=> Terminated learning mode. Post-processing collected information...")
 
@@ -394,6 +404,8 @@ if __name__ == "__main__":
     learn_mode_args = subparsers.add_parser('learn')
     learn_mode_args.add_argument('--parcours', required=True,
                                  help="Path to parcours image.")
+    learn_mode_args.add_argument('--localize', action='store_true',
+                                 help="Correct poses by scan matching.")
 
     # Run contest mode from prerecorded data
     contest_mode_args = subparsers.add_parser('contest')
@@ -404,7 +416,7 @@ if __name__ == "__main__":
 
     try:
         if args.mode == 'learn':
-            main(args.parcours)
+            main(args.parcours, localize=args.localize)
         elif args.mode == 'contest':
             contest(args.datafile)
         else:
@@ -0,0 +1,164 @@
+"""
+Frontier based exploration.
+
+Frontiers are free cells adjacent to unknown cells, i.e. the border between
+what has been explored and what has not. The frontier detector follows the
+changes of the map, hence only cells around changed regions are examined.
+Adjacent frontier cells are clustered into frontiers with union-find.
+"""
+from collections import namedtuple
+
+import numpy as np
+from scipy.ndimage import binary_dilation
+
+
+Frontier = namedtuple('Frontier', ['size', 'centroid', 'cells'])
+Frontier.__doc__ = """A cluster of adjacent frontier cells.
+
+size:       Number of cells.
+centroid:   Mean position (x, y) of the cells.
+cells:      Rows and columns of the cells.
+"""
+
+
+class DisjointSets:
+    """Union-find over the integers 0..n-1, with path halving and union by size."""
+
+    def __init__(self, n):
+        self.parents = list(range(n))
+        self.sizes = [1] * n
+
+    def find(self, i):
+        parents = self.parents
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return
+        if self.sizes[i] < self.sizes[j]:
+            i, j = j, i
+        self.parents[j] = i
+        self.sizes[i] += self.sizes[j]
+
+    def roots(self):
+        return np.array([self.find(i) for i in range(len(self.parents))], dtype=np.intp)
+
+
+class FrontierDetector:
+    """Keeps the frontier cells of a map up to date."""
+
+    def __init__(self, gridmap, unknown_band=0.0, connectivity=8, dirty=None):
+        """
+        Args:
+            gridmap: The occupancy grid map (log odds).
+            unknown_band: Cells with absolute log odds up to `unknown_band`
+                          are unknown, cells below are free.
+            connectivity: 4 or 8, neighbourhood of adjacent cells.
+            dirty: `DirtyRegions` tracking the changes of the map. Defaults
+                   to a subscription to the maps own tracker.
+
+        """
+        if connectivity not in (4, 8):
+            raise ValueError(f"Connectivity must be 4 or 8, got {connectivity}")
+
+        self.gridmap = gridmap
+        self.unknown_band = unknown_band
+        self.shape = tuple(gridmap.shape)
+        self.dirty = dirty if dirty is not None else gridmap.dirty.subscribe()
+
+        self.structure = np.ones((3, 3), dtype=bool)
+        if connectivity == 4:
+            self.structure[[0, 0, 2, 2], [0, 2, 0, 2]] = False
+
+        self.frontier = np.zeros(self.shape, dtype=bool)
+        self._cells = set()
+        self._examine(slice(0, self.shape[0]), slice(0, self.shape[1]))
+
+    def __len__(self):
+        return len(self._cells)
+
+    def update(self):
+        """Re-examines the cells around all regions changed since the last update.
+
+        Returns:
+            The changed regions of the map.
+
+        """
+        regions = self.dirty.drain()
+        for rows, cols in regions:
+            self._examine(rows, cols)
+
+        return regions
+
+    def cells(self):
+        """Returns the rows and columns of all frontier cells."""
+        return np.unravel_index(np.fromiter(self._cells, dtype=np.intp, count=len(self._cells)),
+                                self.shape)
+
+    def clusters(self, min_size=1):
+        """Clusters adjacent frontier cells into frontiers.
+
+        Args:
+            min_size: Frontiers with fewer cells are dropped.
+
+        Returns:
+            List of `Frontier`, largest first.
+
+        """
+        cells = np.sort(np.fromiter(self._cells, dtype=np.intp, count=len(self._cells)))
+        rows, cols = np.unravel_index(cells, self.shape)
+        width = self.shape[1]
+
+        # Union each cell with its neighbours "after" it, such that every
+        # pair of adjacent cells is considered exactly once.
+        sets = DisjointSets(len(cells))
+        for dy, dx in zip(*np.nonzero(self.structure)):
+            dy, dx = dy - 1, dx - 1
+            if (dy, dx) <= (0, 0):
+                continue
+            inside = (rows + dy < self.shape[0]) & (cols + dx >= 0) & (cols + dx < width)
+            neighbours = cells + dy * width + dx
+            positions = np.searchsorted(cells, neighbours)
+            adjacent = inside & (positions < len(cells))
+            adjacent[adjacent] = cells[positions[adjacent]] == neighbours[adjacent]
+            for i, j in zip(np.nonzero(adjacent)[0], positions[adjacent]):
+                sets.union(i, j)
+
+        roots = sets.roots()
+        frontiers = []
+        for root in np.unique(roots):
+            members = roots == root
+            if members.sum() < min_size:
+                continue
+            frontiers.append(Frontier(int(members.sum()),
+                                      (cols[members].mean(), rows[members].mean()),
+                                      (rows[members], cols[members])))
+
+        return sorted(frontiers, key=lambda frontier: -frontier.size)
+
+    def _grow(self, rows, cols, margin):
+        return (slice(max(rows.start - margin, 0), min(rows.stop + margin, self.shape[0])),
+                slice(max(cols.start - margin, 0), min(cols.stop + margin, self.shape[1])))
+
+    def _examine(self, rows, cols):
+        """Recomputes the frontier cells within one cell of a region."""
+        inner = self._grow(rows, cols, 1)
+        window = self._grow(rows, cols, 2)
+
+        values = np.asarray(self.gridmap[window])
+        unknown = np.abs(values) <= self.unknown_band
+        frontier = (values < -self.unknown_band) & binary_dilation(unknown, self.structure)
+        frontier = frontier[inner[0].start - window[0].start:inner[0].stop - window[0].start,
+                            inner[1].start - window[1].start:inner[1].stop - window[1].start]
+
+        self._cells.difference_update(self._flat_indices(inner, self.frontier[inner]))
+        self._cells.update(self._flat_indices(inner, frontier))
+        self.frontier[inner] = frontier
+
+    def _flat_indices(self, region, mask):
+        rows, cols = np.nonzero(mask)
+        return ((rows + region[0].start) * self.shape[1] + cols + region[1].start).tolist()
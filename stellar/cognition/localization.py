@@ -0,0 +1,153 @@
+"""
+Scan-to-map matching.
+
+Dead-reckoned poses drift. The correlative scan matcher corrects a pose by
+scoring candidate poses in a small window around it: the sonar measurements
+are projected from each candidate pose and the likelihood of an obstacle at
+the projected cells is summed up. All candidates of a search level are
+scored at once.
+
+The search is coarse-to-fine, i.e. a coarse grid of candidates spanning
+the whole window is scored first, then a fine grid around the best coarse
+candidate.
+"""
+import numpy as np
+
+
+class LikelihoodField:
+    """Likelihood of sensing an obstacle at each cell of the map.
+
+    The likelihood falls off with the distance d to the nearest obstacle as
+    exp(-d² / 2σ²). It is updated along with its `DistanceField`, i.e. only
+    around the changed regions of the map.
+
+    """
+
+    def __init__(self, distance_field, sigma=2.0):
+        """
+        Args:
+            distance_field: `DistanceField` of the map.
+            sigma: Standard deviation of the measurements (cells).
+
+        """
+        self.distance_field = distance_field
+        self.sigma = sigma
+        self.shape = distance_field.shape
+        self.likelihood = self._compute(distance_field[:, :])
+
+    def __getitem__(self, key):
+        return self.likelihood[key]
+
+    def update(self):
+        """Updates the distance field and the likelihoods of its updated regions.
+
+        Returns:
+            The updated regions.
+
+        """
+        regions = self.distance_field.update()
+        for region in regions:
+            self.likelihood[region] = self._compute(self.distance_field[region])
+
+        return regions
+
+    def _compute(self, distances):
+        return np.exp(-np.square(distances) / (2 * self.sigma ** 2))
+
+
+class ScanMatcher:
+    """Correlative scan matcher."""
+
+    def __init__(self, likelihood_field, linear_window=4, angular_window=np.radians(6),
+                 angular_resolution=np.radians(1), coarse_factor=2):
+        """
+        Args:
+            likelihood_field: `LikelihoodField` of the map.
+            linear_window: Maximum correction of x and y (cells).
+            angular_window: Maximum correction of theta (rad).
+            angular_resolution: Angular step of the fine search (rad). The
+                                linear step of the fine search is one cell.
+            coarse_factor: Step of the coarse search, relative to the fine
+                           search.
+
+        """
+        self.likelihood_field = likelihood_field
+        self.linear_window = linear_window
+        self.angular_window = angular_window
+        self.angular_resolution = angular_resolution
+        self.coarse_factor = coarse_factor
+
+    def score(self, poses, measurements):
+        """Scores candidate poses against the map.
+
+        Args:
+            poses: Candidate poses (x, y, theta), an array of shape (K, 3).
+            measurements: Bearings and distances of the sonars that sensed an
+                          obstacle, an array of shape (N, 2).
+
+        Returns:
+            The summed likelihood of each candidate pose, an array of shape (K,).
+
+        """
+        poses = np.asarray(poses, dtype=np.float64)
+        bearings, distances = np.asarray(measurements, dtype=np.float64).T
+
+        angles = poses[:, 2, None] + bearings
+        cols = np.rint(poses[:, 0, None] + distances * np.cos(angles)).astype(np.intp)
+        rows = np.rint(poses[:, 1, None] + distances * np.sin(angles)).astype(np.intp)
+
+        height, width = self.likelihood_field.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+        likelihood = np.zeros(rows.shape)
+        likelihood[inside] = self.likelihood_field[rows[inside], cols[inside]]
+        return likelihood.sum(axis=1)
+
+    def match(self, pose, measurements):
+        """Corrects a pose by matching the measurements against the map.
+
+        Args:
+            pose: Dead-reckoned pose (x, y, theta) in grid cells.
+            measurements: List of (bearing, distance) tuples, as returned by
+                          `SensorArray.sense`. Measurements without an
+                          obstacle (distance <= 0) are ignored.
+
+        Returns:
+            A tuple of the corrected pose and its score. If no candidate
+            scores better than the given pose, the given pose is returned.
+
+        """
+        hits = np.array([(bearing, distance) for bearing, distance in measurements
+                         if distance > 0], dtype=np.float64).reshape(-1, 2)
+        origin = np.array(pose, dtype=np.float64)
+
+        best_score = self.score(origin[None], hits)[0]
+        if len(hits) == 0:
+            return pose, best_score
+
+        linear_step = self.coarse_factor
+        angular_step = self.coarse_factor * self.angular_resolution
+        coarse = self._candidates(origin, self.linear_window, self.angular_window,
+                                  linear_step, angular_step)
+        scores = self.score(coarse, hits)
+        center = coarse[np.argmax(scores)]
+
+        fine = self._candidates(center, linear_step - 1, angular_step - self.angular_resolution,
+                                1, self.angular_resolution)
+        scores = self.score(fine, hits)
+        best = np.argmax(scores)
+
+        if scores[best] <= best_score:
+            return pose, best_score
+
+        x, y, theta = fine[best]
+        return (int(x), int(y), theta % (2 * np.pi)), scores[best]
+
+    @staticmethod
+    def _candidates(center, linear_window, angular_window, linear_step, angular_step):
+        """Grid of candidate poses around a center pose, an array of shape (K, 3)."""
+        linear = np.arange(-linear_window, linear_window + 1, linear_step)
+        angular = np.arange(-angular_window, angular_window + angular_step / 2, angular_step)
+
+        dx, dy, dtheta = np.meshgrid(linear, linear, angular, indexing='ij')
+        return center + np.stack([dx.ravel(), dy.ravel(), dtheta.ravel()], axis=1)
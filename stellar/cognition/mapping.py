@@ -1,12 +1,10 @@
 """
 Contains implementations of the mapping algorithms.
 """
-from math import floor
+from collections import OrderedDict, namedtuple
+from math import ceil, floor
 
 import numpy as np
-from bresenham import bresenham
-
-from stellar.perception.sensors import get_occupied_cell_from_distance
 
 
 LOG_ODD_MAX = 5
@@ -16,26 +14,91 @@ LOG_ODD_OCCU = 1
 LOG_ODD_FREE = 0.4
 
 
-def connect_pylons(positions, occupancy_grid_map):
+def connect_pylons(positions, occupancy_grid_map, thickness=2, dirty=None):
     """
     Connects pylons with lines, i.e. sets all pixels on that line to occupied.
+
+    Args:
+        positions: Positions (x, y) of the pylons, in the order in which they
+                   are connected. The last pylon is connected to the first.
+        occupancy_grid_map: The occupancy grid map, updated in place.
+        thickness: Thickness of the lines (cells), see `polygon_cells`.
+        dirty: Optional `DirtyRegions` to mark the updated region in.
+
+    Returns:
+        The updated occupancy grid map.
+
     """
-    for index, position in enumerate(positions):
-        next_index = (index + 1) % len(positions)
-        next_element = positions[next_index]
+    ys, xs = polygon_cells(occupancy_grid_map.shape, positions, thickness)
+    if not xs.size:
+        return occupancy_grid_map
+
+    region = (slice(int(ys.min()), int(ys.max()) + 1),
+              slice(int(xs.min()), int(xs.max()) + 1))
 
-        x1 = int(position[0])
-        y1 = int(position[1])
-        x2 = int(next_element[0])
-        y2 = int(next_element[1])
-        for x, y in bresenham(x1, y1, x2, y2):
-            occupancy_grid_map[y, x] = LOG_ODD_MAX
-            occupancy_grid_map[y+1, x] = LOG_ODD_MAX
-            occupancy_grid_map[y, x+1] = LOG_ODD_MAX
+    if isinstance(occupancy_grid_map, np.ndarray):
+        occupancy_grid_map[ys, xs] = LOG_ODD_MAX
+    else:
+        # Maps such as `TiledGridMap` only support indexing by slices
+        values = occupancy_grid_map[region]
+        values[ys - region[0].start, xs - region[1].start] = LOG_ODD_MAX
+        occupancy_grid_map[region] = values
+
+    if dirty is not None:
+        dirty.mark(region)
 
     return occupancy_grid_map
 
 
+def polygon_cells(shape, positions, thickness=2):
+    """Rasterizes the edges of a closed polygon.
+
+    All edges are rasterized at once, following Bresenham's line algorithm.
+    Lines are thickened by a triangular brush, covering the cells (x + i,
+    y + j) for all i, j >= 0 with i + j < thickness. Cells outside of the
+    map are dropped.
+
+    Args:
+        shape: Shape of the map (rows, columns).
+        positions: Vertices (x, y) of the polygon.
+        thickness: Thickness of the edges (cells).
+
+    Returns:
+        Row and column indices of the cells on the edges (possibly repeated).
+
+    """
+    vertices = np.asarray(positions, dtype=float).astype(int).reshape(-1, 2)
+    if not len(vertices):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    x1, y1 = vertices[:, 0], vertices[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    dx, dy = np.abs(x2 - x1), np.abs(y2 - y1)
+    sx, sy = np.where(x2 > x1, 1, -1), np.where(y2 > y1, 1, -1)
+
+    # Each edge is sampled once per step along its major axis
+    steps = np.maximum(dx, dy)
+    edge = np.repeat(np.arange(len(vertices)), steps + 1)
+    k = np.arange(edge.size) - np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)
+
+    n = steps[edge]
+    denominator = np.maximum(2 * n, 1)
+    x_major = (dx > dy)[edge]
+    major = k
+    minor_x = (2 * dx[edge] * k + n) // denominator
+    minor_y = (2 * dy[edge] * k + n) // denominator
+
+    xs = x1[edge] + sx[edge] * np.where(x_major, major, minor_x)
+    ys = y1[edge] + sy[edge] * np.where(x_major, minor_y, major)
+
+    brush = [(i, j) for i in range(thickness) for j in range(thickness) if i + j < thickness]
+    xs = np.concatenate([xs + i for i, _ in brush])
+    ys = np.concatenate([ys + j for _, j in brush])
+
+    inside = (xs >= 0) & (xs < shape[1]) & (ys >= 0) & (ys < shape[0])
+    return ys[inside], xs[inside]
+
+
 def inverse_range_sensor_model(cell, pose, relative_sensor_angle, beta, z_max, z_t):
     """
     Args:
@@ -63,16 +126,10 @@ def inverse_range_sensor_model(cell, pose, relative_sensor_angle, beta, z_max, z
 
     # r: Distance between studied cell to the robot
     r = np.sqrt(np.square(xi-xr) + np.square(yi-yr))
-    # phi: Angle between studied cell and the robot
-    phi = np.arctan2(yi - yr, xi - xr) - theta_r
+    # phi: Angle between studied cell and the sonar axis, within [-pi, pi)
+    phi = (np.arctan2(yi - yr, xi - xr) - theta_r - sonar_theta + np.pi) % (2 * np.pi) - np.pi
 
-    if phi >= np.pi:
-        phi -= 2 * np.pi
-
-    elif phi <= -np.pi:
-        phi += 2 * np.pi
-
-    if r > min(z_max, z_t + alpha / 2) or (np.abs(phi - sonar_theta) > (beta / 2)):
+    if r > min(z_max, z_t + alpha / 2) or (np.abs(phi) > (beta / 2)):
         return 0
     elif (z_t < z_max) and (np.abs(r - z_t) < alpha / 2):
         return 1
@@ -80,9 +137,197 @@ def inverse_range_sensor_model(cell, pose, relative_sensor_angle, beta, z_max, z
         return -1
 
 
-def update_occupancy_map(gridmap, pose, measurement, sonar_bearing_angle, sonar_opening_angle, z_max):
+def inverse_range_sensor_model_grid(xs, ys, pose, relative_sensor_angle, beta, z_max, z_t):
+    """Vectorized version of `inverse_range_sensor_model`.
+
+    Evaluates the model for every cell spanned by the columns `xs` and the
+    rows `ys` in a single pass, yielding the same result as calling
+    `inverse_range_sensor_model` for each cell.
+
+    Args:
+        xs: x coordinates (columns) of the cells to evaluate.
+        ys: y coordinates (rows) of the cells to evaluate.
+        pose: A tuple of the robot pose, consisting of x, y and theta.
+        relative_sensor_angle: Angle of the sensor relative to the roboter
+        beta: Opening angle of range sensor
+        z_max: Maximum range of sensor
+        z_t: Sensor measurement at time t
+
+    Returns:
+        A 2D int8 array of shape (len(ys), len(xs)), indicating for each cell
+        if its state is unknown (0), occupied (1) or free (-1).
+
+    """
+    alpha = 2  # obstacle thickness
+    xr, yr, theta_r = pose
+
+    dx = np.asarray(xs, dtype=np.float64)[np.newaxis, :] - xr
+    dy = np.asarray(ys, dtype=np.float64)[:, np.newaxis] - yr
+
+    # r: Distance between studied cells to the robot
+    r = np.sqrt(np.square(dx) + np.square(dy))
+    # phi: Angle between studied cells and the sonar axis, within [-pi, pi)
+    phi = (np.arctan2(dy, dx) - theta_r - relative_sensor_angle + np.pi) % (2 * np.pi) - np.pi
+
+    outside = (r > min(z_max, z_t + alpha / 2)) | (np.abs(phi) > (beta / 2))
+    occupied = (z_t < z_max) & (np.abs(r - z_t) < alpha / 2)
+
+    cells = np.where(occupied, 1, -1).astype(np.int8)
+    cells[outside] = 0
+    return cells
+
+
+# Log odd update per cell state, indexed by the state (-1, 0, 1) plus one.
+LOG_ODD_UPDATES = np.array([-LOG_ODD_FREE, 0.0, LOG_ODD_OCCU])
+
+
+def normalize_measurement(measurement, z_max):
+    """Treat missing (-1) or empty (0) measurements as maximum range."""
+    if measurement == -1 or measurement == 0:
+        return z_max
+
+    return measurement
+
+
+def sonar_window(shape, pose, measurement, sonar_bearing_angle, sonar_opening_angle, z_max):
+    """Calculate the map region covered by a sonar cone.
+
+    The region is the bounding box of the circular sector of the cone, i.e.
+    it covers every cell the inverse sensor model may update.
+
+    Args:
+        shape: Shape of the occupancy grid map (rows, columns).
+        pose: Robots current pose.
+        measurement: Normalized distance measurement from sonar.
+        sonar_bearing_angle: Bearing angle of the sonar, relative to robot (rad).
+        sonar_opening_angle: Opening angle of the sonar (rad).
+        z_max: Maximum range of the sonar.
+
+    Returns:
+        A tuple of row and column slices, clipped to the map boundaries.
+
+    """
+    alpha = 2  # obstacle thickness, see `inverse_range_sensor_model`
+    max_x, min_x, max_y, min_y = sector_bounding_box(
+        pose, min(z_max, measurement + alpha / 2),
+        pose[2] + sonar_bearing_angle, sonar_opening_angle)
+
+    # Cells on the boundary of the sector belong to the cone
+    eps = 1e-9
+    rows = slice(max(ceil(min_y - eps), 0), max(min(floor(max_y + eps) + 1, shape[0]), 0))
+    cols = slice(max(ceil(min_x - eps), 0), max(min(floor(max_x + eps) + 1, shape[1]), 0))
+    return rows, cols
+
+
+def sonar_cells(shape, pose, measurement, sonar_bearing_angle, sonar_opening_angle, z_max):
+    """Evaluate the inverse sensor model over the region of a sonar cone.
+
+    Returns:
+        A tuple of the region (row and column slices) and the cell states
+        within that region, as returned by `inverse_range_sensor_model_grid`.
+
+    """
+    region = sonar_window(shape, pose, measurement, sonar_bearing_angle,
+                          sonar_opening_angle, z_max)
+    rows, cols = region
+    cells = inverse_range_sensor_model_grid(
+        np.arange(cols.start, cols.stop),
+        np.arange(rows.start, rows.stop),
+        pose,
+        sonar_bearing_angle,
+        sonar_opening_angle,
+        z_max,
+        measurement)
+
+    return region, cells
+
+
+class SparseCells(namedtuple('SparseCells', ['ys', 'xs', 'states'])):
+    """Cell states of individual cells (row and column indices), as opposed
+    to the dense cell states of a region.
+
+    A cell may occur multiple times, but always with the same state. Hence
+    updating the cells through (buffered) fancy indexing, e.g.
+    `gridmap[cells.ys, cells.xs] += updates`, updates every cell once.
+    """
+
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return self.states.size
+
+
+def beam_cells(shape, pose, measurement, sonar_bearing_angle, sonar_opening_angle, z_max,
+               rays=None):
+    """Evaluate the inverse sensor model along a fan of rays.
+
+    Instead of evaluating every cell in the bounding box of the sonar cone,
+    only the cells traversed by a fan of rays within the opening angle are
+    evaluated. Hence the work scales with the range times the number of rays
+    instead of the area of the bounding box.
+
+    Args:
+        shape: Shape of the occupancy grid map (rows, columns).
+        pose: Robots current pose.
+        measurement: Normalized distance measurement from sonar.
+        sonar_bearing_angle: Bearing angle of the sonar, relative to robot (rad).
+        sonar_opening_angle: Opening angle of the sonar (rad).
+        z_max: Maximum range of the sonar.
+        rays: Number of rays. Defaults to as many rays as needed for
+              adjacent rays to be at most one cell apart.
+
+    Returns:
+        A tuple of the region (row and column slices) covering the traversed
+        cells and the `SparseCells` which are updated, see `sonar_cells` for
+        their states.
+
+    """
+    alpha = 2  # obstacle thickness
+    xr, yr, theta_r = pose
+    reach = min(z_max, measurement + alpha / 2)
+
+    if rays is None:
+        rays = max(2, ceil(sonar_opening_angle * reach) + 1)
+
+    angles = theta_r + sonar_bearing_angle + \
+        np.linspace(-sonar_opening_angle / 2, sonar_opening_angle / 2, rays)
+    ranges = np.arange(1, floor(reach) + 1)
+
+    xs = np.rint(xr + np.outer(np.cos(angles), ranges)).astype(int).ravel()
+    ys = np.rint(yr + np.outer(np.sin(angles), ranges)).astype(int).ravel()
+
+    inside = (xs >= 0) & (xs < shape[1]) & (ys >= 0) & (ys < shape[0])
+    xs, ys = xs[inside], ys[inside]
+
+    # Classify the traversed cells by the distance of their centers. Cells
+    # traversed by multiple rays are classified the same way.
+    r = np.sqrt(np.square(xs - xr) + np.square(ys - yr))
+    states = np.where((measurement < z_max) & (np.abs(r - measurement) < alpha / 2), 1, -1)
+    updated = r <= reach
+    cells = SparseCells(ys[updated], xs[updated], states[updated].astype(np.int8))
+    if not cells.size:
+        return (slice(0, 0), slice(0, 0)), cells
+
+    rows = slice(int(cells.ys.min()), int(cells.ys.max()) + 1)
+    cols = slice(int(cells.xs.min()), int(cells.xs.max()) + 1)
+    return (rows, cols), cells
+
+
+# Sensor models evaluating the cells of a sonar measurement
+SENSOR_MODELS = {
+    'cone': sonar_cells,
+    'beam': beam_cells
+}
+
+
+def update_occupancy_map(gridmap, pose, measurement, sonar_bearing_angle, sonar_opening_angle, z_max,
+                         dirty=None, model='cone'):
     """Update occupancy grid map with new measurement.
 
+    The map is updated in place; only the region covered by the sonar cone
+    is touched (and clipped).
+
     Args:
         gridmap: Occupancy grid map to update (2D)
         pose: Robots current pose
@@ -90,79 +335,364 @@ def update_occupancy_map(gridmap, pose, measurement, sonar_bearing_angle, sonar_
         sonar_bearing_angle: Bearing angle of the sonar, relative to robot (rad).
         sonar_opening_angle: Opening angle of the sonar (rad).
         z_max: Maximum range of the sonar.
+        dirty: Optional `DirtyRegions` to mark the updated region in.
+        model: Sensor model, see `SENSOR_MODELS`. Either the whole sonar
+               cone ('cone') or a fan of rays within it ('beam').
 
 
     Returns:
-        An updated version of the occupancy grid map.
+        The updated occupancy grid map.
 
     """
+    measurement = normalize_measurement(measurement, z_max)
+
+    pose_cell = pose_region(gridmap.shape, pose)
+    if pose_cell is not None:
+        gridmap[pose_cell] -= LOG_ODD_FREE
+
+    region, cells = SENSOR_MODELS[model](gridmap.shape, pose, measurement,
+                                         sonar_bearing_angle, sonar_opening_angle, z_max)
+    if isinstance(cells, SparseCells):
+        scatter_log_odds(gridmap, cells.ys, cells.xs, LOG_ODD_UPDATES[cells.states + 1])
+    else:
+        gridmap[region] += LOG_ODD_UPDATES[cells + 1]
+        clip_region(gridmap, region)
+    if pose_cell is not None:
+        clip_region(gridmap, pose_cell)
+
+    if dirty is not None:
+        if isinstance(cells, SparseCells):
+            dirty.mark_cells(cells.ys, cells.xs)
+        else:
+            dirty.mark(region)
+        if pose_cell is not None:
+            dirty.mark(pose_cell)
+
+    return gridmap
+
+
+def fuse_measurements(gridmap, pose, measurements, sonar_opening_angle, z_max,
+                      stamp_cache=None, dirty=None, model='cone'):
+    """Update occupancy grid map with all measurements taken at one pose.
+
+    Instead of updating the map once per sonar, the log odd updates of all
+    sonar cones are accumulated and applied to the map in a single step. The
+    map is updated in place and only the region covered by the cones is
+    touched, hence the cost does not depend on the size of the map.
+
+    NOTE: The map is clipped once after all updates were applied, which
+    differs from updating per sonar only where clipping saturates a cell
+    covered by multiple cones.
 
-    if measurement == -1:
-        measurement = z_max
+    Args:
+        gridmap: Occupancy grid map to update (2D)
+        pose: Robots current pose
+        measurements: Pairs of sonar bearing angle (rad) and distance
+                      measurement, as returned by `SensorArray.sense`.
+        sonar_opening_angle: Opening angle of the sonars (rad), for all
+                             sonars or one per measurement.
+        z_max: Maximum range of the sonars, for all sonars or one per
+               measurement.
+        stamp_cache: Optional `StampCache` to look up precomputed sonar
+                     cones instead of evaluating the inverse sensor model.
+                     Requires all sonars to match the opening angle and
+                     range of the cache.
+        dirty: Optional `DirtyRegions` to mark the updated region in.
+        model: Sensor model, see `SENSOR_MODELS`. Ignored if a stamp cache
+               is given.
+
+    Returns:
+        The updated region of the map as a tuple of row and column slices,
+        or None if no cell was updated.
+
+    """
+    opening_angles = np.broadcast_to(sonar_opening_angle, (len(measurements),))
+    z_maxs = np.broadcast_to(z_max, (len(measurements),))
+
+    if stamp_cache is not None:
+        if (np.any(opening_angles != stamp_cache.sonar_opening_angle)
+                or np.any(z_maxs != stamp_cache.z_max)):
+            raise ValueError("Sonars do not match the stamp cache")
+        beams = [stamp_cells(gridmap.shape, pose,
+                             stamp_cache.lookup(pose[2] + angle, measurement))
+                 for angle, measurement in measurements]
+    else:
+        beams = [SENSOR_MODELS[model](gridmap.shape, pose,
+                                      normalize_measurement(measurement, sonar_z_max),
+                                      angle, opening_angle, sonar_z_max)
+                 for (angle, measurement), opening_angle, sonar_z_max
+                 in zip(measurements, opening_angles, z_maxs)]
+
+    pose_cell = pose_region(gridmap.shape, pose)
+    regions = [region for region, cells in beams if cells.size]
+    if pose_cell is not None and len(beams):
+        regions.append(pose_cell)
+
+    if not regions:
+        return None
+
+    region = union_region(regions)
+    sparse = [cells for _, cells in beams if isinstance(cells, SparseCells)]
+    if (isinstance(gridmap, np.ndarray) and gridmap.flags.c_contiguous
+            and len(sparse) == len(beams)):
+        # Only update the cells traversed by the rays, all updates are
+        # applied before clipping. Flat indices are faster than pairs.
+        flat_map = gridmap.reshape(-1)
+        indices = [cells.ys * gridmap.shape[1] + cells.xs for cells in sparse]
+        for cells, cell_indices in zip(sparse, indices):
+            flat_map[cell_indices] += LOG_ODD_UPDATES[cells.states + 1]
+        if pose_cell is not None:
+            gridmap[pose_cell] -= LOG_ODD_FREE * len(beams)
+
+        indices = np.concatenate(indices)
+        flat_map[indices] = np.clip(flat_map[indices], a_max=LOG_ODD_MAX, a_min=LOG_ODD_MIN)
+        if pose_cell is not None:
+            clip_region(gridmap, pose_cell)
+
+        if dirty is not None:
+            dirty.mark_cells(*np.divmod(indices, gridmap.shape[1]))
+            if pose_cell is not None:
+                dirty.mark(pose_cell)
+        return region
+
+    rows, cols = region
+    delta = np.zeros((rows.stop - rows.start, cols.stop - cols.start))
+
+    for (beam_rows, beam_cols), cells in beams:
+        if not cells.size:
+            continue
+        if isinstance(cells, SparseCells):
+            delta[cells.ys - rows.start, cells.xs - cols.start] += LOG_ODD_UPDATES[cells.states + 1]
+            continue
+        delta[beam_rows.start - rows.start:beam_rows.stop - rows.start,
+              beam_cols.start - cols.start:beam_cols.stop - cols.start] += LOG_ODD_UPDATES[cells + 1]
+
+    if pose_cell is not None:
+        delta[pose[1] - rows.start, pose[0] - cols.start] -= LOG_ODD_FREE * len(beams)
+
+    add_log_odds(gridmap, region, delta)
+    if dirty is not None:
+        dirty.mark(region)
+
+    return region
+
+
+def pose_region(shape, pose):
+    """Returns the region of the cell the robot is in, or None if outside."""
+    x, y = pose[0], pose[1]
+    if 0 <= y < shape[0] and 0 <= x < shape[1]:
+        return slice(y, y + 1), slice(x, x + 1)
+
+    return None
+
+
+def union_region(regions):
+    """Returns the smallest region (row and column slices) covering all regions."""
+    rows = slice(min(r.start for r, _ in regions), max(r.stop for r, _ in regions))
+    cols = slice(min(c.start for _, c in regions), max(c.stop for _, c in regions))
+    return rows, cols
+
+
+def add_log_odds(gridmap, region, log_odds):
+    """Adds log odds to a region of the map and clips the region, in place.
+
+    Maps which provide their own (e.g. saturating) `add_log_odds`, such as
+    `QuantizedLogOddsMap`, are updated through it.
+    """
+    if hasattr(gridmap, 'add_log_odds'):
+        gridmap.add_log_odds(region, log_odds)
+    else:
+        gridmap[region] += log_odds
+        clip_region(gridmap, region)
 
-    x_r, y_r, theta_r = pose
-    beam_angle = (theta_r + sonar_bearing_angle)
-    beam_angle = (theta_r + sonar_bearing_angle) % (2 * np.pi)
 
-    if beam_angle > np.pi:
-        beam_angle -= 2 * np.pi
+def scatter_log_odds(gridmap, ys, xs, log_odds):
+    """Adds log odds to individual cells of the map and clips them, in place.
 
-    if beam_angle < -np.pi:
-        beam_angle += 2 * np.pi
+    Cells occurring multiple times must have the same log odds, they are
+    updated once (see `SparseCells`).
 
-    if measurement == 0:
-        measurement = z_max
+    Maps which cannot be indexed by cell indices (e.g. `TiledGridMap`) are
+    updated over the region covering the cells.
+    """
+    if hasattr(gridmap, 'add_log_odds'):
+        gridmap.add_log_odds((ys, xs), log_odds)
+    elif isinstance(gridmap, np.ndarray):
+        gridmap[ys, xs] = np.clip(gridmap[ys, xs] + log_odds,
+                                  a_max=LOG_ODD_MAX, a_min=LOG_ODD_MIN)
+    elif len(ys):
+        rows = slice(int(ys.min()), int(ys.max()) + 1)
+        cols = slice(int(xs.min()), int(xs.max()) + 1)
+        delta = np.zeros((rows.stop - rows.start, cols.stop - cols.start))
+        delta[ys - rows.start, xs - cols.start] = log_odds
+        add_log_odds(gridmap, (rows, cols), delta)
 
-    B = get_occupied_cell_from_distance(gridmap,
-                                        pose, measurement + 5, sonar_bearing_angle - np.deg2rad(10))
-    C = get_occupied_cell_from_distance(gridmap,
-                                        pose, measurement + 5, sonar_bearing_angle + np.deg2rad(10))
 
-    max_x, min_x, max_y, min_y = fov_bounding_box(pose, B, C)
+def clip_region(gridmap, region):
+    """Clips the log odds within a region of the map, in place."""
+    values = gridmap[region]
+    np.clip(values, a_max=LOG_ODD_MAX, a_min=LOG_ODD_MIN, out=values)
 
-    # gridmap[min_y:max_y, min_x:max_x] = 10
-    # print(max_y, min_y)
-    if pose[1] <= gridmap.shape[0] and pose[0] <= gridmap.shape[1]:
-        gridmap[pose[1], pose[0]] -= LOG_ODD_FREE
-    for y in range(min_y, min(max_y, gridmap.shape[0])):
-        for x in range(min_x, min(max_x, gridmap.shape[1])):
-            p = inverse_range_sensor_model(
-                (x, y),
-                pose,
-                sonar_bearing_angle,
-                sonar_opening_angle,
-                z_max,
-                measurement)
+    # Maps other than numpy arrays (e.g. `TiledGridMap`) return a copy
+    if not isinstance(gridmap, np.ndarray):
+        gridmap[region] = values
 
-            if p == -1:
-                gridmap[y, x] -= LOG_ODD_FREE
 
-            if p == 1:
-                gridmap[y, x] += LOG_ODD_OCCU
+# A precomputed sonar cone: cell states relative to the robots cell, where
+# (dx, dy) is the offset of the first column and row of `cells`.
+Stamp = namedtuple('Stamp', ['dx', 'dy', 'cells'])
 
-            if p == 0:
-                pass
 
-    return np.clip(gridmap, a_max=LOG_ODD_MAX, a_min=LOG_ODD_MIN)
+class StampCache:
+    """Cache of precomputed sonar cones (stamps).
 
+    The cell states of a sonar cone only depend on the (absolute) heading of
+    the beam, the measured range, the opening angle and the obstacle
+    thickness. Headings and ranges are quantized, so that a cone can be
+    looked up and stamped onto the map at the robots cell instead of being
+    evaluated over and over again.
 
-def fov_bounding_box(pose, B, C):
-    """Calculate a bounding box around the sonar cone.
+    Least recently used stamps are evicted once the stamps exceed the
+    memory limit.
+
+    """
+
+    def __init__(self, sonar_opening_angle, z_max, heading_resolution=np.radians(1),
+                 range_resolution=1, max_bytes=16 * 2**20):
+        """Initialize a new stamp cache.
+
+        Args:
+            sonar_opening_angle: Opening angle of the sonars (rad).
+            z_max: Maximum range of the sonars.
+            heading_resolution: Quantization of the beam heading (rad).
+            range_resolution: Quantization of the measured range (cells).
+            max_bytes: Memory limit for all cached stamps.
+
+        """
+        self.sonar_opening_angle = sonar_opening_angle
+        self.z_max = z_max
+        self.heading_resolution = heading_resolution
+        self.range_resolution = range_resolution
+        self.max_bytes = max_bytes
+
+        self.headings = int(round(2 * np.pi / heading_resolution))
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._stamps = OrderedDict()
+
+    def __len__(self):
+        return len(self._stamps)
+
+    def key(self, heading, measurement):
+        """Returns the quantized heading and range of a beam."""
+        measurement = normalize_measurement(measurement, self.z_max)
+
+        heading_index = int(round(heading / self.heading_resolution)) % self.headings
+        range_index = int(round(measurement / self.range_resolution))
+
+        return heading_index, range_index
+
+    def lookup(self, heading, measurement):
+        """Returns the stamp of a beam.
+
+        Args:
+            heading: Absolute heading of the beam (rad), i.e. the robots
+                     orientation plus the sonar bearing angle.
+            measurement: Distance measurement from sonar.
+
+        Returns:
+            The `Stamp` of the (quantized) beam.
+
+        """
+        key = self.key(heading, measurement)
+        stamp = self._stamps.get(key)
+
+        if stamp is not None:
+            self.hits += 1
+            self._stamps.move_to_end(key)
+            return stamp
+
+        self.misses += 1
+        stamp = self._compute(*key)
+        self._stamps[key] = stamp
+        self.nbytes += stamp.cells.nbytes
+
+        while self.nbytes > self.max_bytes and len(self._stamps) > 1:
+            _, evicted = self._stamps.popitem(last=False)
+            self.nbytes -= evicted.cells.nbytes
+            self.evictions += 1
+
+        return stamp
+
+    def clear(self):
+        """Removes all stamps and resets the counters."""
+        self._stamps.clear()
+        self.nbytes = self.hits = self.misses = self.evictions = 0
+
+    def _compute(self, heading_index, range_index):
+        heading = heading_index * self.heading_resolution
+        measurement = min(range_index * self.range_resolution, self.z_max)
+
+        radius = ceil(min(self.z_max, measurement + 1)) + 1
+        offsets = np.arange(-radius, radius + 1)
+        cells = inverse_range_sensor_model_grid(
+            offsets, offsets, (0, 0, heading), 0,
+            self.sonar_opening_angle, self.z_max, measurement)
+
+        # Trim the stamp to the cells covered by the cone
+        rows = np.flatnonzero(cells.any(axis=1))
+        cols = np.flatnonzero(cells.any(axis=0))
+        if not rows.size:
+            return Stamp(0, 0, np.zeros((0, 0), dtype=np.int8))
+
+        cells = cells[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1].copy()
+        return Stamp(int(offsets[cols[0]]), int(offsets[rows[0]]), cells)
+
+
+def stamp_cells(shape, pose, stamp):
+    """Places a stamp at the robots cell.
+
+    Returns:
+        A tuple of the region (row and column slices) and the cell states
+        within that region, clipped to the map boundaries.
+
+    """
+    height, width = stamp.cells.shape
+    top, left = pose[1] + stamp.dy, pose[0] + stamp.dx
+
+    rows = slice(max(top, 0), max(min(top + height, shape[0]), 0))
+    cols = slice(max(left, 0), max(min(left + width, shape[1]), 0))
+    cells = stamp.cells[rows.start - top:max(rows.stop - top, 0),
+                        cols.start - left:max(cols.stop - left, 0)]
+
+    return (rows, cols), cells
+
+
+def sector_bounding_box(pose, radius, heading, opening_angle):
+    """Calculate a bounding box around a circular sector.
 
     Args:
-        pose:   Robots current pose.
-        B:
-        C:
+        pose:           Robots current pose, the center of the sector.
+        radius:         Radius of the sector.
+        heading:        Direction of the axis of the sector (rad).
+        opening_angle:  Opening angle of the sector (rad).
 
     Returns:
         A tuple containing the maximum and mininum value
         for the x- and y-axis.
 
     """
-    A = (pose[0], pose[1])
-    max_x = floor(max(A[0], max(B[0], C[0])))
-    min_x = floor(min(A[0], min(B[0], C[0])))
-    max_y = floor(max(A[1], max(B[1], C[1])))
-    min_y = floor(min(A[1], min(B[1], C[1])))
+    # The extremes lie on the center, the ends of the arc, or where the arc
+    # crosses one of the axes.
+    start = heading - opening_angle / 2
+    angles = [start, start + opening_angle]
+    angles += [start + (k * np.pi / 2 - start) % (2 * np.pi) for k in range(4)]
+    angles = [angle for angle in angles if angle <= start + opening_angle]
+
+    xs = [pose[0]] + [pose[0] + radius * np.cos(angle) for angle in angles]
+    ys = [pose[1]] + [pose[1] + radius * np.sin(angle) for angle in angles]
 
-    return (max_x, min_x, max_y, min_y)
+    return (max(xs), min(xs), max(ys), min(ys))
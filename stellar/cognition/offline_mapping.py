@@ -0,0 +1,204 @@
+"""
+Offline map building from recorded drives.
+
+Log odd updates are additive, hence a recorded drive can be split into
+shards, which are mapped independently by a pool of worker processes. Each
+worker counts how often every cell within reach of its shard was observed as
+occupied and as free, and adds the counts to a single accumulator in shared
+memory. The counts are turned into (clipped) log odds at the end.
+
+Since the counts are integers, the result does not depend on the number of
+workers, i.e. it matches the serial result exactly. It only matches the map
+built tick by tick (see `mapping.fuse_measurements`) as long as no cell
+saturates: online, the log odds are clipped after every tick, such that
+a saturated cell ignores further evidence in its direction, while offline
+all evidence is summed before clipping once.
+
+A recorded drive is stored as `.npz` file with the arrays:
+    poses:          Robot poses (x, y, theta) in grid cells, one per tick.
+    measurements:   Distance measurements, one row per tick and one column
+                    per sonar (-1 if nothing was sensed).
+    bearings:       Bearing angle of each sonar, relative to robot (rad).
+"""
+import argparse
+import os
+from math import ceil
+from multiprocessing import Lock, Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from stellar.cognition import mapping
+
+
+def count_observations(counts, poses, measurements, bearings, sonar_opening_angle, z_max,
+                       model='cone'):
+    """Counts the occupied and free observations of each cell.
+
+    Args:
+        counts: Array of shape (2, rows, columns) to add the number of
+                occupied (index 0) and free (index 1) observations to.
+        poses: Robot poses (x, y, theta) in grid cells.
+        measurements: Distance measurements, one row per pose.
+        bearings: Bearing angle of each sonar, relative to robot (rad).
+        sonar_opening_angle: Opening angle of the sonars (rad), for all
+                             sonars or one per sonar.
+        z_max: Maximum range of the sonars, for all sonars or one per sonar.
+        model: Sensor model, see `mapping.SENSOR_MODELS`.
+
+    """
+    shape = counts.shape[1:]
+    occupied, free = counts
+    sensor_model = mapping.SENSOR_MODELS[model]
+    sonars = list(zip(bearings, np.broadcast_to(sonar_opening_angle, (len(bearings),)),
+                      np.broadcast_to(z_max, (len(bearings),))))
+
+    for (x, y, theta), distances in zip(poses, measurements):
+        pose = (int(x), int(y), theta)
+        for (bearing, opening_angle, sonar_z_max), distance in zip(sonars, distances):
+            region, cells = sensor_model(shape, pose,
+                                         mapping.normalize_measurement(distance, sonar_z_max),
+                                         bearing, opening_angle, sonar_z_max)
+            if isinstance(cells, mapping.SparseCells):
+                # Buffered fancy indexing counts repeated cells once
+                occupied[cells.ys, cells.xs] += cells.states == 1
+                free[cells.ys, cells.xs] += cells.states == -1
+            else:
+                occupied[region] += cells == 1
+                free[region] += cells == -1
+
+        pose_cell = mapping.pose_region(shape, pose)
+        if pose_cell is not None:
+            free[pose_cell] += len(bearings)
+
+
+def log_odds_from_counts(counts):
+    """Turns occupied and free observation counts into clipped log odds."""
+    occupied, free = counts
+    log_odds = occupied * mapping.LOG_ODD_OCCU - free * mapping.LOG_ODD_FREE
+    return np.clip(log_odds, a_max=mapping.LOG_ODD_MAX, a_min=mapping.LOG_ODD_MIN)
+
+
+def shard_region(shape, poses, z_max):
+    """Region of the map within reach of the sonars from the given poses.
+
+    Returns:
+        A tuple of row and column slices, clipped to the map boundaries.
+
+    """
+    reach = ceil(np.max(z_max)) + 2
+    xs, ys = poses[:, 0].astype(int), poses[:, 1].astype(int)
+    return _reach_slice(ys, reach, shape[0]), _reach_slice(xs, reach, shape[1])
+
+
+def _reach_slice(positions, reach, size):
+    start = min(max(positions.min() - reach, 0), size)
+    return slice(start, max(min(positions.max() + reach + 1, size), start))
+
+
+_lock = None
+
+
+def _init_worker(lock):
+    global _lock
+    _lock = lock
+
+
+def _count_shard(shm_name, shape, poses, measurements, bearings,
+                 sonar_opening_angle, z_max, model):
+    """Counts the observations of a shard within its reach and adds them to
+    the shared accumulator."""
+    rows, cols = shard_region(shape, poses, z_max)
+    # Poses relative to the region, the sensor models only depend on offsets
+    poses = poses.copy()
+    poses[:, 0] = poses[:, 0].astype(int) - cols.start
+    poses[:, 1] = poses[:, 1].astype(int) - rows.start
+    counts = np.zeros((2, rows.stop - rows.start, cols.stop - cols.start), dtype=np.int32)
+    count_observations(counts, poses, measurements, bearings,
+                       sonar_opening_angle, z_max, model)
+
+    shm = SharedMemory(name=shm_name)
+    try:
+        accumulator = np.ndarray((2,) + tuple(shape), dtype=np.int32, buffer=shm.buf)
+        with _lock:
+            accumulator[:, rows, cols] += counts
+        del accumulator
+    finally:
+        shm.close()
+
+
+def build_map(shape, poses, measurements, bearings, sonar_opening_angle, z_max,
+              workers=None, model='cone'):
+    """Builds an occupancy grid map from a recorded drive.
+
+    Args:
+        shape: Shape of the map (rows, columns).
+        poses: Robot poses (x, y, theta) in grid cells, one per tick.
+        measurements: Distance measurements, one row per tick and one column
+                      per sonar.
+        bearings: Bearing angle of each sonar, relative to robot (rad).
+        sonar_opening_angle: Opening angle of the sonars (rad).
+        z_max: Maximum range of the sonars.
+        workers: Number of worker processes. Defaults to the number of CPUs,
+                 with 1, the map is built within the current process.
+                 Besides the accumulator of 8 bytes per cell, each worker
+                 counts into 8 bytes per cell within reach of its shard of
+                 the drive, up to the whole map.
+        model: Sensor model, see `mapping.SENSOR_MODELS`.
+
+    Returns:
+        The occupancy grid map (log odds).
+
+    """
+    poses = np.asarray(poses, dtype=np.float64)
+    measurements = np.asarray(measurements, dtype=np.float64)
+    workers = min(workers or os.cpu_count() or 1, max(len(poses), 1))
+
+    if workers == 1:
+        counts = np.zeros((2,) + tuple(shape), dtype=np.int32)
+        count_observations(counts, poses, measurements, bearings,
+                           sonar_opening_angle, z_max, model)
+        return log_odds_from_counts(counts)
+
+    counts_shape = (2,) + tuple(shape)
+    shm = SharedMemory(create=True, size=int(np.prod(counts_shape)) * 4)
+    try:
+        counts = np.ndarray(counts_shape, dtype=np.int32, buffer=shm.buf)
+        counts[:] = 0
+
+        shards = np.array_split(np.arange(len(poses)), workers)
+        with Pool(workers, initializer=_init_worker, initargs=(Lock(),)) as pool:
+            pool.starmap(_count_shard, [
+                (shm.name, tuple(shape), poses[shard], measurements[shard],
+                 bearings, sonar_opening_angle, z_max, model)
+                for shard in shards])
+
+        log_odds = log_odds_from_counts(counts)
+        del counts
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return log_odds
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a map from a recorded drive.')
+    parser.add_argument('drive', help="Path to the recorded drive (.npz).")
+    parser.add_argument('output', help="Path to store the map at (.npy).")
+    parser.add_argument('--shape', type=int, nargs=2, default=[200, 200],
+                        metavar=('ROWS', 'COLUMNS'))
+    parser.add_argument('--z-max', type=int, default=40,
+                        help="Maximum range of the sonars (cells).")
+    parser.add_argument('--opening-angle', type=float, default=15,
+                        help="Opening angle of the sonars (degrees).")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--model', choices=sorted(mapping.SENSOR_MODELS),
+                        default='cone')
+    args = parser.parse_args()
+
+    drive = np.load(args.drive)
+    occupancy_grid_map = build_map(args.shape, drive['poses'], drive['measurements'],
+                                   drive['bearings'], np.radians(args.opening_angle),
+                                   args.z_max, workers=args.workers, model=args.model)
+    np.save(args.output, occupancy_grid_map)
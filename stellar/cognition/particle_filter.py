@@ -0,0 +1,190 @@
+"""
+Monte Carlo localization against a previously learned map.
+
+The particles are stored as struct-of-arrays, i.e. one row per state
+variable (x, y, theta) with one column per particle, such that motion
+updates, ray casts and resampling operate on all particles at once.
+
+Expected sonar ranges are cast with a `RayOffsetTable`, i.e. along
+precomputed cell offsets per quantized heading: casting all rays boils down
+to a gather from the (padded) map and an argmax for the first occupied cell
+per ray.
+"""
+import numpy as np
+
+from stellar.perception.sensors import RayOffsetTable
+
+
+class ParticleFilter:
+    """Particle filter localizing the robot on an occupancy grid map."""
+
+    def __init__(self, gridmap, sonar_bearings, z_max, count=10000, scale=1.0,
+                 threshold=0.5, sigma=2.0, motion_noise=(0.05, np.radians(2)),
+                 heading_resolution=np.radians(1), rng=None):
+        """
+        Args:
+            gridmap: The map to localize against.
+            sonar_bearings: Bearing angle of each sonar, relative to robot (rad).
+            z_max: Maximum range of the sonars (cells).
+            count: Number of particles.
+            scale: Size of a cell (meters), poses are in meters like the
+                   pose of `Robot`.
+            threshold: Cells with a value greater than threshold are obstacles.
+            sigma: Standard deviation of the range measurements (cells).
+            motion_noise: Standard deviation of the distance (relative to the
+                          distance) and the direction of a movement (rad).
+            heading_resolution: Angular resolution of the ray casts (rad).
+            rng: Random number generator.
+
+        """
+        self.sonar_bearings = np.asarray(sonar_bearings, dtype=np.float64)
+        self.z_max = z_max
+        self.scale = scale
+        self.sigma = sigma
+        self.motion_noise = motion_noise
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+        self.states = np.zeros((3, count))
+        self.weights = np.full(count, 1 / count)
+        self._scratch = np.empty_like(self.states)
+
+        self.shape = np.shape(gridmap)
+        self.free = np.asarray(gridmap) <= threshold
+        self.ray_table = RayOffsetTable(gridmap, z_max, threshold, heading_resolution)
+
+    @property
+    def x(self):
+        return self.states[0]
+
+    @property
+    def y(self):
+        return self.states[1]
+
+    @property
+    def theta(self):
+        return self.states[2]
+
+    def __len__(self):
+        return self.states.shape[1]
+
+    def initialize(self, pose=None, spread=(0.5, 0.5, np.radians(10))):
+        """Scatters the particles.
+
+        Args:
+            pose: Initial pose (x, y, theta) to scatter the particles around
+                  normally with standard deviations `spread`. If None, the
+                  particles are scattered uniformly over the free cells.
+            spread: Standard deviation of x, y (meters) and theta (rad).
+
+        """
+        count = len(self)
+        if pose is None:
+            rows, cols = np.nonzero(self.free)
+            cells = self.rng.integers(0, len(rows), count)
+            self.x[:] = (cols[cells] + self.rng.random(count)) * self.scale
+            self.y[:] = (rows[cells] + self.rng.random(count)) * self.scale
+            self.theta[:] = self.rng.uniform(0, 2 * np.pi, count)
+        else:
+            self.states[:] = self.rng.normal(np.asarray(pose, dtype=np.float64)[:, None],
+                                             np.asarray(spread)[:, None], (3, count))
+            self.theta[:] %= 2 * np.pi
+
+        self.weights[:] = 1 / count
+
+    def move(self, distance, direction, max_steering=np.pi / 2):
+        """Moves all particles, see `Robot.move`, with added motion noise."""
+        count = len(self)
+        distance_noise, direction_noise = self.motion_noise
+
+        directions = direction + self.rng.normal(0, direction_noise, count)
+        np.clip(directions, -max_steering, max_steering, out=directions)
+        distances = distance + self.rng.normal(0, distance_noise * abs(distance), count)
+        np.maximum(distances, 0.0, out=distances)
+
+        self.theta[:] += directions
+        self.theta[:] %= 2.0 * np.pi
+        self.x[:] += np.cos(self.theta) * distances
+        self.y[:] += np.sin(self.theta) * distances
+
+    def expected_ranges(self, cells=None):
+        """Casts the rays of all sonars from all particles.
+
+        Args:
+            cells: Grid cells of the particles, as returned by `_cells`,
+                   computed if None.
+
+        Returns:
+            The distance to the nearest obstacle (cells) per particle and
+            sonar, an array of shape (particles, sonars), -1 if there is no
+            obstacle within z_max or the ray leaves the map.
+
+        """
+        rows, cols, _ = cells if cells is not None else self._cells()
+        return self.ray_table.cast(cols[:, None], rows[:, None],
+                                   self.theta[:, None] + self.sonar_bearings)
+
+    def sense(self, measurements):
+        """Weights the particles by the likelihood of the measurements.
+
+        Particles outside the map or in cells which are not free get a
+        weight of 0.
+
+        Args:
+            measurements: List of (bearing, distance) tuples, one per sonar,
+                          as returned by `SensorArray.sense`. Distances are
+                          in cells, -1 if nothing was sensed.
+
+        """
+        measured = np.array([distance for _, distance in measurements], dtype=np.float64)
+        measured[measured < 0] = self.z_max
+
+        cells = self._cells()
+        expected = self.expected_ranges(cells)
+        expected[expected < 0] = self.z_max
+
+        errors = np.square(expected - measured).sum(axis=1)
+        self.weights *= np.exp(-errors / (2 * self.sigma ** 2))
+        # Particles outside the map or within obstacles are impossible
+        rows, cols, inside = cells
+        inside &= self.free[rows, cols]
+        self.weights[~inside] = 0
+
+        total = self.weights.sum()
+        if total > 0:
+            self.weights /= total
+        else:
+            self.weights[:] = 1 / len(self)
+
+    def effective_count(self):
+        """Effective number of particles, 1 / sum(w²)."""
+        return 1 / np.square(self.weights).sum()
+
+    def resample(self):
+        """Low variance (systematic) resampling."""
+        count = len(self)
+        positions = (self.rng.random() + np.arange(count)) / count
+        cumulative = np.cumsum(self.weights)
+        cumulative[-1] = 1.0
+        indices = np.searchsorted(cumulative, positions)
+
+        np.take(self.states, indices, axis=1, out=self._scratch)
+        self.states, self._scratch = self._scratch, self.states
+        self.weights[:] = 1 / count
+
+    def estimate(self):
+        """Weighted mean pose (x, y, theta) of the particles."""
+        x = np.dot(self.weights, self.x)
+        y = np.dot(self.weights, self.y)
+        theta = np.arctan2(np.dot(self.weights, np.sin(self.theta)),
+                           np.dot(self.weights, np.cos(self.theta)))
+        return (x, y, theta % (2 * np.pi))
+
+    def _cells(self):
+        """Grid cells of the particles (clamped to the map) and whether
+        they lie within the map."""
+        cols = np.floor(self.x / self.scale).astype(np.intp)
+        rows = np.floor(self.y / self.scale).astype(np.intp)
+        inside = (rows >= 0) & (rows < self.shape[0]) & (cols >= 0) & (cols < self.shape[1])
+        np.clip(rows, 0, self.shape[0] - 1, out=rows)
+        np.clip(cols, 0, self.shape[1] - 1, out=cols)
+        return rows, cols, inside
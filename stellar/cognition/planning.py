@@ -36,13 +36,17 @@ class AStarPlanner:
     def __init__(self):
         pass
 
-    def plan(self, occupancy_grid_map, start_node, goal_node):
+    def plan(self, occupancy_grid_map, start_node, goal_node, distance_field=None, clearance=0):
         """Plans a path through the occupancy grid map.
 
         Args:
             occupancy_grid_map: The occupancy grid map.
             start_node: Coordinates of the start node.
             goal_ndoe: Coordinates of the goal node.
+            distance_field: Optional `DistanceField` of the map. Cells closer
+                            than `clearance` to an obstacle are penalized by
+                            the missing clearance.
+            clearance: Desired distance to obstacles (cells).
 
         Returns:
             A list of coordinates of the planned path or None, if no path
@@ -95,9 +99,11 @@ class AStarPlanner:
                     continue
 
                 # Check if that cell is free!
-                cell = occupancy_grid_map[yn][xn]
+                cell = occupancy_grid_map[yn, xn]
                 if cell <= 0:
                     potential_cost = 0  # abs(cell)  # * 3
+                    if distance_field is not None:
+                        potential_cost = max(clearance - distance_field[yn, xn], 0)
                     new_cost = cost + dcost + potential_cost
                     new_total_cost_to_goal = new_cost + \
                         heuristics((xn, yn), goal_node) + potential_cost
@@ -112,6 +118,38 @@ class AStarPlanner:
 
         return list(reversed(path))
 
+    def is_blocked(self, occupancy_grid_map, path, regions):
+        """Checks whether changes to the map block a planned path.
+
+        Only the cells of the path within the changed regions are examined,
+        hence a path needs to be replanned only if this returns True.
+
+        Args:
+            occupancy_grid_map: The occupancy grid map.
+            path: The planned path, as a list of (x, y) coordinates.
+            regions: Changed regions of the map (row and column slices), e.g.
+                     as returned by `DirtyRegions.drain`.
+
+        Returns:
+            True if any cell of the path within the regions is occupied.
+
+        """
+        if not len(path):
+            return False
+
+        xs, ys = np.asarray(path, dtype=int).T
+        for rows, cols in regions:
+            inside = (rows.start <= ys) & (ys < rows.stop) & \
+                (cols.start <= xs) & (xs < cols.stop)
+            if not inside.any():
+                continue
+
+            cells = np.asarray(occupancy_grid_map[rows, cols])
+            if np.any(cells[ys[inside] - rows.start, xs[inside] - cols.start] > 0):
+                return True
+
+        return False
+
     def smoothen(self, occupancy_grid_map, path):
         """Smoothens the planned path.
 
@@ -18,7 +18,7 @@ show_animation = True
 
 class AStarPlanner:
 
-    def __init__(self, ox, oy, reso, rr):
+    def __init__(self, ox, oy, reso, rr, distance_field=None):
         """
         Initialize grid map for a star planning
 
@@ -26,11 +26,19 @@ class AStarPlanner:
         oy: y position list of Obstacles [m]
         reso: grid resolution [m]
         rr: robot radius[m]
+        distance_field: optional DistanceField of the obstacles, used for
+                        collision checks instead of the obstacle map. Its
+                        origin and cell size must match the positions [m];
+                        positions outside of the field are not safe.
         """
 
         self.reso = reso
         self.rr = rr
-        self.calc_obstacle_map(ox, oy)
+        self.distance_field = distance_field
+        if distance_field is None:
+            self.calc_obstacle_map(ox, oy)
+        else:
+            self.calc_bounds(ox, oy)
         self.motion = self.get_motion_model()
 
     class Node:
@@ -172,12 +180,18 @@ class AStarPlanner:
             return False
 
         # collision check
-        if self.obmap[node.x][node.y]:
+        if self.distance_field is not None:
+            try:
+                if self.distance_field.clearance(px, py) <= self.rr:
+                    return False
+            except IndexError:
+                return False
+        elif self.obmap[node.x][node.y]:
             return False
 
         return True
 
-    def calc_obstacle_map(self, ox, oy):
+    def calc_bounds(self, ox, oy):
 
         self.minx = round(min(ox))
         self.miny = round(min(oy))
@@ -193,8 +207,12 @@ class AStarPlanner:
         print("xwidth:", self.xwidth)
         print("ywidth:", self.ywidth)
 
-        self.xwidth = self.xwidth.astype('int')
-        self.ywidth = self.ywidth.astype('int')
+        self.xwidth = int(self.xwidth)
+        self.ywidth = int(self.ywidth)
+
+    def calc_obstacle_map(self, ox, oy):
+
+        self.calc_bounds(ox, oy)
 
         # obstacle map generation
         self.obmap = [[False for i in range(self.ywidth)]
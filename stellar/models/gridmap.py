@@ -4,6 +4,7 @@ Credits to https://github.com/richardos/occupancy-grid-a-star
 """
 import numpy as np
 import matplotlib.pyplot as plt
+from scipy.ndimage import distance_transform_edt
 
 from stellar.utils import png_to_ogm
 
@@ -61,3 +62,676 @@ class OccupancyGridMap:
         #ogm_data_arr[where_1] = 0
 
         return OccupancyGridMap(ogm_data_arr, cell_size)
+
+
+def index_region(key, shape):
+    """Turns an index of a 2D map into row and column slices.
+
+    Supports integers and slices with a step of one, as well as Ellipsis.
+
+    Returns:
+        Row and column slices and an index to drop the dimensions that
+        were indexed by integers.
+
+    """
+    if not isinstance(key, tuple):
+        key = (key,)
+    if Ellipsis in key:
+        position = key.index(Ellipsis)
+        key = key[:position] + (slice(None),) * (3 - len(key)) + key[position + 1:]
+    if len(key) > 2:
+        raise IndexError(f"too many indices for map: map is 2-dimensional, "
+                         f"but {len(key)} were indexed")
+    key = key + (slice(None),) * (2 - len(key))
+
+    slices = []
+    squeeze = []
+    for index, size in zip(key, shape):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(size)
+            if step != 1:
+                raise IndexError("only slices with a step of 1 are supported")
+            slices.append(slice(start, max(start, stop)))
+            squeeze.append(slice(None))
+        elif isinstance(index, (int, np.integer)):
+            index = int(index)
+            if not -size <= index < size:
+                raise IndexError(f"index {index} is out of bounds for size {size}")
+            index %= size
+            slices.append(slice(index, index + 1))
+            squeeze.append(0)
+        else:
+            raise IndexError(f"unsupported index: {index!r}")
+
+    return slices[0], slices[1], tuple(squeeze)
+
+
+class DirtyRegions:
+    """Keeps track of the changed regions of a map.
+
+    Changes are tracked at the granularity of square tiles. Consumers of the
+    map (e.g. visualization or planning) `subscribe` to get a tracker of
+    their own and `drain` it to process only the regions which changed
+    since they last did so.
+
+    """
+
+    def __init__(self, shape, tile_size=16):
+        """
+        Creates a new tracker, with no region marked as changed.
+
+        Args:
+            shape: Number of rows and columns of the tracked map.
+            tile_size: Number of rows and columns of a tile.
+
+        """
+        self.shape = tuple(shape)
+        self.tile_size = tile_size
+
+        self._tiles = set()
+        self._subscribers = []
+
+    def __bool__(self):
+        return bool(self._tiles)
+
+    def __len__(self):
+        """Number of changed tiles."""
+        return len(self._tiles)
+
+    def subscribe(self):
+        """Returns a new tracker which is marked whenever this one is."""
+        subscriber = DirtyRegions(self.shape, self.tile_size)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def mark(self, region):
+        """Marks a region (row and column slices) as changed."""
+        row_start, row_stop, _ = region[0].indices(self.shape[0])
+        col_start, col_stop, _ = region[1].indices(self.shape[1])
+        if row_stop <= row_start or col_stop <= col_start:
+            return
+
+        size = self.tile_size
+        for i in range(row_start // size, (row_stop - 1) // size + 1):
+            for j in range(col_start // size, (col_stop - 1) // size + 1):
+                self._tiles.add((i, j))
+
+        for subscriber in self._subscribers:
+            subscriber.mark(region)
+
+    def mark_cells(self, rows, cols):
+        """Marks individual cells (arrays of row and column indices) as changed."""
+        rows, cols = np.asarray(rows), np.asarray(cols)
+        if not rows.size:
+            return
+
+        size = self.tile_size
+        columns = -(-self.shape[1] // size)
+        tiles = np.flatnonzero(np.bincount(((rows // size) * columns + cols // size).ravel()))
+        self._tiles.update(zip(*(indices.tolist() for indices in np.divmod(tiles, columns))))
+
+        for subscriber in self._subscribers:
+            subscriber.mark_cells(rows, cols)
+
+    def mark_all(self):
+        """Marks the whole map as changed."""
+        self.mark((slice(0, self.shape[0]), slice(0, self.shape[1])))
+
+    def drain(self):
+        """Returns the changed regions and resets the tracker.
+
+        Adjacent tiles are merged into rectangles, first along rows and then
+        along columns.
+
+        Returns:
+            A list of regions (row and column slices).
+
+        """
+        tiles = sorted(self._tiles)
+        self._tiles = set()
+
+        # Merge horizontally adjacent tiles into runs of (row, first, last)
+        runs = []
+        for i, j in tiles:
+            if runs and runs[-1][0] == i and runs[-1][2] == j - 1:
+                runs[-1][2] = j
+            else:
+                runs.append([i, j, j])
+
+        # Merge vertically adjacent runs spanning the same columns
+        rectangles = []
+        open_rectangles = {}
+        for i, first, last in runs:
+            rectangle = open_rectangles.get((first, last))
+            if rectangle is not None and rectangle[1] == i - 1:
+                rectangle[1] = i
+            else:
+                rectangle = [i, i, first, last]
+                open_rectangles[(first, last)] = rectangle
+                rectangles.append(rectangle)
+
+        size = self.tile_size
+        return [(slice(top * size, min((bottom + 1) * size, self.shape[0])),
+                 slice(first * size, min((last + 1) * size, self.shape[1])))
+                for top, bottom, first, last in rectangles]
+
+
+class TiledGridMap:
+    """Sparse grid map, made up of fixed size square tiles.
+
+    Tiles are only allocated once a cell within them is written to, cells of
+    absent tiles read as `fill_value` (i.e. unknown). Hence memory grows with
+    the explored area instead of the size of the map.
+
+    The map can be indexed like a 2D numpy array with integers and slices
+    (with a step of one). Reading returns a dense copy of the indexed cells,
+    writing updates the underlying tiles, so in place operators such as
+    `gridmap[rows, cols] += delta` work as with numpy arrays. Single cells
+    (`gridmap[row, col]`) and arrays of cells (`take_cells`) are read from
+    their tiles directly.
+
+    Tiles are stored in a pool, whose first tile is never written and holds
+    the fill value, such that cells of absent tiles can be looked up like
+    any other cell.
+
+    """
+
+    ndim = 2
+
+    def __init__(self, shape, tile_size=64, fill_value=0.0, dtype=np.float64):
+        """
+        Creates a new tiled grid map.
+
+        Args:
+            shape: Number of rows and columns of the map.
+            tile_size: Number of rows and columns of a tile.
+            fill_value: Value of cells which have not been written yet.
+            dtype: Data type of the cells.
+
+        """
+        self.shape = tuple(shape)
+        self.tile_size = tile_size
+        self.fill_value = fill_value
+        self.dtype = np.dtype(dtype)
+        self.dirty = DirtyRegions(self.shape, tile_size)
+
+        # Slot of each tile in the pool, 0 for absent tiles
+        self._slots = np.zeros((-(-self.shape[0] // tile_size), -(-self.shape[1] // tile_size)),
+                               dtype=np.intp)
+        self._pool = np.full((1, tile_size, tile_size), fill_value, dtype=self.dtype)
+        self._allocated = 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        """Number of bytes consumed by the tiles, apart from the fill tile."""
+        return self._pool[1:].nbytes
+
+    def tiles(self):
+        """Yields the region (row and column slices) and data of all allocated tiles."""
+        size = self.tile_size
+        for i, j in zip(*(indices.tolist() for indices in np.nonzero(self._slots))):
+            rows = slice(i * size, min((i + 1) * size, self.shape[0]))
+            cols = slice(j * size, min((j + 1) * size, self.shape[1]))
+            yield (rows, cols), self._pool[self._slots[i, j], :rows.stop - rows.start,
+                                           :cols.stop - cols.start]
+
+    def extent(self):
+        """Returns the smallest region (row and column slices) covering all
+        allocated tiles, or None if no tile is allocated."""
+        rows, cols = np.nonzero(self._slots)
+        if not rows.size:
+            return None
+
+        size = self.tile_size
+        return (slice(int(rows.min()) * size, min((int(rows.max()) + 1) * size, self.shape[0])),
+                slice(int(cols.min()) * size, min((int(cols.max()) + 1) * size, self.shape[1])))
+
+    def take_cells(self, rows, cols):
+        """Returns the values of individual cells.
+
+        Args:
+            rows, cols: Row and column indices of the cells (arrays of the
+                        same shape), which must be within the map.
+
+        """
+        size = self.tile_size
+        return self._pool[self._slots[rows // size, cols // size], rows % size, cols % size]
+
+    def __getitem__(self, key):
+        if (type(key) is tuple and len(key) == 2
+                and isinstance(key[0], (int, np.integer)) and isinstance(key[1], (int, np.integer))):
+            row, col = key
+            if not (-self.shape[0] <= row < self.shape[0] and -self.shape[1] <= col < self.shape[1]):
+                raise IndexError(f"index {key} is out of bounds for shape {self.shape}")
+            row, col = row % self.shape[0], col % self.shape[1]
+            size = self.tile_size
+            return self._pool[self._slots[row // size, col // size], row % size, col % size]
+
+        rows, cols, squeeze = index_region(key, self.shape)
+        out = np.full((rows.stop - rows.start, cols.stop - cols.start),
+                      self.fill_value, dtype=self.dtype)
+
+        for (i, j), tile_region, out_region in self._overlapping(rows, cols):
+            slot = self._slots[i, j]
+            if slot:
+                out[out_region] = self._pool[slot][tile_region]
+
+        return out[squeeze]
+
+    def __setitem__(self, key, value):
+        rows, cols, squeeze = index_region(key, self.shape)
+        shape = (rows.stop - rows.start, cols.stop - cols.start)
+        indexed_shape = tuple(n for n, index in zip(shape, squeeze)
+                              if isinstance(index, slice))
+        value = np.broadcast_to(np.asarray(value, dtype=self.dtype),
+                                indexed_shape).reshape(shape)
+
+        for (i, j), tile_region, out_region in self._overlapping(rows, cols):
+            slot = self._slots[i, j] or self._allocate(i, j)
+            self._pool[slot][tile_region] = value[out_region]
+
+        self.dirty.mark((rows, cols))
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self[:, :]
+        return dense if dtype is None else dense.astype(dtype)
+
+    def _allocate(self, i, j):
+        """Allocates tile (i, j) and returns its slot in the pool."""
+        self._allocated += 1
+        if self._allocated == len(self._pool):
+            # Grow the pool geometrically, so that tiles are copied O(1)
+            # times on average.
+            pool = np.empty((2 * len(self._pool),) + self._pool.shape[1:], dtype=self.dtype)
+            pool[:len(self._pool)] = self._pool
+            self._pool = pool
+
+        self._pool[self._allocated] = self.fill_value
+        self._slots[i, j] = self._allocated
+        return self._allocated
+
+    def _overlapping(self, rows, cols):
+        """Yields all tiles overlapping the region, with the overlapping part
+        of the region within the tile and within the region."""
+        size = self.tile_size
+        for i in self._tile_indices(rows):
+            row_start = max(rows.start, i * size)
+            row_stop = min(rows.stop, (i + 1) * size)
+            for j in self._tile_indices(cols):
+                col_start = max(cols.start, j * size)
+                col_stop = min(cols.stop, (j + 1) * size)
+
+                tile_region = (slice(row_start - i * size, row_stop - i * size),
+                               slice(col_start - j * size, col_stop - j * size))
+                out_region = (slice(row_start - rows.start, row_stop - rows.start),
+                              slice(col_start - cols.start, col_stop - cols.start))
+                yield (i, j), tile_region, out_region
+
+    def _tile_indices(self, cells):
+        """Returns the range of tile indices covering a slice of cells."""
+        if cells.stop <= cells.start:
+            return range(0)
+
+        return range(cells.start // self.tile_size, (cells.stop - 1) // self.tile_size + 1)
+
+
+def obstacle_mask(gridmap, threshold, out=None):
+    """Returns whether each cell of the map is an obstacle, i.e. greater than
+    threshold.
+
+    `TiledGridMap`s are compared tile by tile, without a dense copy.
+
+    Args:
+        out: Optional boolean array of the shape of the map to write to.
+
+    """
+    if out is None:
+        out = np.empty(np.shape(gridmap), dtype=bool)
+
+    if isinstance(gridmap, TiledGridMap):
+        out[...] = gridmap.fill_value > threshold
+        for region, tile in gridmap.tiles():
+            np.greater(tile, threshold, out=out[region])
+    else:
+        np.greater(gridmap, threshold, out=out)
+
+    return out
+
+
+class QuantizedLogOddsMap:
+    """Occupancy grid map storing log odds as fixed point integers.
+
+    Log odds are bounded, hence they can be stored as small integers (int8
+    or int16) instead of float64, i.e. in 1/8th or 1/4th of the memory.
+    Updates are applied as saturating integer additions; probabilities are
+    only computed when requested.
+
+    Indexing works like with a 2D numpy array of (float) log odds: reading
+    returns the dequantized log odds, writing quantizes the values.
+
+    """
+
+    ndim = 2
+
+    def __init__(self, shape, bounds, dtype=np.int8, resolution=None):
+        """
+        Creates a new quantized log odds map, with all cells unknown.
+
+        Args:
+            shape: Number of rows and columns of the map.
+            bounds: Minimum and maximum log odd value.
+            dtype: Integer type used to store the log odds.
+            resolution: Log odd value of one integer step. Defaults to the
+                        finest power of ten for which `bounds` fit `dtype`.
+
+        """
+        self.dtype = np.dtype(dtype)
+        if resolution is None:
+            largest = max(abs(bound) for bound in bounds)
+            resolution = 10.0 ** np.ceil(np.log10(largest / np.iinfo(self.dtype).max))
+
+        self.resolution = resolution
+        self.bounds = bounds
+        self.levels = tuple(int(round(bound / resolution)) for bound in bounds)
+
+        info = np.iinfo(self.dtype)
+        if self.levels[0] < info.min or self.levels[1] > info.max:
+            raise ValueError(f"Log odds {bounds} do not fit into {self.dtype} "
+                             f"with a resolution of {resolution}")
+
+        self.data = np.zeros(shape, dtype=self.dtype)
+        self.shape = self.data.shape
+        self.dirty = DirtyRegions(self.shape)
+
+        # Steps are limited to the span of the bounds, so that adding them to
+        # any stored value cannot overflow, as long as the dtype has enough
+        # headroom. Otherwise, additions are carried out in a wider type.
+        low, high = self.levels
+        self.max_step = high - low
+        self._in_place = (2 * low - high >= info.min and 2 * high - low <= info.max)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def quantize(self, log_odds):
+        """Converts log odds to (saturated) integer steps."""
+        steps = np.rint(np.asarray(log_odds) / self.resolution)
+        return np.clip(steps, *self.levels).astype(self.dtype)
+
+    def steps(self, log_odds):
+        """Converts log odd updates to integer steps, as used by `add_steps`."""
+        steps = np.rint(np.asarray(log_odds) / self.resolution)
+        return np.clip(steps, -self.max_step, self.max_step).astype(self.dtype)
+
+    def add_steps(self, region, steps):
+        """Adds integer steps to a region of the map, saturating at the bounds.
+
+        Args:
+            region: Index of the region to update, e.g. row and column slices.
+            steps: Integer steps to add (see `steps`), broadcastable to the region.
+
+        """
+        if self._in_place:
+            values = self.data[region]
+            np.add(values, steps, out=values, casting='unsafe')
+            np.clip(values, *self.levels, out=values)
+            if not np.shares_memory(values, self.data):
+                self.data[region] = values
+        else:
+            values = self.data[region].astype(np.int64)
+            values += steps
+            np.clip(values, *self.levels, out=values)
+            self.data[region] = values
+
+        self._mark(region)
+
+    def add_log_odds(self, region, log_odds):
+        """Adds log odds to a region of the map, saturating at the bounds.
+
+        Args:
+            region: Index of the region to update, e.g. row and column slices.
+            log_odds: Log odds to add, broadcastable to the region.
+
+        """
+        self.add_steps(region, self.steps(log_odds))
+
+    def probability(self, region=Ellipsis):
+        """Returns the occupancy probability of a region (the whole map by default)."""
+        return 1.0 - 1.0 / (1.0 + np.exp(self[region]))
+
+    def __getitem__(self, key):
+        return self.data[key] * self.resolution
+
+    def __setitem__(self, key, value):
+        self.data[key] = self.quantize(value)
+        self._mark(key)
+
+    def _mark(self, key):
+        if (isinstance(key, tuple) and len(key) == 2
+                and all(isinstance(index, np.ndarray) and index.dtype.kind in 'iu'
+                        for index in key)):
+            # Individual cells, e.g. the cells traversed by rays
+            self.dirty.mark_cells(*key)
+            return
+
+        try:
+            rows, cols, _ = index_region(key, self.shape)
+        except IndexError:
+            # E.g. boolean masks, mark the whole map
+            self.dirty.mark_all()
+        else:
+            self.dirty.mark((rows, cols))
+
+    def __array__(self, dtype=None, copy=None):
+        log_odds = self[...]
+        return log_odds if dtype is None else log_odds.astype(dtype)
+
+
+class MapPyramid:
+    """Multi resolution representation of a map.
+
+    Each level is a max pooled (i.e. conservative, occupied cells dominate)
+    version of the level below, with level 0 being the map itself. Coarse
+    queries, e.g. overviews or hierarchical planning, can use the coarser
+    levels instead of resampling the whole map.
+
+    The pyramid subscribes to the changes of the map and only recomputes the
+    cells above changed regions on `update`.
+
+    """
+
+    def __init__(self, gridmap, levels=4, factor=2, dirty=None):
+        """
+        Creates a new pyramid over a map.
+
+        Args:
+            gridmap: The map (level 0).
+            levels: Number of coarse levels on top of the map.
+            factor: Number of cells (per dimension) pooled into one cell of
+                    the next level.
+            dirty: `DirtyRegions` tracking the changes of the map. Defaults
+                   to a subscription to the maps own tracker.
+
+        """
+        self.gridmap = gridmap
+        self.factor = factor
+        self.dirty = dirty if dirty is not None else gridmap.dirty.subscribe()
+
+        self.levels = []
+        if isinstance(gridmap, TiledGridMap):
+            # Cells above absent tiles hold the fill value, only the cells
+            # above allocated tiles are pooled.
+            shape = gridmap.shape
+            for _ in range(levels):
+                shape = (-(-shape[0] // factor), -(-shape[1] // factor))
+                self.levels.append(np.full(shape, float(gridmap.fill_value)))
+
+            allocated = DirtyRegions(gridmap.shape, gridmap.tile_size)
+            for region, _ in gridmap.tiles():
+                allocated.mark(region)
+            self._pool_regions(allocated.drain())
+        else:
+            source = np.asarray(gridmap, dtype=np.float64)
+            for _ in range(levels):
+                source = self._pool(source)
+                self.levels.append(source)
+
+    def __len__(self):
+        return len(self.levels) + 1
+
+    def level(self, index):
+        """Returns a level of the pyramid, where 0 is the map itself."""
+        if index == 0:
+            return self.gridmap
+
+        return self.levels[index - 1]
+
+    def update(self):
+        """Recomputes the cells above all regions changed since the last update.
+
+        Returns:
+            The changed regions of the map.
+
+        """
+        regions = self.dirty.drain()
+        self._pool_regions(regions)
+        return regions
+
+    def _pool_regions(self, regions):
+        """Recomputes the cells of all levels above the regions of the map."""
+        f = self.factor
+        for rows, cols in regions:
+            for index, level in enumerate(self.levels):
+                below = self.level(index)
+
+                # Cells of this level covering the region of the level below
+                top, left = rows.start // f, cols.start // f
+                bottom = min(-(-rows.stop // f), level.shape[0])
+                right = min(-(-cols.stop // f), level.shape[1])
+
+                block = below[top * f:min(bottom * f, below.shape[0]),
+                              left * f:min(right * f, below.shape[1])]
+                level[top:bottom, left:right] = self._pool(
+                    np.asarray(block, dtype=np.float64))
+
+                rows, cols = slice(top, bottom), slice(left, right)
+
+    def _pool(self, source):
+        """Max pools blocks of `factor` x `factor` cells."""
+        f = self.factor
+        height, width = source.shape
+        padded = np.full((-(-height // f) * f, -(-width // f) * f), -np.inf)
+        padded[:height, :width] = source
+
+        return padded.reshape(padded.shape[0] // f, f, padded.shape[1] // f, f).max(axis=(1, 3))
+
+
+class DistanceField:
+    """Euclidean distance from each cell to the nearest obstacle.
+
+    Distances are truncated at `max_distance`, hence a change of the map only
+    affects the distances within `max_distance` of that change. The field
+    subscribes to the changes of the map and only recomputes those distances
+    on `update`, while lookups are plain array accesses.
+
+    """
+
+    def __init__(self, gridmap, threshold=0.0, max_distance=20, cell_size=1.0, origin=(0.0, 0.0),
+                 dirty=None):
+        """
+        Creates a new distance field over a map.
+
+        Args:
+            gridmap: The map. A cell is considered an obstacle if its value
+                     is greater than `threshold`.
+            threshold: Threshold to determine whether a cell is an obstacle.
+            max_distance: Distances are truncated at this value (cells).
+            cell_size: Size of a cell, used by `clearance` to convert
+                       coordinates and distances.
+            origin: Coordinates (x, y) of the corner of cell (0, 0), used by
+                    `clearance`.
+            dirty: `DirtyRegions` tracking the changes of the map. Defaults
+                   to a subscription to the maps own tracker.
+
+        """
+        self.gridmap = gridmap
+        self.threshold = threshold
+        self.max_distance = max_distance
+        self.cell_size = cell_size
+        self.origin = origin
+        self.dirty = dirty if dirty is not None else gridmap.dirty.subscribe()
+
+        self.shape = tuple(gridmap.shape)
+        if isinstance(gridmap, TiledGridMap) and gridmap.fill_value <= threshold:
+            # All obstacles are within the allocated tiles, cells further
+            # away than `max_distance` keep the truncated distance.
+            self.distances = np.full(self.shape, float(max_distance))
+            extent = gridmap.extent()
+            if extent is not None:
+                window = self._grow(*extent, int(np.ceil(max_distance)))
+                self.distances[window] = self._compute(*window)
+        else:
+            self.distances = self._compute(slice(0, self.shape[0]), slice(0, self.shape[1]))
+
+    def __getitem__(self, key):
+        """Distances (in cells) of the indexed cells."""
+        return self.distances[key]
+
+    def clearance(self, x, y):
+        """Returns the distance from position (x, y) to the nearest obstacle.
+
+        Coordinates and distance are in units of `cell_size`, coordinates
+        are in the same frame as `origin`.
+
+        Raises:
+            IndexError if the position is outside of the map.
+
+        """
+        row = int(np.floor((y - self.origin[1]) / self.cell_size))
+        col = int(np.floor((x - self.origin[0]) / self.cell_size))
+        if not (0 <= row < self.shape[0] and 0 <= col < self.shape[1]):
+            raise IndexError(f"Position ({x}, {y}) is outside of the map")
+        return self.distances[row, col] * self.cell_size
+
+    def update(self):
+        """Recomputes the distances around all regions changed since the last update.
+
+        Returns:
+            The regions whose distances were recomputed.
+
+        """
+        reach = int(np.ceil(self.max_distance))
+        updated = []
+
+        for rows, cols in self.dirty.drain():
+            # Distances within `reach` of the region may have changed, and
+            # depend on obstacles within `reach` of those cells.
+            inner = self._grow(rows, cols, reach)
+            window = self._grow(rows, cols, 2 * reach)
+
+            distances = self._compute(*window)
+            self.distances[inner] = distances[
+                inner[0].start - window[0].start:inner[0].stop - window[0].start,
+                inner[1].start - window[1].start:inner[1].stop - window[1].start]
+            updated.append(inner)
+
+        return updated
+
+    def _grow(self, rows, cols, margin):
+        return (slice(max(rows.start - margin, 0), min(rows.stop + margin, self.shape[0])),
+                slice(max(cols.start - margin, 0), min(cols.stop + margin, self.shape[1])))
+
+    def _compute(self, rows, cols):
+        free = np.asarray(self.gridmap[rows, cols]) <= self.threshold
+        if free.all():
+            return np.full(free.shape, float(self.max_distance))
+
+        distances = distance_transform_edt(free)
+        return np.minimum(distances, self.max_distance, out=distances)
@@ -1,4 +1,311 @@
-from .gridmap import OccupancyGridMap
+"""
+Tests for the grid map models.
+"""
+import numpy as np
+import pytest
 
+from hypothesis import given, settings
+import hypothesis.strategies as some
 
+from stellar.cognition import mapping
+from stellar.models import astar
+from stellar.models.gridmap import (DirtyRegions, DistanceField, MapPyramid,
+                                    QuantizedLogOddsMap, TiledGridMap)
 
+
+def test_tiled_grid_map_reads_absent_tiles_as_unknown():
+    """
+    Cells of tiles that were never written read as fill value, without
+    allocating tiles.
+    """
+    gridmap = TiledGridMap((1000, 1000), tile_size=32, fill_value=0.5)
+
+    assert gridmap[10, 999] == 0.5
+    assert np.all(gridmap[100:200, 300:400] == 0.5)
+    assert gridmap.nbytes == 0
+
+
+def test_tiled_grid_map_allocates_tiles_on_first_write():
+    """
+    Writing a region only allocates the tiles overlapping that region.
+    """
+    gridmap = TiledGridMap((1000, 1000), tile_size=32)
+    gridmap[30:40, 60:70] = 1.0
+
+    assert len(list(gridmap.tiles())) == 4
+    assert gridmap[30:40, 60:70].sum() == 100
+    assert gridmap[:, :].sum() == 100
+
+
+def test_tiled_grid_map_reads_cells_from_tiles():
+    """
+    Single cells and arrays of cells are read from their tiles, or as fill
+    value from absent ones, also while the pool of tiles grows.
+    """
+    dense = np.full((100, 70), -1.0)
+    gridmap = TiledGridMap(dense.shape, tile_size=8, fill_value=-1.0)
+    rng = np.random.default_rng(0)
+    for row, col in rng.integers(0, 70, (40, 2)):
+        dense[row, col] = gridmap[row, col] = row + col / 100
+
+    rows, cols = np.meshgrid(np.arange(100), np.arange(70), indexing='ij')
+    assert np.array_equal(gridmap.take_cells(rows, cols), dense)
+    assert gridmap[-1, -1] == dense[-1, -1]
+    assert all(gridmap[int(row), int(col)] == dense[row, col]
+               for row, col in rng.integers(0, 70, (100, 2)))
+    with pytest.raises(IndexError):
+        gridmap[100, 0]
+
+    extent = gridmap.extent()
+    assert np.all(dense[:extent[0].start] == -1) and np.all(dense[extent[0].stop:] == -1)
+    assert TiledGridMap((10, 10)).extent() is None
+
+
+slices = some.tuples(some.integers(min_value=-60, max_value=60),
+                     some.integers(min_value=-60, max_value=60)).map(lambda s: slice(*s))
+indices = some.one_of(some.integers(min_value=-50, max_value=49), slices)
+
+
+@settings(max_examples=100, deadline=None)
+@given(some.tuples(indices, indices), some.floats(min_value=-5, max_value=5))
+def test_tiled_grid_map_indexes_like_numpy(key, value):
+    """
+    Reading and writing regions must behave like with numpy arrays.
+    """
+    dense = np.zeros((50, 50))
+    gridmap = TiledGridMap(dense.shape, tile_size=8)
+
+    dense[key] += value
+    gridmap[key] += value
+
+    assert np.array_equal(gridmap[key], dense[key])
+    assert np.array_equal(np.asarray(gridmap), dense)
+
+
+def test_tiled_grid_map_raises_on_out_of_bounds_index():
+    gridmap = TiledGridMap((50, 50))
+    with pytest.raises(IndexError):
+        gridmap[50, 0]
+
+
+@pytest.mark.parametrize("model", ['cone', 'beam'])
+def test_mapping_on_tiled_grid_map_matches_dense_map(model):
+    """
+    Mapping must produce the same result on tiled and dense maps.
+    """
+    measurements = [(0, 20), (np.pi / 2, 7), (-np.pi / 2, -1)]
+    pose = (70, 40, np.radians(30))
+
+    dense = np.zeros((200, 200))
+    gridmap = TiledGridMap(dense.shape, tile_size=16)
+    for gm in (dense, gridmap):
+        mapping.fuse_measurements(gm, pose, measurements, np.radians(15), 40, model=model)
+        mapping.update_occupancy_map(gm, pose, 3, 0, np.radians(15), 40, model=model)
+
+    assert np.array_equal(np.asarray(gridmap), dense)
+    assert gridmap.nbytes < dense.nbytes
+
+
+@pytest.mark.parametrize("dtype", [np.int8, np.int16])
+def test_quantized_map_saturates_at_log_odd_bounds(dtype):
+    """
+    Integer additions must saturate instead of overflowing.
+    """
+    bounds = (mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX)
+    gridmap = QuantizedLogOddsMap((10, 10), bounds, dtype=dtype)
+
+    for _ in range(100):
+        gridmap.add_log_odds((slice(0, 5), slice(None)), mapping.LOG_ODD_OCCU)
+        gridmap.add_log_odds((slice(5, 10), slice(None)), -mapping.LOG_ODD_FREE)
+
+    assert np.all(gridmap[:5] == pytest.approx(mapping.LOG_ODD_MAX))
+    assert np.all(gridmap[5:] == pytest.approx(mapping.LOG_ODD_MIN))
+    assert gridmap.probability()[0, 0] == pytest.approx(1 - 1 / (1 + np.exp(5)))
+
+
+@pytest.mark.parametrize("model", ['cone', 'beam'])
+@pytest.mark.parametrize("dtype", [np.int8, np.int16])
+def test_mapping_on_quantized_map_matches_float_map(dtype, model):
+    """
+    Log odd updates are multiples of the resolution, hence the quantized map
+    must match the float64 map.
+    """
+    bounds = (mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX)
+    dense = np.zeros((200, 200))
+    gridmap = QuantizedLogOddsMap(dense.shape, bounds, dtype=dtype)
+
+    for theta in np.radians([0, 30, 60, 90]):
+        measurements = [(0, 20), (np.pi / 2, 7), (-np.pi / 2, -1)]
+        for gm in (dense, gridmap):
+            mapping.fuse_measurements(gm, (100, 100, theta), measurements,
+                                      np.radians(15), 40, model=model)
+            mapping.update_occupancy_map(gm, (100, 100, theta), 5, 0,
+                                         np.radians(15), 40, model=model)
+
+    assert np.asarray(gridmap) == pytest.approx(dense)
+    assert gridmap.nbytes == dense.nbytes // (8 // np.dtype(dtype).itemsize)
+
+
+def test_dirty_regions_merge_changed_tiles_into_rectangles():
+    """
+    Changed tiles are drained as merged rectangles, clipped to the map.
+    """
+    dirty = DirtyRegions((100, 100), tile_size=10)
+    dirty.mark((slice(5, 25), slice(12, 38)))
+    dirty.mark((slice(95, 100), slice(95, 100)))
+
+    assert dirty.drain() == [(slice(0, 30), slice(10, 40)),
+                             (slice(90, 100), slice(90, 100))]
+    assert not dirty
+    assert dirty.drain() == []
+
+
+def test_dirty_regions_subscribers_drain_independently():
+    dirty = DirtyRegions((100, 100), tile_size=10)
+    first, second = dirty.subscribe(), dirty.subscribe()
+
+    dirty.mark((slice(0, 5), slice(0, 5)))
+    assert first.drain() == [(slice(0, 10), slice(0, 10))]
+    assert not first
+    assert second
+
+
+def test_dirty_regions_mark_tiles_of_cells():
+    dirty = DirtyRegions((100, 100), tile_size=10)
+    first = dirty.subscribe()
+    dirty.mark_cells(np.array([5, 15, 99, 7]), np.array([12, 12, 0, 19]))
+
+    assert dirty.drain() == [(slice(0, 20), slice(10, 20)),
+                             (slice(90, 100), slice(0, 10))]
+    assert len(first) == 3
+
+
+@pytest.mark.parametrize("model", ['cone', 'beam'])
+@pytest.mark.parametrize("make_map", [
+    lambda: TiledGridMap((200, 200), tile_size=16),
+    lambda: QuantizedLogOddsMap((200, 200), (mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX))])
+def test_maps_track_changed_regions(make_map, model):
+    """
+    Maps keep track of their changes, covering all updated cells.
+    """
+    gridmap = make_map()
+    before = np.asarray(gridmap).copy()
+    mapping.fuse_measurements(gridmap, (100, 100, 0), [(0, 20), (np.pi / 2, 7)],
+                              np.radians(15), 40, model=model)
+
+    changed = np.zeros(gridmap.shape, dtype=bool)
+    for region in gridmap.dirty.drain():
+        changed[region] = True
+
+    assert changed.sum() < changed.size
+    assert not np.any((np.asarray(gridmap) != before) & ~changed)
+
+
+def max_pool(gridmap, factor):
+    height, width = gridmap.shape
+    return np.array([[gridmap[i:i + factor, j:j + factor].max()
+                      for j in range(0, width, factor)]
+                     for i in range(0, height, factor)])
+
+
+def test_map_pyramid_is_max_pooled_after_updates():
+    """
+    Incremental updates of the pyramid must match pooling the whole map.
+    """
+    gridmap = TiledGridMap((203, 190), tile_size=16)
+    pyramid = MapPyramid(gridmap, levels=3, factor=2)
+
+    for x, theta in [(20, 0), (100, 1), (180, 2.5)]:
+        mapping.fuse_measurements(gridmap, (x, 100, theta),
+                                  [(0, 20), (np.pi / 2, 7), (-np.pi / 2, -1)],
+                                  np.radians(15), 40)
+        assert pyramid.update()
+
+    expected = np.asarray(gridmap)
+    for index in range(1, len(pyramid)):
+        expected = max_pool(expected, 2)
+        assert np.array_equal(pyramid.level(index), expected)
+
+
+def test_map_pyramid_and_distance_field_build_from_allocated_tiles():
+    """
+    Building over a tiled map, only its allocated tiles are read, which must
+    match building over the dense map.
+    """
+    gridmap = TiledGridMap((203, 190), tile_size=16)
+    gridmap[60:64, 100:140] = mapping.LOG_ODD_MAX
+    gridmap[150:170, 30:33] = mapping.LOG_ODD_MIN
+    gridmap[180, 185] = 1
+    dense = np.asarray(gridmap)
+
+    pyramid = MapPyramid(gridmap, levels=3, factor=2, dirty=DirtyRegions(gridmap.shape))
+    expected = MapPyramid(dense, levels=3, factor=2, dirty=DirtyRegions(gridmap.shape))
+    for index in range(1, len(pyramid)):
+        assert np.array_equal(pyramid.level(index), expected.level(index))
+
+    field = DistanceField(gridmap, max_distance=12, dirty=DirtyRegions(gridmap.shape))
+    expected = DistanceField(dense, max_distance=12, dirty=DirtyRegions(gridmap.shape))
+    assert np.array_equal(field[:, :], expected[:, :])
+
+
+def test_distance_field_matches_full_transform_after_updates():
+    """
+    Recomputing the distances around changed regions must match computing
+    the distances of the whole map.
+    """
+    gridmap = TiledGridMap((150, 220), tile_size=16)
+    gridmap[60:64, 100:140] = mapping.LOG_ODD_MAX
+    field = DistanceField(gridmap, max_distance=12)
+
+    for x, theta in [(20, 0), (100, 1), (200, 2.5)]:
+        mapping.fuse_measurements(gridmap, (x, 100, theta),
+                                  [(0, 20), (np.pi / 2, 7), (-np.pi / 2, -1)],
+                                  np.radians(15), 40)
+        gridmap[60:64, x // 2:x // 2 + 4] = mapping.LOG_ODD_MIN
+        assert field.update()
+
+    expected = DistanceField(gridmap, max_distance=12, dirty=DirtyRegions(gridmap.shape))
+    assert np.array_equal(field[:, :], expected[:, :])
+    assert field[62, 120] == 0
+    assert field[0, 0] == 12
+
+
+def test_astar_planner_checks_collisions_with_distance_field():
+    astar.show_animation = False
+    gridmap = np.zeros((50, 50))
+    gridmap[:, 25] = 1
+    field = DistanceField(gridmap, max_distance=10, cell_size=0.5,
+                          dirty=DirtyRegions(gridmap.shape))
+
+    ox, oy = np.array([0.0, 25.0]), np.array([0.0, 25.0])
+    planner = astar.AStarPlanner(ox, oy, 0.5, 1.0, distance_field=field)
+
+    assert planner.verify_node(planner.Node(10, 10, 0.0, -1))
+    assert not planner.verify_node(planner.Node(24, 10, 0.0, -1))
+    assert not planner.verify_node(planner.Node(27, 10, 0.0, -1))
+    assert planner.verify_node(planner.Node(28, 10, 0.0, -1))
+
+
+def test_astar_planner_looks_up_clearance_relative_to_origin():
+    """
+    Like the obstacles of `astar.main`, the map starts at -10 m, hence
+    positions must be shifted by the origin before looking up cells.
+    """
+    astar.show_animation = False
+    gridmap = np.zeros((35, 35))
+    gridmap[:, [2, 15]] = 1     # walls at x = -6 m and x = 20 m
+    field = DistanceField(gridmap, max_distance=10, cell_size=2.0, origin=(-10.0, -10.0),
+                          dirty=DirtyRegions(gridmap.shape))
+
+    ox, oy = np.array([-10.0, 60.0]), np.array([-10.0, 60.0])
+    planner = astar.AStarPlanner(ox, oy, 2.0, 1.0, distance_field=field)
+
+    assert planner.verify_node(planner.Node(8, 10, 0.0, -1))
+    assert not planner.verify_node(planner.Node(2, 10, 0.0, -1))
+    assert not planner.verify_node(planner.Node(15, 10, 0.0, -1))
+
+    assert field.clearance(-9.5, 0.0) == 2 * 2.0
+    with pytest.raises(IndexError):
+        field.clearance(-10.5, 0.0)
+    with pytest.raises(IndexError):
+        field.clearance(0.0, 60.0)
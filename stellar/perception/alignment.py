@@ -0,0 +1,204 @@
+"""
+Chronological alignment of sensor signals.
+
+Sonar, odometry and camera signals arrive at different rates. Each channel
+keeps its most recent samples in a fixed-capacity ring buffer with
+monotonically increasing timestamps, such that the signals of all channels
+can be looked up (nearest sample) or interpolated at any point in time.
+
+Buffers are preallocated and never grow. A buffer expects a single writer,
+but may be read from other threads without a lock: appending a sample
+increments a sequence counter before and after the buffer is modified, and
+readers retry until they read while no sample was being appended (i.e. a
+seqlock).
+"""
+import time
+
+import numpy as np
+
+
+class SignalBuffer:
+    """Ring buffer of the most recent timestamped samples of one channel."""
+
+    def __init__(self, capacity, width=1, dtype=np.float64, periodic=()):
+        """
+        Args:
+            capacity: Maximum number of samples, the oldest samples are
+                      overwritten once the buffer is full.
+            width: Number of values per sample.
+            dtype: Type of the values.
+            periodic: Indices of values that are angles (rad), which are
+                      interpolated along the shorter arc.
+
+        """
+        self.capacity = capacity
+        self.width = width
+        self.timestamps = np.zeros(capacity)
+        self.values = np.zeros((capacity, width), dtype=dtype)
+        self.periodic = np.zeros(width, dtype=bool)
+        self.periodic[list(periodic)] = True
+
+        self._start = 0
+        self._count = 0
+        self._sequence = 0  # Odd while a sample is being appended
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        """Adds a sample.
+
+        Raises:
+            ValueError if the timestamp precedes the latest sample.
+
+        """
+        if self._count and timestamp < self.timestamps[self._index(self._count - 1)]:
+            raise ValueError(f"Timestamp {timestamp} precedes latest sample")
+
+        self._sequence += 1
+        if self._count < self.capacity:
+            index = self._index(self._count)
+            self.timestamps[index] = timestamp
+            self.values[index] = value
+            self._count += 1
+        else:
+            index = self._start
+            self.timestamps[index] = timestamp
+            self.values[index] = value
+            self._start = (self._start + 1) % self.capacity
+        self._sequence += 1
+
+    def span(self):
+        """Timestamps of the oldest and the latest sample."""
+        return self._read(self._span)
+
+    def latest(self):
+        """Timestamp and values of the latest sample."""
+        return self._read(lambda: self._sample(self._count - 1))
+
+    def sample(self, i):
+        """Timestamp and values of the i-th oldest sample."""
+        return self._read(self._sample, i)
+
+    def nearest(self, timestamp):
+        """Timestamp and values of the sample closest in time."""
+        return self._read(self._nearest, timestamp)
+
+    def interpolate(self, timestamp):
+        """Linearly interpolates the values at a point in time.
+
+        Raises:
+            ValueError if the timestamp is outside of the buffered span.
+
+        """
+        return self._read(self._interpolate, timestamp)
+
+    def window(self, start, stop):
+        """Timestamps and values of all samples within [start, stop), oldest first."""
+        return self._read(self._window, start, stop)
+
+    def _read(self, read, *args):
+        """Calls read(*args) until no sample was appended meanwhile.
+
+        Errors are only raised if they were not caused by a concurrent append.
+        """
+        while True:
+            sequence = self._sequence
+            if sequence % 2:
+                time.sleep(0)  # Let the writer finish
+                continue
+            try:
+                result = read(*args)
+            except (IndexError, ValueError):
+                if self._sequence == sequence:
+                    raise
+                continue
+            if self._sequence == sequence:
+                return result
+
+    def _span(self):
+        if not self._count:
+            raise ValueError("Buffer is empty")
+        return (self.timestamps[self._start], self.timestamps[self._index(self._count - 1)])
+
+    def _sample(self, i):
+        if not -self._count <= i < self._count:
+            raise IndexError(f"Sample {i} out of range")
+        index = self._index(i % self._count)
+        return self.timestamps[index], self.values[index].copy()
+
+    def _nearest(self, timestamp):
+        i = self._search(timestamp)
+        if i == self._count or (i > 0 and timestamp - self._timestamp(i - 1)
+                                <= self._timestamp(i) - timestamp):
+            i -= 1
+        return self._sample(i)
+
+    def _interpolate(self, timestamp):
+        oldest, latest = self._span()
+        if not oldest <= timestamp <= latest:
+            raise ValueError(f"Timestamp {timestamp} outside of [{oldest}, {latest}]")
+
+        i = self._search(timestamp)
+        t1, v1 = self._sample(i)
+        if t1 == timestamp or i == 0:
+            return v1
+        t0, v0 = self._sample(i - 1)
+
+        delta = v1 - v0
+        delta[self.periodic] = (delta[self.periodic] + np.pi) % (2 * np.pi) - np.pi
+        value = v0 + delta * (timestamp - t0) / (t1 - t0)
+        value[self.periodic] %= 2 * np.pi
+        return value
+
+    def _window(self, start, stop):
+        first, last = self._search(start), self._search(stop)
+        indices = self._index(np.arange(first, last))
+        return self.timestamps[indices], self.values[indices]
+
+    def _index(self, i):
+        """Position of the i-th oldest sample in the arrays."""
+        return (self._start + i) % self.capacity
+
+    def _timestamp(self, i):
+        return self.timestamps[self._index(i)]
+
+    def _search(self, timestamp):
+        """Number of samples older than timestamp, by bisecting both sorted
+        segments of the ring."""
+        head = self.timestamps[self._start:min(self._start + self._count, self.capacity)]
+        tail = self.timestamps[:max(self._start + self._count - self.capacity, 0)]
+        return (int(np.searchsorted(head, timestamp))
+                + int(np.searchsorted(tail, timestamp)))
+
+
+class SignalAlignment:
+    """Aligns the signals of multiple channels in time."""
+
+    def __init__(self):
+        self.channels = {}
+
+    def add_channel(self, name, capacity, width=1, dtype=np.float64, periodic=()):
+        """Adds a channel, see `SignalBuffer`, and returns its buffer."""
+        self.channels[name] = SignalBuffer(capacity, width, dtype, periodic)
+        return self.channels[name]
+
+    def append(self, name, timestamp, value):
+        self.channels[name].append(timestamp, value)
+
+    def align(self, timestamp, interpolate=True):
+        """Returns the values of all channels at a point in time.
+
+        Args:
+            timestamp: Point in time.
+            interpolate: Whether to interpolate the values, or to take the
+                         nearest samples.
+
+        Returns:
+            A dict of the values per channel name.
+
+        """
+        if interpolate:
+            return {name: buffer.interpolate(timestamp)
+                    for name, buffer in self.channels.items()}
+        return {name: buffer.nearest(timestamp)[1] for name, buffer in self.channels.items()}
@@ -0,0 +1,218 @@
+"""
+Record and replay sensor signals.
+
+A recording consists of two append-only files:
+
+    <name>.log      A header, followed by entries of a timestamp, the kind of
+                    the entry, the length of the payload and the payload.
+    <name>.idx      One fixed-size index entry (timestamp, offset of the log
+                    entry, kind) per log entry.
+
+Sensor entries hold the raw bytes as read from the tinyK22, i.e. including the
+UART framing, such that replaying them exercises the same decoding as a real
+drive. Camera entries reference a frame of a video instead of the image
+itself.
+
+Timestamps must not decrease, hence the index is sorted and time windows are
+found by bisection. `LogReader` memory maps the log and yields payloads as
+views into the map, without copying.
+"""
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+from stellar.perception.sourcing import load_records
+
+
+MAGIC = b'STLRLOG'
+VERSION = 1
+HEADER = struct.Struct('<7sB')
+ENTRY = struct.Struct('<dBI')
+INDEX_FORMAT = '<dQB'
+INDEX_NAMES = ['timestamp', 'offset', 'kind']
+INDEX_ENTRY = struct.Struct(INDEX_FORMAT)
+CAMERA_REFERENCE = struct.Struct('<Q')
+
+SENSORS = 0
+CAMERA = 1
+
+Entry = namedtuple('Entry', ['timestamp', 'kind', 'payload'])
+Entry.__doc__ = """An entry of a recording.
+
+timestamp:  Time of the entry (s).
+kind:       SENSORS or CAMERA.
+payload:    The recorded bytes, a memoryview into the log.
+"""
+
+
+def _paths(path):
+    path = Path(path)
+    return path.with_suffix('.log'), path.with_suffix('.idx')
+
+
+class Recorder:
+    """Appends sensor signals and camera frame references to a recording."""
+
+    def __init__(self, path, clock=time.time):
+        """
+        Args:
+            path: Path of the recording, without suffix. An existing
+                  recording is appended to.
+            clock: Source of the timestamps, if not passed explicitly.
+
+        """
+        self.log_path, self.index_path = _paths(path)
+        self.clock = clock
+        self.log = open(self.log_path, 'ab')
+        self.index = open(self.index_path, 'ab')
+
+        self.offset = self.log.tell()
+        self.latest = -np.inf
+        if self.offset == 0:
+            self.log.write(HEADER.pack(MAGIC, VERSION))
+            self.offset = HEADER.size
+        elif self.index.tell() >= INDEX_ENTRY.size:
+            with open(self.index_path, 'rb') as index:
+                index.seek(-INDEX_ENTRY.size, 2)
+                self.latest = INDEX_ENTRY.unpack(index.read())[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, payload, kind=SENSORS, timestamp=None):
+        """Appends an entry.
+
+        Raises:
+            ValueError if the timestamp precedes the latest entry.
+
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        if timestamp < self.latest:
+            raise ValueError(f"Timestamp {timestamp} precedes latest entry")
+
+        self.log.write(ENTRY.pack(timestamp, kind, len(payload)))
+        self.log.write(payload)
+        self.index.write(INDEX_ENTRY.pack(timestamp, self.offset, kind))
+        self.offset += ENTRY.size + len(payload)
+        self.latest = timestamp
+
+    def record_camera(self, source, frame, timestamp=None):
+        """Appends a reference to a frame of a video, see `camera_reference`."""
+        self.record(CAMERA_REFERENCE.pack(frame) + str(source).encode('utf-8'),
+                    CAMERA, timestamp)
+
+    def flush(self):
+        self.log.flush()
+        self.index.flush()
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+
+def camera_reference(payload):
+    """Decodes the payload of a camera entry into the video source and frame number."""
+    frame, = CAMERA_REFERENCE.unpack_from(payload)
+    return bytes(payload[CAMERA_REFERENCE.size:]).decode('utf-8'), frame
+
+
+class LogReader:
+    """Reads a recording, see `Recorder`.
+
+    Payloads are views into the memory mapped log, they must be released
+    before the reader is closed.
+    """
+
+    def __init__(self, path):
+        """
+        Raises:
+            ValueError if the file is not a recording or of another version.
+
+        """
+        self.log_path, self.index_path = _paths(path)
+        with open(self.log_path, 'rb') as log:
+            # Empty files can not be memory mapped
+            if os.fstat(log.fileno()).st_size < HEADER.size:
+                raise ValueError(f"{self.log_path} is not a recording of version {VERSION}, "
+                                 f"it is too short for a header")
+            self.map = mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, version = HEADER.unpack_from(self.view)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{self.log_path} is not a recording of version {VERSION}")
+
+        # Ignore index entries of log entries that were not (entirely) written.
+        index = load_records(self.index_path, INDEX_FORMAT, INDEX_NAMES)
+        complete = len(index)
+        while complete and (index['offset'][complete - 1] + ENTRY.size > len(self.map)
+                            or self._end(index['offset'][complete - 1]) > len(self.map)):
+            complete -= 1
+        self.index = index[:complete]
+        self.timestamps = self.index['timestamp']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def span(self):
+        """Timestamps of the first and the last entry, None if there are no
+        entries."""
+        if not len(self.timestamps):
+            return None
+        return (self.timestamps[0], self.timestamps[-1])
+
+    def window(self, start=-np.inf, stop=np.inf, kind=None):
+        """Yields the entries within [start, stop), oldest first.
+
+        Args:
+            start, stop: Time window (s).
+            kind: Only entries of this kind, if given.
+
+        """
+        first, last = np.searchsorted(self.timestamps, (start, stop))
+        index = self.index[first:last]
+        if kind is not None:
+            index = index[index['kind'] == kind]
+
+        for offset in index['offset'].tolist():
+            timestamp, entry_kind, length = ENTRY.unpack_from(self.view, offset)
+            begin = offset + ENTRY.size
+            yield Entry(timestamp, entry_kind, self.view[begin:begin + length])
+
+    def replay(self, decoder, start=-np.inf, stop=np.inf):
+        """Decodes the recorded sensor signals within [start, stop).
+
+        Args:
+            decoder: `StreamDecoder` matching the recorded stream.
+
+        Yields:
+            The timestamp of the entry completing a record and the values of
+            the record.
+
+        """
+        for timestamp, _, payload in self.window(start, stop, SENSORS):
+            for values in decoder.decode(payload):
+                yield timestamp, values
+
+    def close(self):
+        self.index = self.timestamps = None
+        self.view.release()
+        self.map.close()
+
+    def _end(self, offset):
+        return offset + ENTRY.size + ENTRY.unpack_from(self.view, offset)[2]
@@ -2,11 +2,15 @@ import numpy as np
 from math import floor, ceil
 
 from bresenham import bresenham
+from scipy.ndimage import distance_transform_edt
+
+from stellar.models.gridmap import obstacle_mask
 
 import io
 import queue
 import struct
 import sys
+from collections import namedtuple
 from os import path
 from typing import List
 
@@ -20,32 +24,98 @@ picam_sim = None
 
 
 
+SonarSensor = namedtuple('SonarSensor', ['name', 'bearing', 'opening_angle', 'z_max'])
+SonarSensor.__doc__ = """Layout of a range sensor.
+
+name:           Name of the sensor.
+bearing:        Direction the sensor is facing, relative to robot (rad).
+opening_angle:  Opening angle of the sensor (rad).
+z_max:          Maximum distance (cells).
+"""
+
+
 class SensorArray:
     """An array of sensors."""
 
-    sonar_sensors = [
+    default_sonar_sensors = [
         ('front',   np.radians(0)),
         ('outter',  np.radians(90)),
         ('inner',   np.radians(-90))
     ]
 
-    def __init__(self, z_max):
+    ray_casting_modes = ('dda', 'table', 'sphere')
+
+    def __init__(self, z_max=None, ray_casting='dda', sonar_sensors=None):
         """Initialize a new sensor array.
 
         Args:
-            z_max: Maximum distance for the sonar sensors.
+            z_max: Maximum distance for the default sonar sensors.
+            ray_casting: How rays are cast through the world:
+                'dda':      Cell by cell, see `cast_rays`.
+                'table':    Along precomputed cells per quantized heading,
+                            see `RayOffsetTable`.
+                'sphere':   Jumping through free space by the distance to
+                            the nearest obstacle, see `sphere_trace_rays`.
+                Tables and distance transforms are computed once per world,
+                which must not change afterwards.
+            sonar_sensors: List of `SonarSensor`. Defaults to three sonars
+                           facing left, ahead and right, with an opening
+                           angle of 15° and a range of `z_max`.
 
         """
-        self.z_max = z_max
-        self.sonar_opening_angle = np.radians(15)
+        if ray_casting not in self.ray_casting_modes:
+            raise ValueError(f"Unknown ray casting mode: {ray_casting}")
+        if sonar_sensors is None:
+            if z_max is None:
+                raise ValueError("Either z_max or sonar_sensors is required")
+            sonar_sensors = [SonarSensor(name, bearing, np.radians(15), z_max)
+                             for name, bearing in self.default_sonar_sensors]
+
+        self.sonar_sensors = [SonarSensor(*sensor) for sensor in sonar_sensors]
+        self.bearings = np.array([sensor.bearing for sensor in self.sonar_sensors],
+                                 dtype=np.float64)
+        self.opening_angles = np.array([sensor.opening_angle for sensor in self.sonar_sensors],
+                                       dtype=np.float64)
+        self.max_ranges = np.array([sensor.z_max for sensor in self.sonar_sensors],
+                                   dtype=np.float64)
+        self.z_max = self.max_ranges.max()
+
+        self.ray_casting = ray_casting
+        self._world = None
+        self._ray_table = None
+        self._distances = None
+
+    def __len__(self):
+        return len(self.sonar_sensors)
 
     def sense(self, world, map_pose):
-        """Returns current sensor measurements about the world."""
-        measurements = list()
-        for _, sonar_angle in self.sonar_sensors:
-            distance = sense_distance(
-                world, map_pose, sonar_angle, z_max=self.z_max)
-            measurements.append((sonar_angle, distance))
+        """Returns current sensor measurements about the world.
+
+        Returns:
+            An array of shape (sensors, 2), with the bearing and the distance
+            to the nearest obstacle (-1 if there is none within range) per
+            sensor. Rows unpack like (bearing, distance) tuples.
+
+        """
+        xr, yr, theta = map_pose
+        angles = theta + self.bearings
+
+        if self.ray_casting != 'dda' and self._world is not world:
+            self._world = world
+            if self.ray_casting == 'table':
+                self._ray_table = RayOffsetTable(world, self.z_max)
+            else:
+                self._distances = distance_transform(world, max_distance=self.z_max)
+
+        measurements = np.empty((len(self), 2))
+        measurements[:, 0] = self.bearings
+        if self.ray_casting == 'table':
+            measurements[:, 1] = self._ray_table.cast(xr, yr, angles, z_max=self.max_ranges)
+        elif self.ray_casting == 'sphere':
+            measurements[:, 1] = sphere_trace_rays(world, self._distances, xr, yr, angles,
+                                                   z_max=self.max_ranges)
+        else:
+            measurements[:, 1] = cast_rays(world, xr, yr, angles, z_max=self.max_ranges)
 
         return measurements
 
@@ -60,7 +130,7 @@ def get_occupied_cell_from_distance(world, pose, distance, angle):
     return (xo, yo)
 
 
-def sense_distance(world, position, direction, threshold=0.5, z_max=10):
+def sense_distance(world, position, direction, threshold=0.5, z_max=10, distances=None):
     """
     Returns distance to nearest obstacle in given direction.
 
@@ -68,6 +138,10 @@ def sense_distance(world, position, direction, threshold=0.5, z_max=10):
         world:      Gridmap representing the world.
         position:   Current robots pose.
         direction:  Direction that the sensor is facing.
+        distances:  Optional distance transform of the world, see
+                    `distance_transform`. If given, the ray is sphere traced
+                    (see `sphere_trace_rays`) instead of following a
+                    Bresenham line.
 
     Returns:
         Distance to nearest obstacle in given direction or -1 if
@@ -76,6 +150,10 @@ def sense_distance(world, position, direction, threshold=0.5, z_max=10):
     xr, yr, theta = position
     angle = theta + direction
 
+    if distances is not None:
+        return float(sphere_trace_rays(world, distances, xr, yr, angle,
+                                       threshold=threshold, z_max=z_max))
+
     x_max = floor(z_max * np.cos(angle) + xr)
     y_max = floor(z_max * np.sin(angle) + yr)
 
@@ -97,11 +175,317 @@ def sense_distance(world, position, direction, threshold=0.5, z_max=10):
         return np.sqrt((xr - x2)**2 + (yr - y2)**2)
 
 
+def distance_transform(world, threshold=0.5, max_distance=None):
+    """
+    Returns the Euclidean distance from each cell to the nearest obstacle cell.
+
+    Args:
+        world:          Gridmap representing the world.
+        threshold:      Cells with a value greater than threshold are obstacles.
+        max_distance:   Optional truncation of the distances.
+    """
+    distances = distance_transform_edt(~obstacle_mask(world, threshold))
+    if max_distance is not None:
+        np.minimum(distances, max_distance, out=distances)
+    return distances
+
+
+def cast_rays(world, xs, ys, angles, threshold=0.5, z_max=10):
+    """
+    Returns distances to the nearest obstacles along many rays at once.
+
+    The rays are traversed cell by cell (DDA), all rays in lockstep. A ray
+    starts in the cell containing its origin, cell (x, y) spanning
+    [x - 0.5, x + 0.5) x [y - 0.5, y + 0.5).
+
+    Args:
+        world:      Gridmap representing the world.
+        xs, ys:     Origins of the rays (cells).
+        angles:     Absolute directions of the rays (rad).
+        threshold:  Cells with a value greater than threshold are obstacles.
+        z_max:      Maximum distance, per ray or for all rays (cells).
+
+    All arguments but world and threshold are broadcast against each other.
+
+    Returns:
+        Distance from each origin to the center of the first obstacle cell,
+        or -1 if no obstacle is within z_max or the ray leaves (or starts
+        outside of) the world.
+    """
+    xs, ys, angles, z_max = np.broadcast_arrays(
+        *(np.asarray(a, dtype=np.float64) for a in (xs, ys, angles, z_max)))
+    shape = xs.shape
+    xs, ys, angles, z_max = (a.ravel() for a in (xs, ys, angles, z_max))
+
+    ranges = _traverse(world, xs, ys, np.cos(angles), np.sin(angles), threshold, z_max)
+    return ranges.reshape(shape)
+
+
+def sphere_trace_rays(world, distances, xs, ys, angles, threshold=0.5, z_max=10):
+    """
+    Returns distances to the nearest obstacles along many rays at once.
+
+    Rays jump ahead through free space by the distance to the nearest
+    obstacle, as long as it is large, and traverse the remaining cells like
+    `cast_rays`. Hence the results equal those of `cast_rays`, while open
+    areas are crossed in a few steps.
+
+    Args:
+        world:      Gridmap representing the world.
+        distances:  Euclidean distance transform of the world, i.e. distance
+                    from each cell to the nearest obstacle cell (cells), e.g.
+                    `scipy.ndimage.distance_transform_edt(world <= threshold)`.
+                    Distances may be truncated at z_max.
+        xs, ys:     Origins of the rays (cells).
+        angles:     Absolute directions of the rays (rad).
+        threshold:  Cells with a value greater than threshold are obstacles.
+        z_max:      Maximum distance, per ray or for all rays (cells).
+
+    Returns:
+        See `cast_rays`.
+    """
+    xs, ys, angles, z_max = np.broadcast_arrays(
+        *(np.asarray(a, dtype=np.float64) for a in (xs, ys, angles, z_max)))
+    shape = xs.shape
+    xs, ys, angles, z_max = (a.ravel() for a in (xs, ys, angles, z_max))
+    height, width = np.shape(world)
+    cos, sin = np.cos(angles), np.sin(angles)
+
+    # A point within distance d - sqrt(2) of a point in a cell, whose center
+    # is at distance d from the nearest obstacle center, can't lie within an
+    # obstacle cell. Jump while that is at least one cell.
+    start = np.zeros(xs.size)
+    missed = np.zeros(xs.size, dtype=bool)
+    rays = np.arange(xs.size)
+    while rays.size:
+        cx = np.floor(xs[rays] + start[rays] * cos[rays] + 0.5).astype(np.intp)
+        cy = np.floor(ys[rays] + start[rays] * sin[rays] + 0.5).astype(np.intp)
+        inside = (cx.view(np.uintp) < width) & (cy.view(np.uintp) < height)
+        missed[rays[~inside]] = True
+
+        rays, cx, cy = rays[inside], cx[inside], cy[inside]
+        jump = distances[cy, cx] - np.sqrt(2)
+        jumping = jump >= 1
+        rays = rays[jumping]
+        start[rays] += jump[jumping]
+        beyond = start[rays] > z_max[rays]
+        missed[rays[beyond]] = True
+        rays = rays[~beyond]
+
+    ranges = np.full(xs.size, -1.0)
+    rays = np.flatnonzero(~missed)
+    ranges[rays] = _traverse(world, xs[rays], ys[rays], cos[rays], sin[rays],
+                             threshold, z_max[rays], start[rays])
+    return ranges.reshape(shape)
+
+
+def _traverse(world, xs, ys, cos, sin, threshold, z_max, start=0.0):
+    """
+    Traverses rays cell by cell (DDA), starting at distance `start` from
+    their origins, see `cast_rays`.
+    """
+    height, width = np.shape(world)
+
+    ranges = np.full(xs.size, -1.0)
+    cx = np.floor(xs + start * cos + 0.5).astype(np.intp)
+    cy = np.floor(ys + start * sin + 0.5).astype(np.intp)
+    step_x = np.where(cos > 0, 1, -1)
+    step_y = np.where(sin > 0, 1, -1)
+
+    # Distance along the ray between crossing two vertical (horizontal)
+    # cell boundaries, and distance to the next one. Axis parallel rays never
+    # cross, but their deltas are kept finite to advance by multiplication.
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        delta_x = np.minimum(np.abs(1 / cos), 1e9)
+        delta_y = np.minimum(np.abs(1 / sin), 1e9)
+        next_x = np.where(cos != 0, (cx + 0.5 * step_x - xs) / cos, np.inf)
+        next_y = np.where(sin != 0, (cy + 0.5 * step_y - ys) / sin, np.inf)
+
+    # Tiled maps are looked up per cell instead of being copied
+    take_cells = getattr(world, 'take_cells', None)
+    cells = np.ravel(world) if take_cells is None else None
+    rays = np.arange(xs.size)
+    active = np.ones(xs.size, dtype=bool)
+    along_x = np.empty(xs.size, dtype=bool)
+    while True:
+        # Negative coordinates wrap around to large unsigned ones
+        active &= cx.view(np.uintp) < width
+        active &= cy.view(np.uintp) < height
+        if take_cells is None:
+            index = cy * width
+            index += cx
+            index *= active
+            hit = cells[index] > threshold
+        else:
+            hit = take_cells(cy * active, cx * active) > threshold
+        hit &= active
+        if hit.any():
+            hits = rays[hit]
+            ranges[hits] = np.hypot(cx[hit] - xs[hits], cy[hit] - ys[hits])
+            active &= ~hit
+
+        # Advance to the next cell, across the boundary reached first
+        np.less(next_x, next_y, out=along_x)
+        active &= np.minimum(next_x, next_y) <= z_max
+        cx += step_x * along_x
+        next_x += delta_x * along_x
+        np.logical_not(along_x, out=along_x)
+        cy += step_y * along_x
+        next_y += delta_y * along_x
+
+        # Drop finished rays once they make up half of the remaining ones
+        remaining = np.count_nonzero(active)
+        if remaining == 0:
+            break
+        if remaining <= active.size // 2:
+            rays, cx, cy, next_x, next_y, step_x, step_y, delta_x, delta_y, z_max = (
+                a[active] for a in (rays, cx, cy, next_x, next_y, step_x, step_y,
+                                    delta_x, delta_y, z_max))
+            active = np.ones(rays.size, dtype=bool)
+            along_x = np.empty(rays.size, dtype=bool)
+
+    return ranges
+
+
+class RayOffsetTable:
+    """
+    Cells along rays of fixed length, precomputed per quantized heading.
+
+    The cells of a ray from the center of a cell only depend on its heading,
+    hence casting rays boils down to gathering the cells at precomputed
+    offsets from the (padded) world and finding the first obstacle with
+    argmax. Headings are rounded to `heading_resolution`, apart from that
+    the rays traverse the same cells as with `cast_rays`.
+    """
+
+    def __init__(self, world, z_max, threshold=0.5, heading_resolution=np.radians(1)):
+        """
+        Args:
+            world:      Gridmap representing the world.
+            z_max:      Maximum distance (cells).
+            threshold:  Cells with a value greater than threshold are obstacles.
+            heading_resolution: Quantization of the headings (rad).
+        """
+        self.world = world
+        self.z_max = z_max
+        self.shape = np.shape(world)
+
+        # Free cells around the world, such that rays leaving the world miss
+        self.pad = int(np.ceil(z_max)) + 1
+        self.occupied = np.zeros((self.shape[0] + 2 * self.pad, self.shape[1] + 2 * self.pad),
+                                 dtype=bool)
+        obstacle_mask(world, threshold, out=self.occupied[self.pad:-self.pad, self.pad:-self.pad])
+        self.width = self.occupied.shape[1]
+
+        self.headings = int(round(2 * np.pi / heading_resolution))
+        dx, dy, self.entries = self._traverse(
+            np.arange(self.headings) * 2 * np.pi / self.headings, z_max)
+        self.offsets = (dy * self.width + dx).astype(np.int32 if self.occupied.size < 2**31
+                                                     else np.intp)
+        self.distances = np.hypot(dx, dy)
+
+    def cast(self, xs, ys, angles, z_max=None):
+        """
+        Returns distances to the nearest obstacles along rays.
+
+        Args:
+            xs, ys:     Origins of the rays (cells), rounded to the nearest cell.
+            angles:     Absolute directions of the rays (rad).
+            z_max:      Optional maximum distance per ray (cells), at most the
+                        one of the table. Cells entered beyond it are not
+                        traversed, like with `cast_rays`.
+
+        All arguments are broadcast against each other.
+
+        Returns:
+            Distance from each origin to the center of the first obstacle
+            cell, or -1, see `cast_rays`.
+        """
+        cx, cy = (np.asarray(a) for a in (xs, ys))
+        if not np.issubdtype(cx.dtype, np.integer):
+            cx = np.floor(cx + 0.5)
+        if not np.issubdtype(cy.dtype, np.integer):
+            cy = np.floor(cy + 0.5)
+        cx, cy = cx.astype(np.intp), cy.astype(np.intp)
+        inside = (cx >= 0) & (cx < self.shape[1]) & (cy >= 0) & (cy < self.shape[0])
+        np.clip(cx, 0, self.shape[1] - 1, out=cx)
+        np.clip(cy, 0, self.shape[0] - 1, out=cy)
+        origins = ((cy + self.pad) * self.width + cx + self.pad).astype(self.offsets.dtype)
+
+        headings = np.rint(np.asarray(angles) * (self.headings / (2 * np.pi))).astype(np.intp)
+        headings %= self.headings
+        if z_max is None:
+            headings, origins, inside = np.broadcast_arrays(headings, origins, inside)
+        else:
+            headings, origins, inside, z_max = np.broadcast_arrays(headings, origins, inside,
+                                                                   z_max)
+
+        indices = self.offsets[headings]
+        indices += origins[..., None]
+        hits = self.occupied.ravel()[indices]
+        if z_max is not None:
+            hits &= self.entries[headings] <= z_max[..., None]
+        first = hits.argmax(axis=-1)
+        hit = np.take_along_axis(hits, first[..., None], -1)[..., 0] & inside
+
+        return np.where(hit, self.distances[headings, first], -1.0)
+
+    @staticmethod
+    def _traverse(angles, z_max):
+        """Traverses rays from the center of cell (0, 0) like `cast_rays`.
+
+        Returns:
+            Column and row offsets of the traversed cells and the distances
+            at which the cells are entered, one row per ray. Shorter rays
+            repeat their last cell.
+        """
+        cos, sin = np.cos(angles), np.sin(angles)
+        step_x = np.where(cos > 0, 1, -1)
+        step_y = np.where(sin > 0, 1, -1)
+        with np.errstate(divide='ignore'):
+            delta_x = np.abs(1 / cos)
+            delta_y = np.abs(1 / sin)
+        next_x, next_y = 0.5 * delta_x, 0.5 * delta_y
+
+        cx, cy = np.zeros(len(angles), dtype=np.intp), np.zeros(len(angles), dtype=np.intp)
+        dx, dy, entries = [cx.copy()], [cy.copy()], [np.zeros(len(angles))]
+        while True:
+            along_x = next_x < next_y
+            entry = np.minimum(next_x, next_y)
+            advance = entry <= z_max
+            if not advance.any():
+                break
+            entries.append(np.where(advance, entry, entries[-1]))
+            cx = np.where(advance & along_x, cx + step_x, cx)
+            cy = np.where(advance & ~along_x, cy + step_y, cy)
+            next_x = np.where(advance & along_x, next_x + delta_x, next_x)
+            next_y = np.where(advance & ~along_x, next_y + delta_y, next_y)
+            dx.append(cx)
+            dy.append(cy)
+
+        return np.stack(dx, axis=1), np.stack(dy, axis=1), np.stack(entries, axis=1)
+
+
 def send_data_to_observatory(data: dict):
     """Sends data to observatory"""
     send_message('perception/sensors', data)
 
 
+def map_updates(gridmap, regions) -> list:
+    """Serializes the changed regions of a map for the observatory.
+
+    Args:
+        gridmap:    Occupancy grid map.
+        regions:    Changed regions (row and column slices), e.g. as returned
+                    by `DirtyRegions.drain`.
+    """
+    return [{
+        'row': rows.start,
+        'col': cols.start,
+        'logOdds': np.round(np.asarray(gridmap[rows, cols]), 2).tolist()
+    } for rows, cols in regions]
+
+
 
 def approximate_obstacle_position(world, position, direction, z):
     """Given a sensor measurement `z`, returns the approximate global
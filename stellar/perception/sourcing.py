@@ -14,19 +14,251 @@ Multiple steps are performed read and parse UART messages:
     2. Reassemble original payload from fragmented messages
     3. Reconstruct original payload by parsing the binary blobs.
 
+Reads from a serial device return chunks of arbitrary size, which do not
+necessarily coincide with messages. `StreamDecoder` buffers the chunks and
+decodes all complete records, resynchronizing after corrupt bytes.
+
+The layout of a record is described by a `Schema`: named fields, usually
+preceded by a version byte. Schemas are registered in `SCHEMAS` and compile
+their format once, records are decoded into light-weight objects with named
+attributes. The records of the current tinyK22 firmware, which has no version
+byte yet, are described by `TINYK22`, the default of `Sensors`.
+
 """
 import io
+import keyword
 import queue
+import re
 import struct
-from typing import List
+import threading
+import time
+from collections import deque
+from math import ceil
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class Record:
+    """Base of the records decoded by a `Schema`, with one slot per field.
+
+    Subclasses are created by `record_type`.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, i):
+        return getattr(self, self._fields[i])
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        values = ', '.join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
+
+    def _asdict(self):
+        return {field: getattr(self, field) for field in self._fields}
+
+
+def record_type(name: str, fields: Sequence[str], versioned=True) -> type:
+    """Creates a `Record` subclass with the given fields.
+
+    Like `collections.namedtuple`, the constructors are compiled once per
+    type: `__init__(*values)`, and `_unpack(values)`, which takes a tuple as
+    returned by `struct.unpack`, skipping its first (version) value if
+    versioned.
+
+    Raises:
+        ValueError if a field name is not an identifier, a keyword, starts
+        with an underscore or is repeated.
+    """
+    for field in fields:
+        if not field.isidentifier() or keyword.iskeyword(field) or field.startswith('_'):
+            raise ValueError(f"Invalid field name {field!r}")
+    if len(set(fields)) != len(fields):
+        raise ValueError(f"Repeated field names in {fields!r}")
+
+    # Field names never start with an underscore, hence never collide with
+    # the names used by the compiled functions.
+    arguments = ', '.join(fields)
+    attributes = ', '.join(f"_self.{field}" for field in fields)
+    source = (f"def __init__(_self, {arguments}):\n"
+              f"    {attributes}, = {arguments},\n"
+              f"def _unpack(_cls, _values):\n"
+              f"    _self = _new(_cls)\n"
+              f"    {'_, ' if versioned else ''}{attributes}, = _values\n"
+              f"    return _self\n")
+    namespace = {'_new': object.__new__}
+    exec(source, namespace)
+
+    return type(name, (Record,), {
+        '__slots__': tuple(fields),
+        '_fields': tuple(fields),
+        '__init__': namespace['__init__'],
+        '_unpack': classmethod(namespace['_unpack']),
+    })
+
+
+class Schema:
+    """Layout of a record: a version byte, followed by named fields."""
+
+    def __init__(self, name: str, version: Optional[int], fields: Sequence[Tuple[str, str]],
+                 byte_order='='):
+        """
+        Args:
+            name: Name of the schema.
+            version: Version of the layout (0 to 255), sent as first byte. None
+                     for a layout without version byte.
+            fields: Name and format (see `struct`) of each field, e.g.
+                    ('motor', 'i'). Each format must yield a single value.
+            byte_order: Byte order of the fields, see `struct`.
+
+        Raises:
+            ValueError if a field name is invalid or a format does not yield
+            a single value.
+
+        """
+        if version is not None and not 0 <= version <= 255:
+            raise ValueError(f"Version must fit into a byte, got {version}")
+        if not fields:
+            raise ValueError(f"Schema {name!r} has no fields")
+        for field, code in fields:
+            if field == 'version':
+                raise ValueError(f"Invalid field name {field!r}")
+            if len(struct.unpack(byte_order + code, bytes(struct.calcsize(byte_order + code)))) != 1:
+                raise ValueError(f"Format {code!r} of field {field!r} must yield a single value")
+
+        self.name = name
+        self.version = version
+        self.fields = tuple(field for field, _ in fields)
+        self.format = (byte_order + ('B' if version is not None else '')
+                       + ''.join(code for _, code in fields))
+        self.struct = struct.Struct(self.format)
+        self.size = self.struct.size
+        self.record = record_type(''.join(part.title() for part in name.split('_')) + 'Record',
+                                  self.fields, versioned=version is not None)
+        self._names = self.fields if version is None else ('version',) + self.fields
+
+    def __repr__(self):
+        return f"Schema({self.name!r}, {self.version}, {self.format!r})"
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Equivalent numpy structured dtype, including the version byte."""
+        return format_to_dtype(self.format, self._names)
+
+    def decode(self, buffer, offset=0) -> Record:
+        """Decodes a record at offset of buffer.
+
+        Raises:
+            ValueError if the buffer is too short or the version byte does
+            not match.
+
+        """
+        try:
+            values = self.struct.unpack_from(buffer, offset)
+        except struct.error:
+            raise ValueError(f"Buffer too short for {self}")
+        if self.version is not None and values[0] != self.version:
+            raise ValueError(f"Expected version {self.version} of {self.name!r}, got {values[0]}")
+        return self.record._unpack(values)
+
+    def decode_all(self, buffer, offset=0) -> np.ndarray:
+        """Decodes all records of a buffer at once, see `decode_records`.
+
+        Raises:
+            ValueError if the version byte of any record does not match.
+
+        """
+        records = decode_records(buffer, self.format, self._names, offset)
+        if self.version is not None and np.any(records['version'] != self.version):
+            raise ValueError(f"Expected version {self.version} of {self.name!r}")
+        return records
 
+    def encode(self, *values) -> bytes:
+        """Encodes the values of a record, including the version byte."""
+        if self.version is None:
+            return self.struct.pack(*values)
+        return self.struct.pack(self.version, *values)
 
-def decode_blob(blob: bytes, fmt="=ffffii"):
+
+class SchemaRegistry:
+    """Schemas by name and version."""
+
+    def __init__(self):
+        self.schemas = {}
+
+    def register(self, schema: Schema) -> Schema:
+        """Registers a schema and returns it.
+
+        Raises:
+            ValueError if another schema of the same name and version exists.
+
+        """
+        key = (schema.name, schema.version)
+        if key in self.schemas and self.schemas[key] is not schema:
+            raise ValueError(f"{schema} conflicts with {self.schemas[key]}")
+        self.schemas[key] = schema
+        return schema
+
+    def get(self, name: str, version: int = None) -> Schema:
+        """Returns a schema, the latest version if version is None. A layout
+        without version byte precedes all versions.
+
+        Raises:
+            ValueError if there is no such schema.
+
+        """
+        if version is None:
+            versions = [v for n, v in self.schemas if n == name]
+            version = max(versions, key=lambda v: -1 if v is None else v, default=None)
+        try:
+            return self.schemas[(name, version)]
+        except KeyError:
+            raise ValueError(f"Unknown schema {name!r}, version {version}")
+
+    def decode(self, name: str, buffer, offset=0) -> Record:
+        """Decodes a record with the schema of the version given by its first byte."""
+        return self.get(name, buffer[offset]).decode(buffer, offset)
+
+
+SCHEMAS = SchemaRegistry()
+
+# Sensor signals sent by the current tinyK22 firmware, without version byte:
+# the sonar ranges (named after the sonars of `SensorArray`), the heading and
+# the motor and steering values (as shown by the observatory).
+TINYK22 = SCHEMAS.register(Schema('tinyk22', None, [
+    ('front', 'f'), ('outter', 'f'), ('inner', 'f'), ('heading', 'f'),
+    ('motor', 'i'), ('steering', 'i'),
+]))
+
+
+def decode_blob(blob: bytes, fmt="=ffffii", schema: Schema = None):
     """Decode sensor data array from tinyK22.
 
-    NOTE: No error is raised if the byte length matches, e.g. "=ffffii"
-    matches "=ddd" well, so no error is raised. Perform sanity checks.
+    NOTE: Without a schema, no error is raised if the byte length matches,
+    e.g. "=ffffii" matches "=ddd" well. Schemas check the version byte.
+
+    Args:
+        blob: A single record.
+        fmt: Format of the record, see `struct`, if no schema is given.
+        schema: Schema of the record, returns a `Record` instead of a tuple.
+
     """
+    if schema is not None:
+        if len(blob) != schema.size:
+            raise ValueError(f"Expected {schema.size} bytes for {schema}, got {len(blob)}")
+        return schema.decode(blob)
+
     try:
         return struct.unpack(fmt, blob)
     except struct.error:
@@ -35,6 +267,104 @@ def decode_blob(blob: bytes, fmt="=ffffii"):
         raise ValueError(f"Unable to decode data, got: {error_blob}")
 
 
+# Kinds of the numpy types equivalent to the struct format characters,
+# combined with the size of the format character (which depends on the byte
+# order / alignment for some characters).
+_FORMAT_KINDS = {
+    'c': 'S', 'b': 'i', 'B': 'u', '?': 'b', 'h': 'i', 'H': 'u', 'i': 'i', 'I': 'u',
+    'l': 'i', 'L': 'u', 'q': 'i', 'Q': 'u', 'n': 'i', 'N': 'u', 'e': 'f', 'f': 'f',
+    'd': 'f', 's': 'S',
+}
+_BYTE_ORDERS = {'@': '=', '=': '=', '<': '<', '>': '>', '!': '>'}
+
+
+def _format_items(fmt: str):
+    """Splits a struct format into single items ("f", "3s", "x"), yields
+    each item with its offset and size."""
+    order = fmt[0] if fmt[:1] in _BYTE_ORDERS else '@'
+    body = fmt[1:] if fmt[:1] in _BYTE_ORDERS else fmt
+
+    prefix = order
+    for count, char in re.findall(r'\s*(\d*)(\S)', body):
+        if char != 'x' and char not in _FORMAT_KINDS:
+            raise ValueError(f"Unsupported format character {char!r} in {fmt!r}")
+        count = int(count) if count else 1
+        repeats = 1 if char == 's' else count
+        for _ in range(repeats):
+            item = f"{count}s" if char == 's' else char
+            prefix += item
+            size = struct.calcsize(order + item)
+            yield item, struct.calcsize(prefix) - size, size
+
+
+def format_to_dtype(fmt: str, names: Sequence[str] = None) -> np.dtype:
+    """Converts a struct format into an equivalent numpy structured dtype.
+
+    Pad bytes ("x") are skipped, the offsets and the size of the dtype match
+    the format, including the alignment of native ("@") formats.
+
+    Args:
+        fmt: Format, see `struct`.
+        names: Names of the fields, defaults to "f0", "f1", ...
+
+    Raises:
+        ValueError if the format contains unsupported characters (pascal
+        strings and pointers) or the number of names does not match.
+
+    """
+    order = fmt[0] if fmt[:1] in _BYTE_ORDERS else '@'
+
+    formats, offsets = [], []
+    for item, offset, size in _format_items(fmt):
+        char = item[-1]
+        if char == 'x':
+            continue
+        kind = _FORMAT_KINDS[char]
+        byte_order = '|' if kind in 'Sb' or size == 1 else _BYTE_ORDERS[order]
+        formats.append(f"{byte_order}{kind}{size}")
+        offsets.append(offset)
+
+    names = list(names) if names is not None else [f"f{i}" for i in range(len(formats))]
+    if len(names) != len(formats):
+        raise ValueError(f"Got {len(names)} names for {len(formats)} fields of {fmt!r}")
+
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': struct.calcsize(fmt)})
+
+
+def decode_records(buffer, fmt="=ffffii", names: Sequence[str] = None,
+                   offset=0) -> np.ndarray:
+    """Decodes all records of a buffer at once, without copying.
+
+    Args:
+        buffer: Consecutive records, any object exposing the buffer
+                interface, e.g. bytes, a memoryview or an `mmap`.
+        fmt: Format of a record, see `struct`.
+        names: Names of the fields, see `format_to_dtype`.
+        offset: Offset of the first record (bytes).
+
+    Returns:
+        A structured array viewing the buffer, one element per record. A
+        trailing incomplete record is ignored. Fields, e.g. `records['f0']`,
+        are views, too.
+
+    """
+    dtype = format_to_dtype(fmt, names)
+    count = (memoryview(buffer).nbytes - offset) // dtype.itemsize
+    return np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+
+
+def load_records(path, fmt="=ffffii", names: Sequence[str] = None, offset=0) -> np.ndarray:
+    """Memory maps a log of consecutive records, see `decode_records`."""
+    dtype = format_to_dtype(fmt, names)
+    with open(path, 'rb') as log:
+        log.seek(0, io.SEEK_END)
+        count = (log.tell() - offset) // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
 def combine_messages(blobs: List[bytes]) -> bytes:
     """Combines multiple UART messages into a single data buffer.
 
@@ -51,17 +381,392 @@ def combine_messages(blobs: List[bytes]) -> bytes:
     return b''.join(buf)
 
 
+class StreamDecoder:
+    """Incrementally decodes records from a stream of UART messages.
+
+    A record is sent as consecutive messages, each consisting of a start byte,
+    `message_size` data bytes and a stop byte. The stop byte is 0x01 for the
+    last message of a record and 0x00 otherwise, start bytes are 0x00 or
+    0x01. Bytes which do not form a valid record are skipped one at a time,
+    until two consecutive valid records bring the stream in sync again.
+
+    Chunks are copied into a preallocated buffer and parsed in place: the
+    start and stop bytes are read at their offsets and the payload is
+    unpacked straight from the buffer by a precompiled `struct.Struct`, which
+    skips the framing bytes between messages. Only if a field spans two
+    messages, the payloads are gathered into a second buffer first. With a
+    schema, the version byte is validated along with the framing.
+    """
+
+    def __init__(self, fmt="=ffffii", message_size=8, capacity=4096, schema: Schema = None):
+        """
+        Args:
+            fmt: Format of the record payload, see `struct`, if no schema is
+                 given.
+            message_size: Number of data bytes per message. If None, a record
+                          is sent as a single message.
+            capacity: Initial size of the buffer (bytes), at least two
+                      records. The buffer grows for larger chunks.
+            schema: Schema of the records, decodes into `Record` instead of
+                    tuples.
+
+        Raises:
+            ValueError if fmt starts or ends with pad bytes, as formats
+            including the framing bytes of a single message did, e.g.
+            "=xffffiix".
+
+        """
+        if schema is None:
+            items = [item for item, _, _ in _format_items(fmt)]
+            if items[0] == 'x' or items[-1] == 'x':
+                raise ValueError(f"Format {fmt!r} includes pad bytes at its ends, expected "
+                                 f"the format of the payload only, without framing bytes")
+        self.schema = schema
+        self.struct = schema.struct if schema is not None else struct.Struct(fmt)
+        self._version = schema.version if schema is not None else None
+        self.message_size = message_size or self.struct.size
+        self.messages = ceil(self.struct.size / self.message_size)
+        self.frame_size = self.messages * (self.message_size + 2)
+
+        self._payload = bytearray(self.messages * self.message_size)
+        self._payload_view = memoryview(self._payload)
+        self._framed_struct = self._compile_framed()
+
+        self.buffer = bytearray(max(capacity, 2 * self.frame_size))
+        self._view = memoryview(self.buffer)
+        self._start = 0
+        self._end = 0
+        self._in_sync = True
+
+        self.records = 0
+        self.decode_errors = 0
+        self.skipped_bytes = 0
+
+    def __len__(self):
+        """Number of buffered bytes, not decoded yet."""
+        return self._end - self._start
+
+    def reset(self):
+        """Discards all buffered bytes."""
+        self._start = self._end = 0
+        self._in_sync = True
+
+    def decode(self, chunk: bytes) -> Iterator[tuple]:
+        """Buffers a chunk of the stream and decodes all complete records.
+
+        Args:
+            chunk: Bytes of any length, as read from the device.
+
+        Returns:
+            An iterator over the values of each decoded record, a `Record` if
+            the decoder has a schema. The chunk is buffered right away, its
+            records are decoded while iterating.
+
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        count = len(chunk)
+        if count > len(self.buffer) - self._end:
+            self._compact()
+            if count > len(self.buffer) - self._end:
+                self._grow(self._end + count)
+        self._view[self._end:self._end + count] = chunk
+        self._end += count
+        return self._parse()
+
+    def _parse(self):
+        while self._end - self._start >= self.frame_size * (1 if self._in_sync else 2):
+            start = self._start
+            # Without checksums, payload bytes may resemble framing bytes.
+            # Once out of sync, a record is only accepted if it is followed
+            # by another valid record.
+            if not (self._framed(start)
+                    and (self._in_sync or self._framed(start + self.frame_size))):
+                if self._in_sync:
+                    self.decode_errors += 1
+                    self._in_sync = False
+                self.skipped_bytes += 1
+                self._start += 1
+                continue
+
+            self._start += self.frame_size
+            self._in_sync = True
+            self.records += 1
+            if self.messages == 1:
+                values = self.struct.unpack_from(self._view, start + 1)
+            elif self._framed_struct is not None:
+                values = self._framed_struct.unpack_from(self._view, start)
+            else:
+                values = self.struct.unpack_from(self._gather(start))
+            yield values if self.schema is None else self.schema.record._unpack(values)
+
+    def _framed(self, start):
+        """Whether the start and stop bytes (and the version byte) of the
+        messages at the given offset are valid."""
+        buffer, stop = self.buffer, self.message_size + 1
+        last = start + self.frame_size - stop - 1
+        for offset in range(start, last, stop + 1):
+            if buffer[offset] > 0x01 or buffer[offset + stop] != 0x00:
+                return False
+        return (buffer[last] <= 0x01 and buffer[last + stop] == 0x01
+                and (self._version is None or buffer[start + 1] == self._version))
+
+    def _compile_framed(self):
+        """Compiles the payload format with pad bytes in place of the framing
+        bytes, None if a field spans two messages."""
+        fmt = self.struct.format
+        order = fmt[0] if fmt[:1] in _BYTE_ORDERS else '@'
+        framed = order
+        for item, offset, size in _format_items(fmt):
+            if item[-1] == 'x':
+                continue
+            message = offset // self.message_size
+            if size and (offset + size - 1) // self.message_size != message:
+                return None
+            target = offset + 2 * message + 1
+            framed += f"{target - struct.calcsize(framed)}x{item}"
+            # Native formats may align the field elsewhere.
+            if struct.calcsize(framed) - size != target:
+                return None
+        return struct.Struct(framed)
+
+    def _gather(self, start):
+        """Copies the payloads of the messages at the given offset into the
+        payload buffer and returns it."""
+        size, step = self.message_size, self.message_size + 2
+        for i in range(self.messages):
+            offset = start + i * step + 1
+            self._payload_view[i * size:(i + 1) * size] = self._view[offset:offset + size]
+        return self._payload
+
+    def _grow(self, size):
+        """Enlarges the buffer to at least size bytes."""
+        self._view.release()
+        self.buffer.extend(bytes(max(size, 2 * len(self.buffer)) - len(self.buffer)))
+        self._view = memoryview(self.buffer)
+
+    def _compact(self):
+        """Moves the buffered bytes to the front of the buffer."""
+        count = self._end - self._start
+        if count:
+            self._view[:count] = self._view[self._start:self._end]
+        self._start, self._end = 0, count
+
+
 class Sensors:
     """Continuously read sensor data from the tinyK22."""
 
-    def __init__(self, device: io.BytesIO, out_queue: queue.Queue, fmt="=xffffiix"):
+    def __init__(self, device: io.BytesIO, out_queue: queue.Queue, fmt: str = None,
+                 message_size=None, read_size=None, recorder=None, schema: Schema = None):
+        """
+        Args:
+            device: The serial device, or any other binary stream.
+            out_queue: Queue receiving the decoded values of each record.
+            fmt: Format of the record payload, see `struct`, decodes into
+                 tuples instead of records of a schema.
+            message_size: Number of data bytes per UART message, see
+                          `StreamDecoder`.
+            read_size: Number of bytes to read at once, defaults to the size
+                       of a record.
+            recorder: `recording.Recorder` recording the bytes as read.
+            schema: Schema of the records, see `StreamDecoder`. Defaults to
+                    `TINYK22` if no fmt is given.
+
+        """
+        if fmt is None and schema is None:
+            schema = TINYK22
         self.device = device
         self.out_queue = out_queue
-        self.fmt = fmt
+        self.fmt = schema.format if schema is not None else fmt
+        self.decoder = StreamDecoder(fmt, message_size, schema=schema)
+        self.read_size = read_size or self.decoder.frame_size
+        self.recorder = recorder
 
     def read(self):
-        """Reads and decodes sensor signals."""
-        blob = self.device.read()
+        """Reads and decodes sensor signals.
+
+        Returns:
+            The number of bytes read, 0 if the device had no data.
+
+        """
+        blob = self.device.read(self.read_size)
         if blob:
-            values = decode_blob(blob, self.fmt)
-            self.out_queue.put(values)
+            if self.recorder is not None:
+                self.recorder.record(blob)
+            for values in self.decoder.decode(blob):
+                self.out_queue.put(values)
+        return len(blob) if blob else 0
+
+
+class RecordQueue:
+    """Bounded queue of decoded records, shared by a reader and a consumer.
+
+    If the consumer falls behind, the policy decides what happens to new
+    records once the queue is full:
+
+        drop-oldest:    The oldest record is dropped.
+        latest-only:    Only the latest record is kept, regardless of maxsize.
+        block:          The reader waits until the consumer catches up.
+
+    The `put` and `get` methods follow `queue.Queue`, such that the queue can
+    be passed to `Sensors`.
+    """
+    policies = ('drop-oldest', 'latest-only', 'block')
+
+    def __init__(self, maxsize=64, policy='drop-oldest'):
+        if policy not in self.policies:
+            raise ValueError(f"Unknown policy {policy!r}, expected one of {self.policies}")
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be positive, got {maxsize}")
+
+        self.policy = policy
+        self.maxsize = 1 if policy == 'latest-only' else maxsize
+        self.records = deque(maxlen=self.maxsize)
+        self.closed = False
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+
+        self.puts = 0
+        self.drops = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def put(self, record, block=True, timeout=None):
+        """Adds a record, according to the policy.
+
+        Returns:
+            False if the queue was closed and the record discarded.
+
+        Raises:
+            queue.Full if the policy is 'block' and the queue is still full
+            after timeout seconds.
+
+        """
+        with self._not_full:
+            if self.policy == 'block' and block:
+                if not self._not_full.wait_for(
+                        lambda: self.closed or len(self.records) < self.maxsize, timeout):
+                    raise queue.Full
+            if self.closed:
+                return False
+            if len(self.records) == self.maxsize:
+                if self.policy == 'block':
+                    raise queue.Full
+                self.drops += 1
+
+            self.records.append(record)
+            self.puts += 1
+            self.max_depth = max(self.max_depth, len(self.records))
+            self._not_empty.notify()
+        return True
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the oldest record.
+
+        Raises:
+            queue.Empty if there is no record (after timeout seconds).
+
+        """
+        with self._not_empty:
+            if block and not self._not_empty.wait_for(
+                    lambda: self.closed or self.records, timeout):
+                raise queue.Empty
+            if not self.records:
+                raise queue.Empty
+            record = self.records.popleft()
+            self._not_full.notify()
+        return record
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def drain(self):
+        """Removes and returns all records, oldest first."""
+        with self._lock:
+            records = list(self.records)
+            self.records.clear()
+            self._not_full.notify_all()
+        return records
+
+    def close(self):
+        """Wakes up all waiting readers and consumers, new records are discarded."""
+        with self._lock:
+            self.closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+
+class SensorReader:
+    """Reads and decodes sensor signals continuously in a background thread.
+
+    Example:
+        reader = SensorReader(serial.Serial('/dev/ttyACM0', timeout=0.01))
+        reader.start()
+        values = reader.records.get()
+
+    """
+    is_running: bool = False
+
+    def __init__(self, device: io.BytesIO, fmt: str = None, message_size=None, read_size=None,
+                 maxsize=64, policy='drop-oldest', idle=0.001, recorder=None,
+                 schema: Schema = None):
+        """
+        Args:
+            device: The serial device, or any other binary stream.
+            fmt, message_size, read_size, recorder, schema: See `Sensors`.
+            maxsize, policy: See `RecordQueue`.
+            idle: Time to sleep if the device had no data (s). Serial devices
+                  should be opened with a read timeout instead.
+
+        """
+        self.records = RecordQueue(maxsize, policy)
+        self.sensors = Sensors(device, self.records, fmt, message_size, read_size, recorder,
+                               schema)
+        self.idle = idle
+        self.thread = None
+        self.read_errors = 0
+
+    @property
+    def decode_errors(self):
+        return self.sensors.decoder.decode_errors
+
+    @property
+    def drops(self):
+        return self.records.drops
+
+    def stats(self):
+        """Counters of the reader, e.g. to be sent to the observatory."""
+        return {
+            'records': self.sensors.decoder.records,
+            'depth': len(self.records),
+            'max_depth': self.records.max_depth,
+            'drops': self.records.drops,
+            'decode_errors': self.sensors.decoder.decode_errors,
+            'skipped_bytes': self.sensors.decoder.skipped_bytes,
+            'read_errors': self.read_errors,
+        }
+
+    def run(self):
+        while self.is_running:
+            try:
+                if not self.sensors.read() and self.idle:
+                    time.sleep(self.idle)
+            except OSError:
+                self.read_errors += 1
+                time.sleep(self.idle)
+
+    def start(self):
+        self.is_running = True
+        self.records.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.is_running = False
+        self.records.close()
+        if self.thread is not None:
+            self.thread.join(timeout)
@@ -0,0 +1,153 @@
+"""
+Emulate the tinyK22 on a pseudo-terminal.
+
+The emulator writes UART messages (see `stellar.perception.sourcing`) to the
+master side of a pseudo-terminal, while `sourcing.Sensors` reads from the
+slave side, just like from the serial device of the real tinyK22. Faults
+of real serial lines can be injected:
+
+    fragmentation:  Records are written in chunks of random size.
+    corruption:     A random byte of a record is overwritten.
+    bursts:         Multiple records are written at once, at the same
+                    average rate.
+
+Only available on platforms providing `os.openpty` (i.e. not on Windows).
+"""
+import os
+import struct
+import termios
+import time
+import tty
+from math import ceil
+
+import numpy as np
+
+from stellar.perception.sourcing import format_to_dtype
+
+
+def encode_record(values, fmt="=ffffii", message_size=None) -> bytes:
+    """Encodes a record into UART messages, see `sourcing.StreamDecoder`.
+
+    Args:
+        values: Values of the record.
+        fmt: Format of the record payload, see `struct`.
+        message_size: Number of data bytes per message. If None, a record is
+                      sent as a single message.
+
+    """
+    payload = struct.pack(fmt, *values)
+    message_size = message_size or len(payload)
+    messages = ceil(len(payload) / message_size)
+    payload += bytes(messages * message_size - len(payload))
+
+    return b''.join(b'\x00' + payload[i * message_size:(i + 1) * message_size]
+                    + (b'\x01' if i == messages - 1 else b'\x00')
+                    for i in range(messages))
+
+
+class TinyK22Emulator:
+    """Writes sensor records to a pseudo-terminal at a configurable rate."""
+
+    is_running: bool = False
+
+    def __init__(self, fmt="=ffffii", message_size=None, rate=50.0, burst=1,
+                 fragmentation=0.0, corruption=0.0, rng=None, schema=None):
+        """
+        Args:
+            fmt, message_size: Format and framing of the records, see
+                               `encode_record`.
+            rate: Records per second, None to write as fast as possible.
+            burst: Number of records written at once.
+            fragmentation: Probability of a burst being written in chunks of
+                           random size.
+            corruption: Probability of a record being corrupted.
+            rng: Random number generator.
+            schema: `sourcing.Schema` of the records, replaces fmt.
+
+        """
+        self.schema = schema
+        fmt = schema.format if schema is not None else fmt
+        self.fmt = fmt
+        self.message_size = message_size
+        self.rate = rate
+        self.burst = burst
+        self.fragmentation = fragmentation
+        self.corruption = corruption
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.dtype = schema.dtype if schema is not None else format_to_dtype(fmt)
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.device_path = os.ttyname(self.slave)
+
+        self.sent = 0
+        self.corrupted = 0
+        self.sent_at = []
+
+    def values(self, i):
+        """Values of the i-th record: integer fields hold the sequence
+        number, wrapped to the non-negative range of the field, the other
+        fields i + (index of the field) / 4. With a versioned schema, the
+        first value is the version."""
+        fields = [self.dtype[name] for name in self.dtype.names]
+        values = tuple(i % 2 ** (8 * field.itemsize - (field.kind == 'i'))
+                       if field.kind in 'iu' else (i + j / 4 if field.kind == 'f' else 0)
+                       for j, field in enumerate(fields))
+        if self.schema is not None and self.schema.version is not None:
+            values = (self.schema.version,) + values[1:]
+        return values
+
+    def device(self, timeout=0.1):
+        """Opens the slave side, like a serial device with a read timeout (s)."""
+        fd = os.open(self.device_path, os.O_RDONLY | os.O_NOCTTY)
+        tty.setraw(fd)
+        attributes = termios.tcgetattr(fd)
+        attributes[6][termios.VMIN] = 0
+        attributes[6][termios.VTIME] = max(1, round(timeout * 10))
+        termios.tcsetattr(fd, termios.TCSANOW, attributes)
+        return open(fd, 'rb', buffering=0)
+
+    def write_burst(self):
+        """Writes the next burst of records."""
+        records = []
+        for _ in range(self.burst):
+            record = bytearray(encode_record(self.values(self.sent + len(records)), self.fmt,
+                                             self.message_size))
+            if self.rng.random() < self.corruption:
+                record[self.rng.integers(len(record))] = self.rng.integers(256)
+                self.corrupted += 1
+            records.append(record)
+        data = memoryview(b''.join(records))
+
+        chunks = [data]
+        if self.rng.random() < self.fragmentation:
+            cuts = np.sort(self.rng.integers(1, len(data), self.rng.integers(1, 4)))
+            chunks = [data[start:stop] for start, stop in
+                      zip([0, *cuts.tolist()], [*cuts.tolist(), len(data)])]
+
+        now = time.perf_counter()
+        for chunk in chunks:
+            while chunk:
+                chunk = chunk[os.write(self.master, chunk):]
+        self.sent_at.extend([now] * self.burst)
+        self.sent += self.burst
+
+    def run(self, count=None):
+        """Writes records until stopped, or until `count` records were sent."""
+        self.is_running = True
+        interval = self.burst / self.rate if self.rate else 0
+        deadline = time.perf_counter()
+        while self.is_running and (count is None or self.sent < count):
+            self.write_burst()
+            if interval:
+                deadline += interval
+                time.sleep(max(deadline - time.perf_counter(), 0))
+        self.is_running = False
+
+    def stop(self):
+        self.is_running = False
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
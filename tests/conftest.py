@@ -0,0 +1,15 @@
+"""
+Fixtures shared by the tests.
+"""
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def room():
+    """A walled room of 100 x 120 cells with a pillar."""
+    world = np.zeros((100, 120))
+    world[[5, 94], 5:115] = 1
+    world[5:95, [5, 114]] = 1
+    world[40:60, 70:75] = 1
+    return world
@@ -0,0 +1,115 @@
+"""
+Tests for the chronological alignment of sensor signals.
+"""
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from stellar.perception.alignment import SignalAlignment, SignalBuffer
+
+
+def test_signal_buffer_overwrites_oldest_samples():
+    buffer = SignalBuffer(4)
+    for t in range(6):
+        buffer.append(t, t * 10)
+
+    assert len(buffer) == 4
+    assert buffer.span() == (2, 5)
+    assert buffer.sample(0) == (2, [20])
+    assert buffer.latest() == (5, [50])
+
+    timestamps, values = buffer.window(3, 5)
+    assert timestamps.tolist() == [3, 4]
+    assert values[:, 0].tolist() == [30, 40]
+
+
+def test_signal_buffer_rejects_non_monotonic_timestamps():
+    buffer = SignalBuffer(4)
+    buffer.append(1.0, 0)
+    buffer.append(1.0, 0)
+
+    with pytest.raises(ValueError):
+        buffer.append(0.5, 0)
+
+
+@pytest.mark.parametrize("appended", [3, 5, 7, 8])
+def test_signal_buffer_finds_nearest_sample_across_wrap_around(appended):
+    buffer = SignalBuffer(5)
+    for t in range(appended):
+        buffer.append(t, t)
+
+    for t in np.arange(-1, appended + 1, 0.25):
+        expected = min(max(np.floor(t + 0.5), max(appended - 5, 0)), appended - 1)
+        if t - np.floor(t) == 0.5:
+            expected = np.clip(np.floor(t), max(appended - 5, 0), appended - 1)
+        assert buffer.nearest(t)[0] == expected
+
+
+def test_signal_buffer_interpolates_values_and_angles():
+    buffer = SignalBuffer(3, width=2, periodic=[1])
+    buffer.append(0.0, [0, np.radians(350)])
+    buffer.append(1.0, [10, np.radians(10)])
+    buffer.append(3.0, [30, np.radians(50)])
+    buffer.append(4.0, [40, np.radians(60)])
+
+    assert buffer.interpolate(1.5) == pytest.approx([15, np.radians(20)])
+    assert buffer.interpolate(4.0) == pytest.approx([40, np.radians(60)])
+
+    with pytest.raises(ValueError):
+        buffer.interpolate(0.5)
+
+    buffer = SignalBuffer(2, width=2, periodic=[1])
+    buffer.append(0.0, [0, np.radians(350)])
+    buffer.append(1.0, [10, np.radians(10)])
+    assert buffer.interpolate(0.25) == pytest.approx([2.5, np.radians(355)])
+    assert buffer.interpolate(0.75) == pytest.approx([7.5, np.radians(5)])
+
+
+def test_signal_buffer_reads_consistently_while_appending():
+    """
+    Readers must never observe a partially appended sample, e.g. an unsorted
+    window while the oldest slot is overwritten.
+    """
+    buffer = SignalBuffer(8)
+    buffer.append(0, 0)
+    appended = threading.Event()
+
+    def append():
+        for t in range(1, 20000):
+            buffer.append(t, t)
+        appended.set()
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        writer = threading.Thread(target=append)
+        writer.start()
+        while not appended.is_set():
+            timestamps, values = buffer.window(-np.inf, np.inf)
+            assert np.all(np.diff(timestamps) > 0)
+            assert np.array_equal(timestamps, values[:, 0])
+            timestamp, value = buffer.latest()
+            assert timestamp == value[0]
+        writer.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+
+def test_signal_alignment_aligns_channels():
+    alignment = SignalAlignment()
+    alignment.add_channel('pose', 10, width=3, periodic=[2])
+    alignment.add_channel('sonar', 10, width=4)
+
+    for t in range(5):
+        alignment.append('pose', t, [t, 2 * t, 0])
+        alignment.append('sonar', t + 0.5, [t] * 4)
+
+    aligned = alignment.align(2.75)
+    assert aligned['pose'] == pytest.approx([2.75, 5.5, 0])
+    assert aligned['sonar'] == pytest.approx([2.25] * 4)
+
+    nearest = alignment.align(2.75, interpolate=False)
+    assert nearest['pose'] == pytest.approx([3, 6, 0])
+    assert nearest['sonar'] == pytest.approx([2] * 4)
@@ -0,0 +1,59 @@
+"""
+Tests for the frontier detection.
+"""
+import numpy as np
+import pytest
+
+from stellar.cognition import mapping
+from stellar.cognition.exploration import DisjointSets, FrontierDetector
+from stellar.models.gridmap import DirtyRegions, TiledGridMap
+
+
+def test_frontier_detector_matches_full_detection_after_updates():
+    """
+    Re-examining the changed regions only must yield the same frontier as
+    examining the whole map.
+    """
+    gridmap = TiledGridMap((150, 220), tile_size=16)
+    detector = FrontierDetector(gridmap)
+    assert len(detector) == 0
+
+    for x, theta in [(20, 0), (100, 1), (200, 2.5), (110, 1.2)]:
+        mapping.fuse_measurements(gridmap, (x, 100, theta),
+                                  [(0, 20), (np.pi / 2, 7), (-np.pi / 2, -1)],
+                                  np.radians(15), 40)
+        detector.update()
+
+    expected = FrontierDetector(gridmap, dirty=DirtyRegions(gridmap.shape))
+    assert np.array_equal(detector.frontier, expected.frontier)
+    assert len(detector) == np.count_nonzero(expected.frontier)
+    assert np.array_equal(np.sort(np.ravel_multi_index(detector.cells(), gridmap.shape)),
+                          np.flatnonzero(expected.frontier))
+
+
+def test_frontier_detector_clusters_adjacent_cells():
+    gridmap = np.zeros((20, 30))
+    gridmap[2:8, 2:8] = -1
+    gridmap[12:15, 20:28] = -1
+    gridmap[12:15, 23] = 1
+    detector = FrontierDetector(gridmap, dirty=DirtyRegions(gridmap.shape))
+
+    frontiers = detector.clusters()
+
+    assert [frontier.size for frontier in frontiers] == [20, 9, 7]
+    assert frontiers[0].centroid == pytest.approx((4.5, 4.5))
+    assert len(detector.clusters(min_size=9)) == 2
+
+    detector = FrontierDetector(gridmap, connectivity=4, dirty=DirtyRegions(gridmap.shape))
+    assert len(detector.clusters()) == 3
+
+
+def test_disjoint_sets_merge_by_union():
+    sets = DisjointSets(5)
+    sets.union(0, 1)
+    sets.union(3, 4)
+    sets.union(1, 4)
+
+    assert sets.find(0) == sets.find(3)
+    assert sets.find(2) != sets.find(0)
+    assert len(set(sets.roots())) == 2
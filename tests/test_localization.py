@@ -0,0 +1,51 @@
+"""
+Tests for the scan matching.
+"""
+import numpy as np
+import pytest
+
+from stellar.cognition import mapping
+from stellar.cognition.localization import LikelihoodField, ScanMatcher
+from stellar.models.gridmap import DirtyRegions, DistanceField
+from stellar.perception.sensors import sense_distance
+
+
+@pytest.mark.parametrize("guess", [(52, 28, np.radians(24)), (47, 33, np.radians(16))])
+def test_scan_matcher_corrects_drifted_pose(guess, room):
+    """
+    Matching the measurements of the true pose must move a drifted pose
+    back to (about) the true pose.
+    """
+    world = room
+    field = LikelihoodField(DistanceField(world, threshold=0.5,
+                                          dirty=DirtyRegions(world.shape)))
+    matcher = ScanMatcher(field)
+
+    true_pose = (50, 30, np.radians(20))
+    measurements = [(bearing, sense_distance(world, true_pose, bearing, z_max=60))
+                    for bearing in np.radians(np.arange(0, 360, 45))]
+
+    (x, y, theta), score = matcher.match(guess, measurements)
+
+    assert abs(x - true_pose[0]) <= 1 and abs(y - true_pose[1]) <= 1
+    assert theta == pytest.approx(true_pose[2], abs=np.radians(2))
+    assert score >= matcher.score([true_pose], [m for m in measurements if m[1] > 0])[0]
+
+
+def test_scan_matcher_keeps_pose_without_evidence():
+    """
+    Without sensed obstacles or map information, the pose is kept as is.
+    """
+    gridmap = np.zeros((100, 100))
+    dirty = DirtyRegions(gridmap.shape)
+    matcher = ScanMatcher(LikelihoodField(DistanceField(gridmap, dirty=dirty)))
+
+    pose = (50, 50, 1.0)
+    assert matcher.match(pose, [(0, -1), (np.pi / 2, -1)])[0] == pose
+    assert matcher.match(pose, [(0, 20)])[0] == pose
+
+    # Obstacles added to the map are picked up by the likelihood field.
+    mapping.update_occupancy_map(gridmap, (50, 50, 0), 20, 0, np.radians(15), 40,
+                                 dirty=dirty)
+    assert matcher.likelihood_field.update()
+    assert matcher.likelihood_field[50, 70] == 1
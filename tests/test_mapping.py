@@ -0,0 +1,387 @@
+"""
+Tests for the mapping algorithms.
+"""
+from math import floor
+
+import numpy as np
+import pytest
+
+from hypothesis import given, settings
+import hypothesis.strategies as some
+
+from stellar.cognition import mapping
+from stellar.perception.sensors import get_occupied_cell_from_distance
+
+
+SONAR_OPENING_ANGLE = np.radians(15)
+SONAR_BEARINGS = [np.radians(0), np.radians(90), np.radians(-90)]
+
+
+def update_per_cell(gridmap, pose, measurement, sonar_bearing_angle, z_max):
+    """
+    Reference implementation, evaluating the inverse sensor model per cell.
+    """
+    measurement = mapping.normalize_measurement(measurement, z_max)
+    gridmap[pose[1], pose[0]] -= mapping.LOG_ODD_FREE
+
+    rows, cols = mapping.sonar_window(gridmap.shape, pose, measurement,
+                                      sonar_bearing_angle, SONAR_OPENING_ANGLE, z_max)
+    for y in range(rows.start, rows.stop):
+        for x in range(cols.start, cols.stop):
+            p = mapping.inverse_range_sensor_model(
+                (x, y), pose, sonar_bearing_angle, SONAR_OPENING_ANGLE,
+                z_max, measurement)
+            if p == -1:
+                gridmap[y, x] -= mapping.LOG_ODD_FREE
+            if p == 1:
+                gridmap[y, x] += mapping.LOG_ODD_OCCU
+
+    return np.clip(gridmap, a_max=mapping.LOG_ODD_MAX, a_min=mapping.LOG_ODD_MIN)
+
+
+def inverse_range_sensor_model_original(cell, pose, relative_sensor_angle, beta, z_max, z_t):
+    """
+    The inverse sensor model before it was vectorized, verbatim.
+    """
+    alpha = 2
+    xi, yi = cell
+    xr, yr, theta_r = pose
+    sonar_theta = relative_sensor_angle
+
+    r = np.sqrt(np.square(xi-xr) + np.square(yi-yr))
+    phi = np.arctan2(yi - yr, xi - xr) - theta_r
+
+    if phi >= np.pi:
+        phi -= 2 * np.pi
+
+    elif phi <= -np.pi:
+        phi += 2 * np.pi
+
+    if r > min(z_max, z_t + alpha / 2) or (np.abs(phi - sonar_theta) > (beta / 2)):
+        return 0
+    elif (z_t < z_max) and (np.abs(r - z_t) < alpha / 2):
+        return 1
+    else:
+        return -1
+
+
+def update_per_cell_original(gridmap, pose, measurement, sonar_bearing_angle, z_max):
+    """
+    The per cell update before it was vectorized, verbatim apart from the
+    window being clipped at 0: negative indices used to wrap around to the
+    opposite side of the map.
+
+    Returns:
+        The updated map and the window (row and column slices) it covered.
+    """
+    if measurement == -1 or measurement == 0:
+        measurement = z_max
+
+    B = get_occupied_cell_from_distance(gridmap, pose, measurement + 5,
+                                        sonar_bearing_angle - np.deg2rad(10))
+    C = get_occupied_cell_from_distance(gridmap, pose, measurement + 5,
+                                        sonar_bearing_angle + np.deg2rad(10))
+    max_x = floor(max(pose[0], B[0], C[0]))
+    min_x = max(floor(min(pose[0], B[0], C[0])), 0)
+    max_y = floor(max(pose[1], B[1], C[1]))
+    min_y = max(floor(min(pose[1], B[1], C[1])), 0)
+
+    gridmap[pose[1], pose[0]] -= mapping.LOG_ODD_FREE
+    for y in range(min_y, min(max_y, gridmap.shape[0])):
+        for x in range(min_x, min(max_x, gridmap.shape[1])):
+            p = inverse_range_sensor_model_original(
+                (x, y), pose, sonar_bearing_angle, SONAR_OPENING_ANGLE, z_max, measurement)
+            if p == -1:
+                gridmap[y, x] -= mapping.LOG_ODD_FREE
+            if p == 1:
+                gridmap[y, x] += mapping.LOG_ODD_OCCU
+
+    window = (slice(min_y, max(max_y, min_y)), slice(min_x, max(max_x, min_x)))
+    return np.clip(gridmap, a_max=mapping.LOG_ODD_MAX, a_min=mapping.LOG_ODD_MIN), window
+
+
+poses = some.tuples(some.integers(min_value=0, max_value=99),
+                    some.integers(min_value=0, max_value=99),
+                    some.floats(min_value=0, max_value=2 * np.pi, exclude_max=True))
+
+
+@settings(max_examples=50, deadline=None)
+@given(poses, some.sampled_from(SONAR_BEARINGS), some.integers(min_value=-1, max_value=40))
+def test_grid_model_matches_per_cell_model(pose, bearing, measurement):
+    """
+    The vectorized inverse sensor model must agree with the per cell model.
+    """
+    z_max = 40
+    measurement = mapping.normalize_measurement(measurement, z_max)
+    xs = np.arange(pose[0] - 45, pose[0] + 45)
+    ys = np.arange(pose[1] - 45, pose[1] + 45)
+
+    cells = mapping.inverse_range_sensor_model_grid(
+        xs, ys, pose, bearing, SONAR_OPENING_ANGLE, z_max, measurement)
+
+    expected = [[mapping.inverse_range_sensor_model(
+        (x, y), pose, bearing, SONAR_OPENING_ANGLE, z_max, measurement)
+        for x in xs] for y in ys]
+
+    assert np.array_equal(cells, expected)
+
+
+@settings(max_examples=30, deadline=None)
+@given(poses, some.sampled_from(SONAR_BEARINGS), some.integers(min_value=-1, max_value=40))
+def test_update_occupancy_map_matches_per_cell_update(pose, bearing, measurement):
+    """
+    Ensure update_occupancy_map yields the same log odds as the per cell path.
+    """
+    z_max = 40
+    rng = np.random.default_rng(0)
+    gridmap = rng.uniform(mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX, (100, 100))
+
+    expected = update_per_cell(gridmap.copy(), pose, measurement, bearing, z_max)
+    updated = mapping.update_occupancy_map(
+        gridmap.copy(), pose, measurement, bearing, SONAR_OPENING_ANGLE, z_max)
+
+    assert np.array_equal(updated, expected)
+
+
+@settings(max_examples=300, deadline=None)
+@given(poses, some.sampled_from(SONAR_BEARINGS), some.integers(min_value=-1, max_value=40))
+def test_update_occupancy_map_matches_original_per_cell_update(pose, bearing, measurement):
+    """
+    Ensure update_occupancy_map yields the same log odds as the original per
+    cell loop. Accepted difference: the original window stopped short of the
+    last row and column of the cone, the cells of the cone beyond it are
+    updated now.
+    """
+    z_max = 40
+    rng = np.random.default_rng(0)
+    gridmap = rng.uniform(mapping.LOG_ODD_MIN, mapping.LOG_ODD_MAX, (100, 100))
+
+    expected, window = update_per_cell_original(gridmap.copy(), pose, measurement, bearing,
+                                                z_max)
+    updated = mapping.update_occupancy_map(
+        gridmap.copy(), pose, measurement, bearing, SONAR_OPENING_ANGLE, z_max)
+
+    tolerated = mapping.inverse_range_sensor_model_grid(
+        np.arange(100), np.arange(100), pose, bearing, SONAR_OPENING_ANGLE, z_max,
+        mapping.normalize_measurement(measurement, z_max)) != 0
+    tolerated[window] = False
+    differs = updated != expected
+    assert not (differs & ~tolerated).any()
+
+
+def test_update_occupancy_map_clips_sonar_window_to_map():
+    """
+    Cones reaching beyond the map must not wrap around to the opposite side.
+    """
+    gridmap = np.zeros((50, 50))
+    pose = (2, 2, np.radians(180))
+
+    updated = mapping.update_occupancy_map(
+        gridmap, pose, -1, 0, SONAR_OPENING_ANGLE, 40)
+
+    assert not updated[:, 10:].any()
+    assert not updated[10:, :].any()
+
+
+def test_update_occupancy_map_updates_in_place():
+    """
+    Ensure update_occupancy_map does not allocate a new map.
+    """
+    gridmap = np.zeros((100, 100))
+    updated = mapping.update_occupancy_map(
+        gridmap, (50, 50, 0), 20, 0, SONAR_OPENING_ANGLE, 40)
+
+    assert updated is gridmap
+    assert gridmap.any()
+
+
+def test_fuse_measurements_matches_sequential_updates():
+    """
+    Applying all measurements of a tick at once must yield the same map as
+    updating the map once per sonar (as long as no cell saturates).
+    """
+    pose = (50, 50, np.radians(30))
+    measurements = [(SONAR_BEARINGS[0], 20), (SONAR_BEARINGS[1], 12),
+                    (SONAR_BEARINGS[2], -1)]
+
+    expected = np.zeros((100, 100))
+    for angle, measurement in measurements:
+        mapping.update_occupancy_map(expected, pose, measurement, angle,
+                                     SONAR_OPENING_ANGLE, 40)
+
+    gridmap = np.zeros((100, 100))
+    rows, cols = mapping.fuse_measurements(gridmap, pose, measurements,
+                                           SONAR_OPENING_ANGLE, 40)
+
+    assert gridmap == pytest.approx(expected)
+
+    # Nothing outside of the returned region may have been touched.
+    outside = np.ones(gridmap.shape, dtype=bool)
+    outside[rows, cols] = False
+    assert not gridmap[outside].any()
+
+
+def test_fuse_measurements_applies_per_sonar_configuration():
+    """
+    Sonars with their own opening angle and range must update the map like
+    updating it once per sonar.
+    """
+    pose = (50, 50, np.radians(30))
+    measurements = [(SONAR_BEARINGS[0], 20), (SONAR_BEARINGS[1], -1),
+                    (SONAR_BEARINGS[2], 12)]
+    opening_angles = np.radians([15, 30, 10])
+    z_maxs = [40, 25, 15]
+
+    expected = np.zeros((100, 100))
+    for (angle, measurement), opening_angle, z_max in zip(measurements, opening_angles,
+                                                          z_maxs):
+        mapping.update_occupancy_map(expected, pose, measurement, angle,
+                                     opening_angle, z_max)
+
+    gridmap = np.zeros((100, 100))
+    mapping.fuse_measurements(gridmap, pose, measurements, opening_angles, z_maxs)
+
+    assert gridmap == pytest.approx(expected)
+
+    cache = mapping.StampCache(SONAR_OPENING_ANGLE, 40)
+    with pytest.raises(ValueError):
+        mapping.fuse_measurements(gridmap, pose, measurements, opening_angles, z_maxs,
+                                  stamp_cache=cache)
+
+
+def test_fuse_measurements_clips_updated_region():
+    """
+    Ensure the updated region stays within the log odd boundaries.
+    """
+    gridmap = np.zeros((100, 100))
+    for _ in range(20):
+        mapping.fuse_measurements(gridmap, (50, 50, 0), [(0, 20)],
+                                  SONAR_OPENING_ANGLE, 40)
+
+    assert gridmap.max() == mapping.LOG_ODD_MAX
+    assert gridmap.min() == mapping.LOG_ODD_MIN
+
+
+@settings(max_examples=100, deadline=None)
+@given(some.integers(min_value=-5, max_value=95), some.integers(min_value=-5, max_value=85),
+       some.integers(min_value=0, max_value=359),
+       some.lists(some.tuples(some.sampled_from(SONAR_BEARINGS + [np.pi]),
+                              some.integers(min_value=-1, max_value=40)),
+                  min_size=1, max_size=3))
+def test_stamp_cache_matches_inverse_sensor_model(x, y, degrees, measurements):
+    """
+    For headings and ranges on the quantization grid, stamped cones must be
+    identical to evaluating the inverse sensor model.
+    """
+    pose = (x, y, np.radians(degrees))
+    cache = mapping.StampCache(SONAR_OPENING_ANGLE, 40)
+
+    expected = np.zeros((80, 90))
+    mapping.fuse_measurements(expected, pose, measurements,
+                              SONAR_OPENING_ANGLE, 40)
+    gridmap = np.zeros((80, 90))
+    mapping.fuse_measurements(gridmap, pose, measurements,
+                              SONAR_OPENING_ANGLE, 40, stamp_cache=cache)
+
+    assert np.array_equal(gridmap, expected)
+
+
+@pytest.mark.parametrize("opening_angle", np.radians([5, 15, 30, 90, 200]))
+def test_sonar_window_covers_cone(opening_angle):
+    """
+    The window must cover every cell updated by the inverse sensor model.
+    """
+    for degrees in range(0, 360, 7):
+        pose = (50, 50, np.radians(degrees))
+        for measurement in [2, 5, 20, 39, 40]:
+            xs = ys = np.arange(0, 100)
+            cells = mapping.inverse_range_sensor_model_grid(
+                xs, ys, pose, np.pi / 2, opening_angle, 40, measurement)
+            rows, cols = mapping.sonar_window(cells.shape, pose, measurement, np.pi / 2,
+                                              opening_angle, 40)
+
+            outside = np.ones(cells.shape, dtype=bool)
+            outside[rows, cols] = False
+            assert not cells[outside].any()
+
+
+def test_stamp_cache_counts_hits_and_evicts_least_recently_used():
+    """
+    Ensure the stamp cache keeps track of hits and misses and respects its
+    memory limit.
+    """
+    cache = mapping.StampCache(SONAR_OPENING_ANGLE, 40)
+    first = cache.lookup(0, 20)
+    assert cache.lookup(np.radians(0.2), 20.3) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache = mapping.StampCache(SONAR_OPENING_ANGLE, 40,
+                               max_bytes=first.cells.nbytes)
+    cache.lookup(0, 20)
+    cache.lookup(np.pi, 20)
+    assert len(cache) == 1
+    assert cache.evictions == 1
+    assert cache.nbytes <= first.cells.nbytes
+
+    cache.lookup(0, 20)
+    assert cache.misses == 3
+
+
+@pytest.mark.parametrize("measurement", [10, 25, -1])
+def test_beam_model_agrees_with_cone_model(measurement):
+    """
+    Cells traversed by the rays of the beam model must be classified as by
+    the cone model, and the beam model must cover most of the cone.
+    """
+    pose = (100, 100, np.radians(30))
+    measurements = [(bearing, measurement) for bearing in SONAR_BEARINGS]
+
+    cone = np.zeros((200, 200))
+    mapping.fuse_measurements(cone, pose, measurements, SONAR_OPENING_ANGLE, 40)
+    beam = np.zeros((200, 200))
+    mapping.fuse_measurements(beam, pose, measurements, SONAR_OPENING_ANGLE, 40,
+                              model='beam')
+
+    both = (cone != 0) & (beam != 0)
+    assert np.array_equal(np.sign(cone[both]), np.sign(beam[both]))
+    assert both.sum() >= 0.9 * (cone != 0).sum()
+
+
+def test_beam_model_marks_obstacle_at_measured_distance():
+    gridmap = np.zeros((100, 100))
+    mapping.update_occupancy_map(gridmap, (10, 50, 0), 30, 0,
+                                 SONAR_OPENING_ANGLE, 40, model='beam')
+
+    assert gridmap[50, 40] == mapping.LOG_ODD_OCCU
+    assert np.all(gridmap[50, 11:39] == -mapping.LOG_ODD_FREE)
+    assert not gridmap[:, 42:].any()
+
+
+def test_connect_pylons_matches_bresenham_lines():
+    """
+    Pylons are connected by Bresenham lines, thickened by one cell to the
+    right and to the top.
+    """
+    from bresenham import bresenham
+
+    pylons = [(50, 75), (75, 150), (150, 150), (100, 75), (60, 50)]
+    expected = np.zeros((200, 200))
+    for (x1, y1), (x2, y2) in zip(pylons, pylons[1:] + pylons[:1]):
+        for x, y in bresenham(x1, y1, x2, y2):
+            expected[y, x] = expected[y + 1, x] = expected[y, x + 1] = mapping.LOG_ODD_MAX
+
+    gridmap = mapping.connect_pylons(pylons, np.zeros((200, 200)))
+
+    assert np.array_equal(gridmap, expected)
+
+
+def test_connect_pylons_clips_lines_to_map():
+    """
+    Lines reaching beyond the map must be clipped to the map.
+    """
+    gridmap = mapping.connect_pylons([(-10, 5), (60, 5)], np.zeros((50, 50)),
+                                     thickness=3)
+
+    assert np.all(gridmap[5:8, :] == mapping.LOG_ODD_MAX)
+    assert not gridmap[8:, :].any()
+    assert not gridmap[:5, :].any()
@@ -0,0 +1,73 @@
+"""
+Tests for building maps from recorded drives.
+"""
+import numpy as np
+
+from stellar.cognition import mapping
+from stellar.cognition.offline_mapping import build_map
+
+
+SONAR_OPENING_ANGLE = np.radians(15)
+SONAR_BEARINGS = np.radians([0, 90, -90])
+
+
+def recorded_drive(ticks=60, seed=0):
+    rng = np.random.default_rng(seed)
+    poses = np.column_stack([rng.integers(20, 180, ticks),
+                             rng.integers(20, 180, ticks),
+                             rng.uniform(0, 2 * np.pi, ticks)])
+    measurements = rng.integers(-1, 40, (ticks, len(SONAR_BEARINGS)))
+    return poses, measurements
+
+
+def test_sharded_build_matches_serial_build_exactly():
+    """
+    The map must not depend on how the drive is split across workers.
+    """
+    poses, measurements = recorded_drive()
+
+    serial = build_map((200, 200), poses, measurements, SONAR_BEARINGS,
+                       SONAR_OPENING_ANGLE, 40, workers=1)
+    sharded = build_map((200, 200), poses, measurements, SONAR_BEARINGS,
+                        SONAR_OPENING_ANGLE, 40, workers=3)
+
+    assert np.array_equal(serial, sharded)
+    assert serial.any()
+
+
+def test_sharded_build_of_a_drive_across_the_map_matches_serial_build():
+    """
+    Shards of a continuous drive only count the cells within their reach,
+    including drives along and beyond the edges of the map.
+    """
+    ticks = 400
+    t = np.linspace(0, 1, ticks)
+    poses = np.column_stack([-10 + 220 * t, 100 + 95 * np.sin(6 * t), 6 * t % (2 * np.pi)])
+    measurements = np.random.default_rng(0).integers(-1, 40, (ticks, len(SONAR_BEARINGS)))
+
+    serial = build_map((200, 200), poses, measurements, SONAR_BEARINGS,
+                       SONAR_OPENING_ANGLE, 40, workers=1)
+    sharded = build_map((200, 200), poses, measurements, SONAR_BEARINGS,
+                        SONAR_OPENING_ANGLE, 40, workers=8)
+
+    assert np.array_equal(serial, sharded)
+
+
+def test_build_matches_online_mapping_without_saturation():
+    """
+    As long as no cell saturates, the offline map matches the map built
+    tick by tick. Over longer drives the maps diverge: online, the log odds
+    are clipped after every tick, offline only once at the end.
+    """
+    poses, measurements = recorded_drive(ticks=3)
+
+    expected = np.zeros((200, 200))
+    for pose, distances in zip(poses, measurements):
+        mapping.fuse_measurements(expected, (int(pose[0]), int(pose[1]), pose[2]),
+                                  list(zip(SONAR_BEARINGS, distances)),
+                                  SONAR_OPENING_ANGLE, 40)
+
+    gridmap = build_map((200, 200), poses, measurements, SONAR_BEARINGS,
+                        SONAR_OPENING_ANGLE, 40, workers=2)
+
+    assert np.allclose(gridmap, expected)
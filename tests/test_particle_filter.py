@@ -0,0 +1,72 @@
+"""
+Tests for the Monte Carlo localization.
+"""
+import numpy as np
+import pytest
+
+from stellar.cognition.particle_filter import ParticleFilter
+from stellar.models.robot import Robot
+from stellar.perception.sensors import SensorArray
+
+
+def test_expected_ranges_hit_walls(room):
+    world = room
+    pf = ParticleFilter(world, [0, np.pi / 2, -np.pi / 2], 40, count=3)
+    pf.states[:] = np.array([[55.5, 50.5, 0], [90.5, 75.5, np.pi / 2],
+                             [50.5, 85.5, 0]]).T
+
+    ranges = pf.expected_ranges()
+
+    assert ranges[0] == pytest.approx([15, -1, -1])
+    assert ranges[1] == pytest.approx([19, -1, 24])
+    assert ranges[2] == pytest.approx([-1, 9, -1])
+
+
+def test_particles_outside_free_cells_get_no_weight(room):
+    world = room
+    pf = ParticleFilter(world, [0], 40, count=4)
+    # Free, within the pillar, on a wall and outside the map
+    pf.states[:] = np.array([[50.5, 50.5, 0], [72.5, 50.5, 0], [5.5, 50.5, 0],
+                             [-3.5, 50.5, 0]]).T
+
+    pf.sense([(0, 20)])
+
+    assert pf.weights[0] == 1
+    assert pf.weights[1:].tolist() == [0, 0, 0]
+
+
+def test_low_variance_resampling_keeps_proportions():
+    pf = ParticleFilter(np.zeros((10, 10)), [0], 5, count=1000,
+                        rng=np.random.default_rng(0))
+    pf.x[:] = np.arange(1000) // 250
+    pf.weights[:] = np.where(pf.x == 0, 0.7 / 250, 0.3 / 750)
+
+    pf.resample()
+
+    assert np.count_nonzero(pf.x == 0) == 700
+    assert np.count_nonzero(pf.x == 3) == 100
+    assert np.all(pf.weights == 1 / 1000)
+
+
+def test_particle_filter_tracks_moving_robot(room):
+    """
+    Starting from a rough initial guess, the estimate must follow the robot.
+    """
+    world = room
+    sensors = SensorArray(40)
+    pf = ParticleFilter(world, sensors.bearings, sensors.z_max, count=2000,
+                        rng=np.random.default_rng(0))
+
+    robot = Robot()
+    robot.set(20, 30, np.radians(10))
+    pf.initialize((22, 28, np.radians(15)), spread=(3, 3, np.radians(10)))
+
+    for _ in range(30):
+        robot.move(1.0, np.radians(1))
+        pf.move(1.0, np.radians(1))
+        pf.sense(sensors.sense(world, robot.pose_in_grid(1.0)))
+        pf.resample()
+
+    x, y, theta = pf.estimate()
+    assert np.hypot(x - robot.x, y - robot.y) < 2
+    assert abs(np.angle(np.exp(1j * (theta - robot.theta)))) < np.radians(5)
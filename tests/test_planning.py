@@ -0,0 +1,27 @@
+"""
+Tests for path planning.
+"""
+import numpy as np
+
+from stellar.cognition.planning import AStarPlanner
+
+
+def test_is_blocked_only_if_changes_occupy_path():
+    """
+    A path is blocked if an occupied cell within the changed regions is part
+    of the path.
+    """
+    occupancy_grid_map = np.zeros((50, 50))
+    path = [(x, 10) for x in range(40)]
+    planner = AStarPlanner()
+
+    occupancy_grid_map[30, 5] = 1.0
+    assert not planner.is_blocked(occupancy_grid_map, path,
+                                  [(slice(0, 50), slice(0, 50))])
+
+    occupancy_grid_map[10, 20] = 1.0
+    assert not planner.is_blocked(occupancy_grid_map, path,
+                                  [(slice(0, 16), slice(0, 16))])
+    assert planner.is_blocked(occupancy_grid_map, path,
+                              [(slice(0, 16), slice(0, 16)),
+                               (slice(0, 16), slice(16, 32))])
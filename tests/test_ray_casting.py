@@ -0,0 +1,196 @@
+"""
+Tests for the ray casting of the simulated sensors.
+"""
+import numpy as np
+import pytest
+
+from hypothesis import HealthCheck, given, settings
+import hypothesis.strategies as some
+
+from stellar.models.gridmap import TiledGridMap
+from stellar.perception.sensors import (RayOffsetTable, SensorArray, SonarSensor, cast_rays,
+                                       distance_transform, sense_distance,
+                                       sphere_trace_rays)
+
+
+def cast_by_sampling(world, x, y, angle, z_max, step=1e-3):
+    """
+    Reference implementation, sampling the ray densely.
+    """
+    for t in np.arange(0, z_max, step):
+        cx = int(np.floor(x + t * np.cos(angle) + 0.5))
+        cy = int(np.floor(y + t * np.sin(angle) + 0.5))
+        if not (0 <= cx < world.shape[1] and 0 <= cy < world.shape[0]):
+            return -1
+        if world[cy, cx] > 0.5:
+            return np.hypot(cx - x, cy - y)
+    return -1
+
+
+def test_sensor_array_matches_sense_distance_along_axes(room):
+    """
+    Along the axes, the cells traversed by Bresenham lines and by the DDA
+    are the same.
+    """
+    world = room
+    sensors = SensorArray(40)
+
+    for pose in [(50, 50, 0), (30, 20, 0), (100, 80, 0), (90, 30, 0)]:
+        expected = [sense_distance(world, pose, angle, z_max=40)
+                    for angle in sensors.bearings]
+        assert sensors.sense(world, pose)[:, 1] == pytest.approx(expected)
+
+
+@settings(max_examples=50, deadline=None,
+          suppress_health_check=[HealthCheck.function_scoped_fixture])
+@given(some.floats(min_value=-10, max_value=130), some.floats(min_value=-10, max_value=110),
+       some.floats(min_value=0, max_value=2 * np.pi), some.integers(min_value=1, max_value=60))
+def test_cast_rays_matches_dense_sampling(room, x, y, angle, z_max):
+    """
+    The DDA must find the same first obstacle as sampling the ray densely.
+    """
+    world = room.copy()
+    rng = np.random.default_rng(0)
+    world[rng.random(world.shape) > 0.98] = 1
+
+    expected = cast_by_sampling(world, x, y, angle, z_max)
+    assert cast_rays(world, x, y, angle, z_max=z_max) == pytest.approx(expected, abs=1e-6)
+
+
+def test_cast_rays_misses_when_leaving_the_world():
+    world = np.zeros((10, 10))
+    world[5, 9] = 1
+
+    ranges = cast_rays(world, [5, 5, -3, 5], [5, 5, 5, 5], [0, np.pi, 0, 0],
+                       z_max=[40, 40, 40, 3])
+
+    assert ranges.tolist() == [4, -1, -1, -1]
+
+
+def test_cast_rays_broadcasts_poses_and_angles(room):
+    world = room
+    angles = np.radians([0, 90, 180])
+    ranges = cast_rays(world, np.array([[50], [60]]), 50, angles, z_max=60)
+
+    assert ranges.shape == (2, 3)
+    assert ranges[0] == pytest.approx([20, 44, 45])
+    assert ranges[1] == pytest.approx([10, 44, 55])
+
+
+def test_ray_offset_table_matches_cast_rays_on_quantized_headings(room):
+    """
+    From cell centers and along quantized headings, the table must traverse
+    the same cells as the DDA.
+    """
+    rng = np.random.default_rng(0)
+    world = room
+    world[rng.random(world.shape) > 0.98] = 1
+    table = RayOffsetTable(world, 40)
+
+    xs = rng.integers(-5, 125, 10000)
+    ys = rng.integers(-5, 105, 10000)
+    angles = np.radians(rng.integers(0, 360, 10000))
+
+    assert np.array_equal(table.cast(xs, ys, angles),
+                          cast_rays(world, xs, ys, angles, z_max=40))
+
+
+@pytest.mark.parametrize("sonar_sensors", [
+    None,
+    [SonarSensor('front', 0, np.radians(15), 40), SonarSensor('rear', np.pi, np.radians(30), 13.5),
+     SonarSensor('left', np.pi / 2, np.radians(15), 25)],
+])
+def test_sensor_array_ray_casting_modes_agree(sonar_sensors, room):
+    """
+    From cell centers and along quantized headings, all ray casting modes
+    must sense the same distances, also for sensors of shorter range.
+    """
+    rng = np.random.default_rng(0)
+    world = room
+    world[rng.random(world.shape) > 0.98] = 1
+    sensors = {mode: SensorArray(40, ray_casting=mode, sonar_sensors=sonar_sensors)
+               for mode in SensorArray.ray_casting_modes}
+
+    for x, y, degrees in zip(rng.integers(0, 120, 500), rng.integers(0, 100, 500),
+                             rng.integers(0, 360, 500)):
+        pose = (x, y, np.radians(degrees))
+        expected = sensors['dda'].sense(world, pose)
+        for mode in ['table', 'sphere']:
+            assert np.array_equal(sensors[mode].sense(world, pose), expected), (mode, pose)
+
+
+@pytest.mark.parametrize("density", [0.9, 0.99, 0.999])
+def test_sphere_tracing_matches_cast_rays(density, room):
+    """
+    Jumping through free space must not skip any obstacle.
+    """
+    rng = np.random.default_rng(0)
+    world = room
+    world[rng.random(world.shape) > density] = 1
+    distances = distance_transform(world, max_distance=60)
+
+    xs = rng.uniform(-5, 125, 10000)
+    ys = rng.uniform(-5, 105, 10000)
+    angles = rng.uniform(0, 2 * np.pi, 10000)
+
+    assert np.array_equal(sphere_trace_rays(world, distances, xs, ys, angles, z_max=60),
+                          cast_rays(world, xs, ys, angles, z_max=60))
+
+
+def test_sense_distance_and_sensor_array_sphere_trace(room):
+    world = room
+    distances = distance_transform(world)
+
+    assert sense_distance(world, (50, 50, 0), np.pi, z_max=60, distances=distances) == 45
+    assert sense_distance(world, (50, 50, 0), 0, z_max=10, distances=distances) == -1
+
+    sensors = SensorArray(40, ray_casting='sphere')
+    for pose in [(50, 50, 0), (30, 20, np.radians(33)), (100, 80, np.radians(271))]:
+        assert np.array_equal(sensors.sense(world, pose), SensorArray(40).sense(world, pose))
+
+    with pytest.raises(ValueError):
+        SensorArray(40, ray_casting='bresenham')
+
+
+@pytest.mark.parametrize("ray_casting", SensorArray.ray_casting_modes)
+def test_sensor_array_senses_with_configured_sonars(ray_casting, room):
+    """
+    Each sonar senses along its own bearing and up to its own range.
+    """
+    world = room
+    sonars = [SonarSensor('front', 0, np.radians(15), 60),
+              SonarSensor('rear', np.pi, np.radians(30), 20),
+              SonarSensor('left', np.pi / 2, np.radians(15), 60),
+              SonarSensor('right', -np.pi / 2, np.radians(15), 60)]
+    sensors = SensorArray(ray_casting=ray_casting, sonar_sensors=sonars)
+
+    measurements = sensors.sense(world, (50, 50, 0))
+
+    assert measurements.shape == (4, 2)
+    assert measurements.flags.c_contiguous
+    assert measurements[:, 1] == pytest.approx([20, -1, 44, 45])
+    for (bearing, distance), sonar in zip(measurements, sonars):
+        assert bearing == sonar.bearing
+
+
+def test_ray_casting_reads_tiled_worlds_per_cell():
+    """
+    Casting through a tiled world, whose absent tiles read as free, must
+    match casting through the dense world.
+    """
+    rng = np.random.default_rng(0)
+    world = np.zeros((100, 120))
+    world[40:60, 70:75] = 1
+    world[rng.random(world.shape) > 0.995] = 1
+    tiled = TiledGridMap(world.shape, tile_size=16)
+    for i, j in zip(*np.nonzero(world)):
+        tiled[i, j] = world[i, j]
+
+    xs = rng.integers(-5, 125, 5000)
+    ys = rng.integers(-5, 105, 5000)
+    angles = np.radians(rng.integers(0, 360, 5000))
+
+    expected = cast_rays(world, xs, ys, angles, z_max=40)
+    assert np.array_equal(cast_rays(tiled, xs, ys, angles, z_max=40), expected)
+    assert np.array_equal(RayOffsetTable(tiled, 40).cast(xs, ys, angles), expected)
+    assert np.array_equal(distance_transform(tiled), distance_transform(world))
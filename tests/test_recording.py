@@ -0,0 +1,104 @@
+"""
+Tests for recording and replaying sensor signals.
+"""
+import io
+import queue
+import struct
+
+import pytest
+
+from stellar.perception.recording import (CAMERA, SENSORS, LogReader, Recorder,
+                                          camera_reference)
+from stellar.perception.sourcing import Sensors, StreamDecoder
+
+
+def frame(values, fmt="=ffffii"):
+    return b'\x00' + struct.pack(fmt, *values) + b'\x01'
+
+
+def test_recording_seeks_time_windows(tmp_path):
+    with Recorder(tmp_path / 'drive') as recorder:
+        for i in range(100):
+            recorder.record(bytes([i]) * (i % 7), timestamp=i * 0.1)
+            if i % 10 == 0:
+                recorder.record_camera('drive.mp4', i // 10, timestamp=i * 0.1)
+
+    with LogReader(tmp_path / 'drive') as reader:
+        assert len(reader) == 110
+        assert reader.span() == (0, pytest.approx(9.9))
+
+        entries = list(reader.window(2.05, 3.05, SENSORS))
+        assert [entry.timestamp for entry in entries] == pytest.approx(
+            [0.1 * i for i in range(21, 31)])
+        assert [bytes(entry.payload) for entry in entries] == [
+            bytes([i]) * (i % 7) for i in range(21, 31)]
+
+        cameras = [camera_reference(entry.payload) for entry in reader.window(kind=CAMERA)]
+        assert cameras == [('drive.mp4', i) for i in range(10)]
+        del entries
+
+
+def test_recorder_appends_to_existing_recording(tmp_path):
+    with Recorder(tmp_path / 'drive') as recorder:
+        recorder.record(b'a', timestamp=1)
+
+    with Recorder(tmp_path / 'drive') as recorder:
+        with pytest.raises(ValueError):
+            recorder.record(b'b', timestamp=0.5)
+        recorder.record(b'b', timestamp=2)
+
+    with LogReader(tmp_path / 'drive') as reader:
+        assert [bytes(entry.payload) for entry in reader.window()] == [b'a', b'b']
+
+
+def test_log_reader_ignores_incomplete_entries(tmp_path):
+    with Recorder(tmp_path / 'drive') as recorder:
+        recorder.record(b'complete', timestamp=1)
+        recorder.record(b'incomplete', timestamp=2)
+
+    log = tmp_path / 'drive.log'
+    log.write_bytes(log.read_bytes()[:-3])
+
+    with LogReader(tmp_path / 'drive') as reader:
+        assert len(reader) == 1
+
+    log.write_bytes(b'not a recording')
+    with pytest.raises(ValueError):
+        LogReader(tmp_path / 'drive')
+
+
+def test_log_reader_reads_empty_recordings(tmp_path):
+    Recorder(tmp_path / 'drive').close()
+
+    with LogReader(tmp_path / 'drive') as reader:
+        assert len(reader) == 0
+        assert reader.span() is None
+        assert list(reader.window()) == []
+
+    for content in [b'', b'STL']:
+        (tmp_path / 'drive.log').write_bytes(content)
+        with pytest.raises(ValueError, match='too short'):
+            LogReader(tmp_path / 'drive')
+
+
+def test_replay_decodes_recorded_sensor_signals(tmp_path):
+    """
+    Signals recorded while reading must decode to the same records.
+    """
+    records = [(0.1, 0.2, 0.3, 0.4, i, 3) for i in range(20)]
+    stream = b''.join(frame(values) for values in records)
+    clock = iter(range(1000)).__next__
+
+    with Recorder(tmp_path / 'drive', clock=clock) as recorder:
+        sensors = Sensors(io.BytesIO(stream), queue.Queue(), read_size=11, recorder=recorder)
+        while sensors.read():
+            pass
+
+    with LogReader(tmp_path / 'drive') as reader:
+        replayed = list(reader.replay(StreamDecoder(message_size=None)))
+        assert [values[4] for _, values in replayed] == list(range(20))
+
+        # Seeking into the middle of the stream, the decoder resyncs on
+        # records 3 (bytes 78 to 104) and 4, which is completed at time 11.
+        replayed = list(reader.replay(StreamDecoder(message_size=None), 7, 13))
+        assert [(timestamp, values[4]) for timestamp, values in replayed] == [(11, 3), (11, 4)]
@@ -7,7 +7,29 @@ import struct
 import pytest
 import numpy as np
 
-from stellar.perception.sourcing import decode_blob, combine_messages, Sensors
+from stellar.perception.sourcing import (decode_blob, combine_messages, Sensors, StreamDecoder,
+                                        decode_records, format_to_dtype, load_records,
+                                        RecordQueue, SensorReader, Schema, SchemaRegistry,
+                                        SCHEMAS, TINYK22, record_type)
+
+
+# Hypothetical record layout with a version byte, which the firmware does
+# not send yet: sonar ranges, heading, motor and steering values.
+TINYK22_V1 = Schema('tinyk22', 1, [
+    ('front', 'f'), ('outter', 'f'), ('inner', 'f'), ('heading', 'f'),
+    ('motor', 'i'), ('steering', 'i'),
+])
+
+
+def frame(values, fmt="=ffffii", message_size=8):
+    """
+    Splits a record into UART messages.
+    """
+    payload = struct.pack(fmt, *values)
+    payload += bytes(-len(payload) % message_size)
+    chunks = [payload[i:i + message_size] for i in range(0, len(payload), message_size)]
+    return b''.join(bytes([i == 0]) + chunk + bytes([i == len(chunks) - 1])
+                    for i, chunk in enumerate(chunks))
 
 
 def test_decode_blob_should_decode_sensor_data_into_correct_types():
@@ -64,6 +86,225 @@ def test_should_reassemble_fragmented_uart_messages_with_multiple_types():
     assert decode_blob(databuffer) == pytest.approx(values, 0.001)
 
 
+@pytest.mark.parametrize("message_size", [8, 3, 24])
+def test_stream_decoder_decodes_records_from_arbitrary_chunks(message_size):
+    """
+    Records must be decoded regardless of how the stream is chunked, and of
+    fields spanning messages.
+    """
+    records = [(0.5 * i, 0.25, -1.0, 2.0, i, -i) for i in range(50)]
+    stream = b''.join(frame(values, message_size=message_size) for values in records)
+
+    for size in [1, 3, 7, 30, 31, len(stream)]:
+        decoder = StreamDecoder(message_size=message_size, capacity=64)
+        decoded = [values for i in range(0, len(stream), size)
+                   for values in decoder.decode(stream[i:i + size])]
+        assert decoded == records
+        assert len(decoder) == 0
+        assert decoder.decode_errors == 0
+
+
+def test_stream_decoder_buffers_chunks_before_iterating():
+    """
+    Chunks must be buffered even if their records are not iterated, also
+    chunks larger than the buffer.
+    """
+    records = [(0.5 * i, 0.25, -1.0, 2.0, i, -i) for i in range(50)]
+    stream = b''.join(frame(values) for values in records)
+    decoder = StreamDecoder(capacity=64)
+
+    decoder.decode(stream[:10])
+    decoder.decode(stream[10:])
+
+    assert len(decoder) == len(stream)
+    assert list(decoder.decode(b'')) == records
+
+    with pytest.raises(ValueError, match='pad bytes'):
+        StreamDecoder("=xffffiix")
+    with pytest.raises(ValueError, match='pad bytes'):
+        Sensors(io.BytesIO(), queue.Queue(), "=xffffiix")
+
+
+def test_stream_decoder_resyncs_after_corrupt_bytes():
+    """
+    Corrupt bytes must be skipped, the records around them decoded.
+    """
+    records = [(0.5 * i, 0.25, -1.0, 2.0, i, -i) for i in range(5)]
+    corrupt = bytearray(frame(records[2]))
+    corrupt[9] = 0x07
+    stream = (b'\xff\x13' + frame(records[0]) + frame(records[1]) + bytes(corrupt)
+              + frame(records[3]) + frame(records[4])[:-1])
+
+    decoder = StreamDecoder()
+
+    assert list(decoder.decode(stream)) == records[:2]
+    assert decoder.decode_errors == 2
+    assert decoder.skipped_bytes == 2 + len(corrupt)
+    assert len(decoder) == 2 * len(corrupt) - 1
+    assert list(decoder.decode(b'\x01')) == records[3:]
+
+
+@pytest.mark.parametrize("fmt", ["=xffffiix", "=ffffii", "<bhq?3sxe", ">Hd2xc", "bid", "@hlbq"])
+def test_decode_records_matches_struct(fmt):
+    """
+    Bulk decoding must decode the same values as unpacking record by record.
+    """
+    rng = np.random.default_rng(0)
+    size = struct.calcsize(fmt)
+    blob = rng.integers(0, 256, 10 * size + 3, dtype=np.uint8).tobytes()
+
+    records = decode_records(blob, fmt)
+
+    assert records.dtype.itemsize == size
+    assert len(records) == 10
+    for record, values in zip(records, struct.iter_unpack(fmt, blob[:10 * size])):
+        for decoded, value in zip(record.tolist(), values):
+            assert decoded == value or (np.isnan(decoded) and np.isnan(value))
+
+
+def test_decode_records_returns_named_views(tmp_path):
+    names = ['x', 'y', 'theta', 'distance', 'left', 'right']
+    values = [(0.5 * i, 0.25, -1.0, 2.0, i, -i) for i in range(100)]
+    blob = b''.join(struct.pack("=xffffiix", *record) for record in values)
+
+    records = decode_records(blob, "=xffffiix", names)
+
+    assert not records.flags.owndata
+    assert records['x'].base is not None
+    assert records['left'].tolist() == list(range(100))
+    assert records['x'] == pytest.approx([0.5 * i for i in range(100)])
+
+    log = tmp_path / 'sensors.log'
+    log.write_bytes(blob[:-1])
+    loaded = load_records(log, "=xffffiix", names)
+    assert isinstance(loaded, np.memmap)
+    assert len(loaded) == 99
+    assert loaded['right'].tolist() == [-i for i in range(99)]
+
+    with pytest.raises(ValueError):
+        format_to_dtype("=ffffii", names[:2])
+    with pytest.raises(ValueError):
+        format_to_dtype("=fp")
+
+
+@pytest.mark.parametrize("policy, expected, drops", [
+    ('drop-oldest', [2, 3, 4], 2),
+    ('latest-only', [4], 4),
+])
+def test_record_queue_drops_records_when_full(policy, expected, drops):
+    records = RecordQueue(3, policy)
+    for i in range(5):
+        records.put(i)
+
+    assert records.drain() == expected
+    assert records.drops == drops
+    assert records.max_depth == len(expected)
+    with pytest.raises(queue.Empty):
+        records.get(timeout=0.01)
+
+
+def test_record_queue_blocks_when_full():
+    records = RecordQueue(2, 'block')
+    records.put(0)
+    records.put(1)
+
+    with pytest.raises(queue.Full):
+        records.put(2, timeout=0.01)
+    assert records.get() == 0
+    records.put(2)
+    assert records.drain() == [1, 2]
+    assert records.drops == 0
+
+    records.close()
+    assert not records.put(3)
+
+    with pytest.raises(ValueError):
+        RecordQueue(2, 'drop-newest')
+
+
+def test_schema_decodes_named_records():
+    blob = TINYK22_V1.encode(0.5, 1.5, 2.5, 0.25, 800, -45)
+
+    record = decode_blob(blob, schema=TINYK22_V1)
+
+    assert record.motor == 800 and record.steering == -45
+    assert tuple(record) == (0.5, 1.5, 2.5, 0.25, 800, -45)
+    assert record == TINYK22_V1.decode(b'xx' + blob, offset=2)
+    assert not hasattr(record, '__dict__')
+    assert record._asdict()['heading'] == 0.25
+
+    with pytest.raises(ValueError):
+        decode_blob(blob[:-1], schema=TINYK22_V1)
+    with pytest.raises(ValueError):
+        TINYK22_V1.decode(b'\x02' + blob[1:])
+
+
+def test_schema_registry_selects_version_by_first_byte():
+    registry = SchemaRegistry()
+    v1 = registry.register(Schema('odometry', 1, [('distance', 'f')]))
+    v2 = registry.register(Schema('odometry', 2, [('distance', 'f'), ('direction', 'h')]))
+
+    assert registry.get('odometry') is v2
+    assert registry.get('odometry', 1) is v1
+    assert registry.decode('odometry', v1.encode(0.5)).distance == 0.5
+    assert registry.decode('odometry', v2.encode(0.5, -3)).direction == -3
+
+    with pytest.raises(ValueError):
+        registry.register(Schema('odometry', 1, [('distance', 'd')]))
+    with pytest.raises(ValueError):
+        registry.register(Schema('odometry', 1, [('range', 'f')]))
+    assert registry.register(v1) is registry.get('odometry', 1)
+    with pytest.raises(ValueError):
+        registry.get('sonar')
+    with pytest.raises(ValueError):
+        Schema('sonar', 1, [('ranges', '3f')])
+    with pytest.raises(ValueError):
+        Schema('sonar', 1, [('_range', 'f')])
+    with pytest.raises(ValueError):
+        Schema('sonar', 1, [('class', 'f')])
+
+    record = Schema('pose', 1, [('self', 'f'), ('values', 'f')]).record(1.0, 2.0)
+    assert (record.self, record.values) == (1.0, 2.0)
+
+
+def test_tinyk22_schema_has_no_version_byte():
+    values = (0.5, 1.5, 2.5, 0.25, 800, -45)
+    blob = struct.pack("=ffffii", *values)
+
+    assert SCHEMAS.get('tinyk22') is TINYK22
+    assert TINYK22.encode(*values) == blob
+    assert decode_blob(blob, schema=TINYK22).steering == -45
+    assert TINYK22.decode_all(blob * 3)['motor'].tolist() == [800] * 3
+
+    registry = SchemaRegistry()
+    registry.register(TINYK22)
+    assert registry.get('tinyk22') is TINYK22
+    assert registry.register(TINYK22_V1) is registry.get('tinyk22')
+
+
+def test_record_type_rejects_invalid_field_names():
+    for fields in [['range', 'class'], ['range', '_range'], ['range', 'x-y'],
+                   ['range', 'range'], ['range', 'x):\n    pass\n#']]:
+        with pytest.raises(ValueError):
+            record_type('SonarRecord', fields)
+
+
+def test_schema_decodes_all_records_and_streams():
+    values = [(0.5 * i, 0.25, -1.0, 2.0, i, -i) for i in range(20)]
+    blob = b''.join(TINYK22_V1.encode(*record) for record in values)
+
+    records = TINYK22_V1.decode_all(blob)
+    assert records['motor'].tolist() == list(range(20))
+    with pytest.raises(ValueError):
+        TINYK22_V1.decode_all(b'\x00' + blob[1:])
+
+    decoder = StreamDecoder(message_size=None, schema=TINYK22_V1)
+    stream = b''.join(b'\x00' + TINYK22_V1.encode(*record) + b'\x01' for record in values)
+    decoded = list(decoder.decode(stream))
+    assert [tuple(record) for record in decoded] == pytest.approx(values)
+    assert decoded[3].steering == -3
+
+
 class TestSensorIntegration(object):
     """
     Ensure sensor signals can be retrieved from other components.
@@ -84,3 +325,44 @@ class TestSensorIntegration(object):
         decoded_values = outqueue.get()
 
         assert values == pytest.approx(decoded_values, 0.1)
+        assert decoded_values.motor == 2 and decoded_values.steering == 3
+
+    def test_should_decode_records_spanning_reads(self):
+        """
+        Ensure Sensors decodes records fragmented over multiple reads.
+        """
+        outqueue = queue.Queue()
+        records = [(0.1, 0.2, 0.3, 0.4, i, 3) for i in range(3)]
+        stream = b''.join(frame(values) for values in records)
+
+        s = Sensors(io.BytesIO(stream), outqueue, message_size=8, read_size=7)
+        while not outqueue.qsize() == len(records):
+            s.read()
+
+        for values in records:
+            assert outqueue.get() == pytest.approx(values)
+
+    @pytest.mark.parametrize("policy", ['drop-oldest', 'block'])
+    def test_sensor_reader_decodes_in_background(self, policy):
+        """
+        Ensure SensorReader decodes all records of the device and counts
+        corrupt bytes.
+        """
+        records = [(0.1, 0.2, 0.3, 0.4, i, 3) for i in range(100)]
+        stream = b'\x07' + b''.join(frame(values) for values in records)
+
+        reader = SensorReader(io.BytesIO(stream), message_size=8, read_size=64,
+                              maxsize=8, policy=policy).start()
+        decoded = []
+        while len(decoded) + reader.drops < len(records):
+            decoded.append(reader.records.get(timeout=1))
+        reader.stop(timeout=1)
+
+        stats = reader.stats()
+        assert not reader.thread.is_alive()
+        assert stats['decode_errors'] == 1
+        assert stats['skipped_bytes'] == 1
+        assert stats['max_depth'] <= 8
+        indices = [values[4] for values in decoded]
+        assert indices == sorted(indices) and indices[-1] == 99
+        assert len(decoded) == (100 - reader.drops if policy == 'drop-oldest' else 100)